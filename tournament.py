@@ -5,26 +5,1301 @@
 
 # Extra credits attempted: allow ties; allow multiple tournaments.
 
-import psycopg2
-from bleach import clean
+import csv
+import json
+import os
+import re
+import select
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import islice
+from StringIO import StringIO
+
+try:
+    import psycopg2
+    from psycopg2 import extensions, pool
+except ImportError:
+    # only PostgresStore needs psycopg2; SQLiteStore works without it.
+    psycopg2 = None
+
+try:
+    import numpy
+except ImportError:
+    # recomputeRatings is vectorized with numpy if it is installed.
+    numpy = None
 
 PLAYERS_PER_MATCH = 2
 
+# column sizes in tournament.sql.
+NAME_MAX_LENGTH = 30
+DESCRIPTION_MAX_LENGTH = 100
+
+# tournament points per match result, by WotC rules.
+WIN_POINTS = 3
+TIE_POINTS = 1
+LOSS_POINTS = 0
+# points for a round without an opponent; a bye also counts as a match win.
+BYE_POINTS = 3
+
+# Elo ratings kept on players across tournaments: the rating players start
+# at, the most one two-player match can move it (the K factor; 0 stops
+# rating updates), and the rating difference at which the stronger player is
+# expected to score ten times as much as the weaker.
+INITIAL_RATING = 1500.0
+RATING_K_FACTOR = 32
+RATING_SCALE = 400.0
+
+# longest idempotency key reportMatch and reportRound accept; the column is
+# wider, leaving room for reportRound's per-match suffix.
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+# tiebreakers playerStandings can compute, in the column order of its
+# tiebreaker query, and the ones it uses when none are given.
+TIEBREAKERS = ('omw', 'buchholz', 'sonneborn_berger', 'head_to_head')
+DEFAULT_TIEBREAKERS = ()
+# tiebreakers startBracket seeds the playoff with by default.
+BRACKET_TIEBREAKERS = ('omw',)
+# floor on each opponent's match-win percentage in omw, by WotC rules.
+MIN_MATCH_WIN_PERCENTAGE = 0.33
+# tournament_players columns kept up to date with each report, from which the
+# tiebreakers are read: opponents met, the sum of their floored match-win
+# percentages, their points, Sonneborn-Berger points and head-to-head points.
+_TIEBREAKER_TOTALS = ('opp_count', 'opp_mwp', 'opp_points', 'sb_points', 'h2h_points')
+# how playerStandings reads each tiebreaker from those columns. omw is rounded,
+# so players whose opponents' percentages were summed in a different order
+# still tie.
+_TIEBREAKER_COLUMNS = {
+    'omw': "CASE WHEN tp.opp_count = 0 THEN 0.0 ELSE CAST(ROUND(CAST("
+           "tp.opp_mwp / tp.opp_count AS NUMERIC), 12) AS FLOAT) END",
+    'buchholz': "tp.opp_points",
+    'sonneborn_berger': "tp.sb_points",
+    'head_to_head': "tp.h2h_points",
+}
+
+# pairing engine limits: candidates examined by the rematch-free search before
+# falling back to minimum-cost matching, the size of each matching window, and
+# the cost of a rematch relative to one place of rank difference. The window
+# must be even.
+PAIRING_SEARCH_LIMIT = 100000
+PAIRING_WINDOW = 12
+REMATCH_COST = 100000
+# pod pairing (PLAYERS_PER_MATCH > 2): unseated players scanned for each seat,
+# and how many tables away a rematch may be swapped to.
+POD_SEARCH_WINDOW = 32
+POD_SWAP_RANGE = 4
+
+# connection settings for the default store, a PostgresStore.
+DSN = "dbname=tournament"
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+# rows per multi-row INSERT statement in bulk operations.
+INSERT_BATCH_SIZE = 1000
+# rows fetched per round trip when streaming query results.
+STREAM_BATCH_SIZE = 2000
+# tournaments whose standings and pairings are kept by the default ResultCache.
+CACHE_SIZE = 64
+# channel that PostgresStore(notify=True) sends change events on.
+CHANGE_CHANNEL = "tournament_changes"
+# PostgreSQL refuses NOTIFY payloads of 8000 bytes or more.
+NOTIFY_MAX_PAYLOAD = 7999
+# how often a ChangeListener checks whether it has been stopped.
+LISTEN_POLL_SECONDS = 1.0
+# schema created by SQLiteStore; tournament.sql is the PostgreSQL one.
+SQLITE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "tournament_sqlite.sql")
+
+
+_CONTROL_CHARACTERS = re.compile(u"[\x00-\x1f\x7f]")
+
+
+def validId(value, label="ID", allowZero=False):
+    """Returns a serial ID as an int, AssertionError if it can't be one.
+
+    Accepts ints and strings of digits, so IDs from forms or URLs work too.
+    All SQL is parameterized, so this is about types, not injection.
 
-def checkCleanArgs(argDict):
-    """Errors if any input was not clean to start. Requires output of locals()"""
-    for arg in argDict.keys():
-        cleanArg = clean(argDict[arg])
-        assert cleanArg == str(argDict[arg]), "Bad {0}: {1}".format(
-            arg, argDict[arg])
+    Args:
+        value: the ID to check
+        label: what the ID is, for the error message
+        allowZero: whether 0 is allowed (winner IDs use it for ties)
+    """
+    if isinstance(value, basestring) and value.strip().isdigit():
+        value = int(value)
+    assert (isinstance(value, (int, long)) and not isinstance(value, bool) and
+            (value > 0 or (allowZero and value == 0))), "Bad {0}: {1!r}".format(
+        label, value)
+    return value
+
+
+def validText(value, label, maxLength, allowEmpty=False):
+    """Returns text that fits its column, AssertionError if it doesn't.
+
+    Args:
+        value: the text to check
+        label: what the text is, for the error message
+        maxLength: the VARCHAR size of its column
+        allowEmpty: whether blank text is allowed
+    """
+    assert isinstance(value, basestring), "Bad {0}: {1!r}".format(label, value)
+    assert allowEmpty or value.strip(), "Bad {0}: must not be blank".format(label)
+    assert len(value) <= maxLength, "Bad {0}: longer than {1} characters".format(
+        label, maxLength)
+    assert not _CONTROL_CHARACTERS.search(value), (
+        "Bad {0}: contains control characters".format(label))
+    return value
+
+
+def sanitize(text):
+    """Returns text made safe to display in HTML.
+
+    Stored names and descriptions are kept as entered; apply this when
+    rendering them. Needs bleach, which is only imported on first use.
+    """
+    from bleach import clean
+    return clean(text)
+
+
+# Instrumentation. Hooks are called as hook(event, details) for each event
+# below while any are registered (see addHook); with none, the only cost is
+# one check per public call. details is a dict:
+#   'call': a public function returned or raised. name, seconds, error (the
+#       exception or None), depth (0 unless called from another public
+#       function), and totals for the call including nested calls:
+#       statements, statement_seconds, rows (fetched) and connections.
+#   'statement': an SQL statement ran. sql, seconds, and call (the name of
+#       the innermost public function running, or None).
+#   'connection': a session took a connection from the store, or connect()
+#       opened one. call, as for 'statement'.
+# Hooks run on the thread that made the call and must not raise.
+_hooks = ()
+_hooksLock = threading.Lock()
+_calls = threading.local()
+
+
+def addHook(hook):
+    """Starts calling hook(event, details) for instrumentation events."""
+    global _hooks
+    with _hooksLock:
+        _hooks = _hooks + (hook,)
+
+
+def removeHook(hook):
+    """Stops calling a hook added with addHook."""
+    global _hooks
+    with _hooksLock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+
+def _emit(event, details):
+    for hook in _hooks:
+        hook(event, details)
+
+
+def _currentCall():
+    """Returns the innermost instrumented call's totals on this thread, or None."""
+    stack = getattr(_calls, 'stack', None)
+    return stack[-1] if stack else None
+
+
+class _CallTotals(object):
+    """What one public call has done so far, including nested calls."""
+
+    __slots__ = ('name', 'statements', 'statement_seconds', 'rows', 'connections')
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.rows = 0
+        self.connections = 0
+
+    def add(self, other):
+        self.statements += other.statements
+        self.statement_seconds += other.statement_seconds
+        self.rows += other.rows
+        self.connections += other.connections
+
+
+def _instrumented(function, name=None):
+    """Returns function, reporting each call to the hooks while there are any."""
+    name = name or function.__name__
+
+    @wraps(function)
+    def call(*args, **kwargs):
+        if not _hooks:
+            return function(*args, **kwargs)
+
+        stack = getattr(_calls, 'stack', None)
+        if stack is None:
+            stack = _calls.stack = []
+        totals = _CallTotals(name)
+        stack.append(totals)
+        error = None
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.time() - start
+            stack.pop()
+            if stack:
+                stack[-1].add(totals)
+            _emit('call', {'name': name, 'seconds': seconds, 'error': error,
+                           'depth': len(stack), 'statements': totals.statements,
+                           'statement_seconds': totals.statement_seconds,
+                           'rows': totals.rows, 'connections': totals.connections})
+    return call
+
+
+def _countConnection():
+    """Reports a connection taken or opened to the hooks."""
+    totals = _currentCall()
+    if totals is not None:
+        totals.connections += 1
+    _emit('connection', {'call': totals.name if totals else None})
+
+
+class _InstrumentedCursor(object):
+    """Wraps a cursor, reporting its statements and counting rows fetched."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _run(self, method, sql, *args):
+        start = time.time()
+        try:
+            return method(sql, *args)
+        finally:
+            seconds = time.time() - start
+            totals = _currentCall()
+            if totals is not None:
+                totals.statements += 1
+                totals.statement_seconds += seconds
+            _emit('statement', {'sql': sql, 'seconds': seconds,
+                                'call': totals.name if totals else None})
+
+    def _fetched(self, n):
+        totals = _currentCall()
+        if totals is not None:
+            totals.rows += n
+
+    def execute(self, sql, *args):
+        return self._run(self._cursor.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._run(self._cursor.executemany, sql, *args)
+
+    def copy_expert(self, sql, *args):
+        return self._run(self._cursor.copy_expert, sql, *args)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._fetched(row is not None)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched(len(rows))
+        return rows
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._fetched(1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class Profiler(object):
+    """Hook that totals calls per public function, for a quick summary.
+
+    Usage:
+        profiler = Profiler()
+        addHook(profiler)
+        ...
+        print profiler.report()
+
+    Totals include nested calls, so a function's time includes that of the
+    functions it calls.
+    """
+
+    FIELDS = ('calls', 'errors', 'seconds', 'statements', 'statement_seconds',
+              'rows', 'connections')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets everything counted so far."""
+        with self._lock:
+            self._totals = {}
+
+    def __call__(self, event, details):
+        if event != 'call':
+            return
+        with self._lock:
+            totals = self._totals.get(details['name'])
+            if totals is None:
+                totals = self._totals[details['name']] = dict.fromkeys(self.FIELDS, 0)
+            totals['calls'] += 1
+            totals['errors'] += details['error'] is not None
+            for field in self.FIELDS[2:]:
+                totals[field] += details[field]
+
+    def summary(self):
+        """Returns a dict of function name -> dict of totals, one per FIELDS."""
+        with self._lock:
+            return dict((name, dict(totals)) for name, totals in self._totals.items())
+
+    def report(self):
+        """Returns the summary as a table, slowest functions first."""
+        lines = ["{0:<32} {1:>7} {2:>6} {3:>9} {4:>7} {5:>9} {6:>9} {7:>6}".format(
+            "function", "calls", "errors", "seconds", "stmts", "stmt s", "rows",
+            "conns")]
+        summary = self.summary()
+        for name in sorted(summary, key=lambda name: -summary[name]['seconds']):
+            totals = summary[name]
+            lines.append(
+                "{0:<32} {1:>7} {2:>6} {3:>9.3f} {4:>7} {5:>9.3f} {6:>9} {7:>6}".format(
+                    name, totals['calls'], totals['errors'], totals['seconds'],
+                    totals['statements'], totals['statement_seconds'],
+                    totals['rows'], totals['connections']))
+        return "\n".join(lines)
+
+
+class TournamentStore(object):
+    """Where tournaments are kept; the module-level functions all go through one.
+
+    Use session() to borrow a cursor. Sessions are tracked per thread, so a
+    public function called from inside another one's session reuses the same
+    connection and transaction; only the outermost session commits (or rolls
+    back if an exception escapes it).
+
+    Cursors accept psycopg2-style SQL: %s placeholders, with a tuple parameter
+    standing for a parenthesized list (as in "player_id IN %s"). Statements
+    that differ between databases go through the methods below, which each
+    backend implements: _begin, _end, _restart, connect, insertRows,
+    incrementRows, streamRows, copyRows and reserveIds, and sendEvent if it
+    can notify other processes of changes.
+    """
+
+    # appended to SELECTs that lock the rows they read until the transaction ends.
+    forUpdate = ""
+    # the same for rows that are only updated, not deleted or re-keyed, so
+    # the lock does not block inserts whose foreign keys reference the rows.
+    forNoKeyUpdate = ""
+    # whether change events are sent to other processes with sendEvent.
+    notify = False
+    # whether reads may be answered from the ResultCache, which only sees
+    # writes made through this process (and those a ChangeListener hears of).
+    cacheReads = False
+    # what the database driver raises when a constraint is violated.
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def session(self):
+        """Yields a cursor, sharing the current thread's transaction if any."""
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is not None:
+            self._local.depth += 1
+            try:
+                yield cursor
+            finally:
+                self._local.depth -= 1
+            return
+
+        db, c = self._begin()
+        if _hooks:
+            _countConnection()
+            c = _InstrumentedCursor(c)
+        self._local.cursor = c
+        self._local.depth = 1
+        self._local.afterCommit = []
+        committed = False
+        try:
+            yield c
+            committed = True
+        finally:
+            self._local.cursor = None
+            self._local.depth = 0
+            pending, self._local.afterCommit = self._local.afterCommit, []
+            self._end(db, c, committed)
+
+        for callback in pending:
+            callback()
+
+    def inSession(self):
+        """Returns whether the current thread has a session open."""
+        return getattr(self._local, 'cursor', None) is not None
+
+    @contextmanager
+    def constraintCheck(self, cursor, diagnose):
+        """Turns a constraint violation in the body into diagnose()'s error.
+
+        Writes that rely on the schema's constraints instead of checking
+        first use this to keep their descriptive errors: diagnose is only
+        called after a violation, and should raise the error explaining it.
+        If it returns, the violation is raised as it was.
+
+        The body's writes are undone before diagnose queries anything: to a
+        savepoint when the session is shared with a caller, whose writes are
+        kept, and otherwise by restarting the transaction, which costs
+        nothing until a violation happens.
+        """
+        savepoint = self._local.depth > 1
+        if savepoint:
+            cursor.execute("SAVEPOINT constraint_check;")
+        try:
+            yield
+        except self.IntegrityError:
+            error = sys.exc_info()
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT constraint_check;")
+            else:
+                self._restart(cursor)
+            diagnose()
+            raise error[0], error[1], error[2]
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT constraint_check;")
+
+    def afterCommit(self, callback):
+        """Calls callback once the current thread's transaction commits.
+
+        Outside of a session it is called at once. If the transaction rolls
+        back, it is never called.
+        """
+        if self.inSession():
+            self._local.afterCommit.append(callback)
+        else:
+            callback()
+
+    def _begin(self):
+        """Starts a transaction. Returns its connection and cursor."""
+        raise NotImplementedError
+
+    def _end(self, db, cursor, commit):
+        """Commits or rolls back a transaction from _begin and releases it."""
+        raise NotImplementedError
+
+    def _restart(self, cursor):
+        """Rolls back the transaction from _begin and starts a new one in its place."""
+        raise NotImplementedError
+
+    def connect(self):
+        """Returns a connection and cursor for use outside of sessions."""
+        raise NotImplementedError
+
+    def close(self):
+        """Closes the store's connections."""
+        raise NotImplementedError
+
+    def insertRows(self, cursor, table, columns, rows, returning=None):
+        """Inserts many rows with as few statements as the database allows.
+
+        Args:
+            cursor: cursor from session()
+            table: name of the table to insert into
+            columns: sequence of column names
+            rows: sequence of tuples, one value per column
+            returning: optional serial column to return for each new row
+
+        Returns:
+            list of the returning column's values in the same order as rows,
+            or None if returning is not given.
+        """
+        raise NotImplementedError
+
+    def incrementRows(self, cursor, table, keyColumns, columns, rows, returning=None):
+        """Adds to counter columns of many rows with as few statements as possible.
+
+        Args:
+            cursor: cursor from session()
+            table: name of the table to update
+            keyColumns: sequence of column names identifying a row
+            columns: sequence of names of the columns to add to
+            rows: sequence of tuples of key values followed by increments
+            returning: optional sequence of column names to return
+
+        Returns:
+            list of tuples of the returning columns' new values, one per
+            updated row in no particular order, or None if returning is not
+            given.
+        """
+        raise NotImplementedError
+
+    def streamRows(self, cursor, sql, params=(), size=STREAM_BATCH_SIZE):
+        """Yields a query's rows, holding only about size of them at a time.
+
+        Args:
+            cursor: cursor from session(); the session must stay open until
+                the rows have been read
+            sql: the SELECT statement
+            params: its parameters
+            size: rows to fetch from the database at a time
+        """
+        raise NotImplementedError
+
+    def copyRows(self, cursor, table, columns, rows):
+        """Loads rows into a table as fast as the database allows.
+
+        Unlike insertRows, rows may be any iterable, such as a generator
+        reading a file, and is consumed without being held in memory.
+
+        Args:
+            cursor: cursor from session()
+            table: name of the table to load
+            columns: sequence of column names
+            rows: iterable of tuples, one value per column
+
+        Returns:
+            nRows: number of rows loaded
+        """
+        raise NotImplementedError
+
+    def reserveIds(self, cursor, table, column, n):
+        """Reserves n consecutive serial IDs for rows inserted with explicit IDs.
+
+        Other sessions cannot add rows to the table until this one ends.
+
+        Args:
+            cursor: cursor from session()
+            table: name of the table
+            column: its serial column
+            n: number of IDs to reserve, at least 1
+
+        Returns:
+            first: the first reserved ID; the rest follow it
+        """
+        raise NotImplementedError
+
+    def sendEvent(self, cursor, event):
+        """Sends a change event to other processes when the transaction commits.
+
+        Args:
+            cursor: cursor from session()
+            event: the event, a dict as described for subscribe()
+        """
+        raise NotImplementedError
+
+
+class PostgresStore(TournamentStore):
+    """Keeps tournaments in PostgreSQL, through a bounded connection pool.
+
+    With notify=True, every change event is also sent with NOTIFY on
+    CHANGE_CHANNEL, for ChangeListeners in other processes.
+
+    Reads are only cached with cacheReads=True, since other processes may
+    write to the same database: either this process is the only writer, or
+    every writer notifies and a ChangeListener runs here.
+    """
+
+    forUpdate = " FOR UPDATE"
+    forNoKeyUpdate = " FOR NO KEY UPDATE"
+    if psycopg2 is not None:
+        IntegrityError = psycopg2.IntegrityError
+
+    def __init__(self, dsn=DSN, minconn=POOL_MIN_CONNECTIONS,
+                 maxconn=POOL_MAX_CONNECTIONS, notify=False, cacheReads=False):
+        TournamentStore.__init__(self)
+        self.dsn = dsn
+        self.notify = notify
+        self.cacheReads = cacheReads
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._poolLock = threading.Lock()
+        # psycopg2 pools raise when exhausted; this makes callers wait instead.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # server-side cursor names must be unique per connection.
+        self._cursorCount = 0
+        self._cursorLock = threading.Lock()
+
+    def _getPool(self):
+        """Creates the connection pool on first use."""
+        if self._pool is None:
+            with self._poolLock:
+                if self._pool is None:
+                    if psycopg2 is None:
+                        raise ImportError("PostgresStore needs psycopg2.")
+                    try:
+                        self._pool = pool.ThreadedConnectionPool(
+                            self.minconn, self.maxconn, self.dsn)
+                    except psycopg2.OperationalError:
+                        print ("Database connection failed. Does tournament "
+                               "database exist for this user?")
+                        raise
+        return self._pool
+
+    def _begin(self):
+        self._slots.acquire()
+        try:
+            db = self._getPool().getconn()
+        except:
+            self._slots.release()
+            raise
+        return db, db.cursor()
+
+    def _end(self, db, cursor, commit):
+        try:
+            if commit:
+                db.commit()
+            elif not db.closed:
+                db.rollback()
+        finally:
+            # the pool rolls back anything a failed commit left open.
+            cursor.close()
+            self._pool.putconn(db, close=bool(db.closed))
+            self._slots.release()
+
+    def _restart(self, cursor):
+        # psycopg2 begins the next transaction with the next statement.
+        cursor.connection.rollback()
+
+    def connect(self):
+        db = psycopg2.connect(self.dsn)
+        return db, db.cursor()
+
+    def close(self):
+        with self._poolLock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def insertRows(self, cursor, table, columns, rows, returning=None):
+        template = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        prefix = "INSERT INTO {0} ({1}) VALUES ".format(table, ", ".join(columns))
+        suffix = " RETURNING {0};".format(returning) if returning else ";"
+
+        newValues = []
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[start:start + INSERT_BATCH_SIZE]
+            values = ",".join(cursor.mogrify(template, row) for row in batch)
+            cursor.execute(prefix + values + suffix)
+            if returning:
+                # serial values are handed out in row order, so sorting the
+                # returned ids restores the order of the input rows.
+                newValues.extend(sorted(r[0] for r in cursor.fetchall()))
+
+        return newValues if returning else None
+
+    def incrementRows(self, cursor, table, keyColumns, columns, rows, returning=None):
+        template = "(" + ", ".join(["%s"] * (len(keyColumns) + len(columns))) + ")"
+        prefix = "UPDATE {0} AS t SET {1} FROM (VALUES ".format(
+            table, ", ".join("{0} = t.{0} + s.{0}".format(col) for col in columns))
+        suffix = ") AS s ({0}) WHERE {1}".format(
+            ", ".join(tuple(keyColumns) + tuple(columns)),
+            " AND ".join("t.{0} = s.{0}".format(col) for col in keyColumns))
+        suffix += " RETURNING {0};".format(
+            ", ".join("t." + col for col in returning)) if returning else ";"
+
+        newValues = []
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[start:start + INSERT_BATCH_SIZE]
+            values = ",".join(cursor.mogrify(template, row) for row in batch)
+            cursor.execute(prefix + values + suffix)
+            if returning:
+                newValues.extend(tuple(row) for row in cursor.fetchall())
+
+        return newValues if returning else None
+
+    def streamRows(self, cursor, sql, params=(), size=STREAM_BATCH_SIZE):
+        # a named cursor keeps the result on the server and fetches it in batches.
+        with self._cursorLock:
+            self._cursorCount += 1
+            name = "tournament_stream_{0}".format(self._cursorCount)
+        stream = cursor.connection.cursor(name=name)
+        stream.itersize = size
+        try:
+            stream.execute(sql, params)
+            for row in stream:
+                yield row
+        finally:
+            stream.close()
+
+    def copyRows(self, cursor, table, columns, rows):
+        data = _CSVReader(rows)
+        cursor.copy_expert("COPY {0} ({1}) FROM STDIN WITH CSV NULL '{2}'".format(
+            table, ", ".join(columns), _CSVReader.NULL), data)
+        return data.nRows
+
+    def reserveIds(self, cursor, table, column, n):
+        # the lock keeps other inserts from taking IDs out of the sequence
+        # between the two statements below.
+        cursor.execute("LOCK TABLE {0} IN EXCLUSIVE MODE;".format(table))
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s));",
+                       (table, column))
+        first = cursor.fetchone()[0]
+        if n > 1:
+            cursor.execute("SELECT setval(pg_get_serial_sequence(%s, %s), %s);",
+                           (table, column, first + n - 1))
+        return first
+
+    def sendEvent(self, cursor, event):
+        # NOTIFY is transactional: listeners get nothing if the session rolls back.
+        for payload in _notifyPayloads(event):
+            cursor.execute("SELECT pg_notify(%s, %s);", (CHANGE_CHANNEL, payload))
+
+
+class _CSVReader(object):
+    """File-like object reading rows as CSV, for COPY ... FROM STDIN."""
+
+    # stands for None; an empty field is an empty string.
+    NULL = "\\N"
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self._line = StringIO()
+        self._writer = csv.writer(self._line, lineterminator="\n")
+        self.nRows = 0
+
+    def _format(self, row):
+        self._line.seek(0)
+        self._line.truncate()
+        self._writer.writerow([
+            self.NULL if value is None else
+            value.encode("utf-8") if isinstance(value, unicode) else value
+            for value in row])
+        return self._line.getvalue()
+
+    def read(self, size=-1):
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = self._format(row)
+            self.nRows += 1
+            pieces.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(pieces)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+
+class _SQLiteCursor(object):
+    """Runs the psycopg2-style SQL used in this module on a sqlite3 cursor."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @staticmethod
+    def _translate(sql, params):
+        parts = sql.split("%s")
+        assert len(parts) - 1 == len(params), "Wrong number of SQL parameters"
+        pieces = [parts[0]]
+        values = []
+        for part, param in zip(parts[1:], params):
+            if isinstance(param, tuple):
+                pieces.append("(" + ", ".join(["?"] * len(param)) + ")")
+                values.extend(param)
+            else:
+                pieces.append("?")
+                values.append(param)
+            pieces.append(part)
+        return "".join(pieces).replace("%%", "%"), values
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(*self._translate(sql, params))
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if rows:
+            sql = self._translate(sql, rows[0])[0]
+            self._cursor.executemany(sql, rows)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteStore(TournamentStore):
+    """Keeps tournaments in an embedded SQLite database.
+
+    The default path, ":memory:", gives a private in-memory database that
+    lasts as long as the store, which suits tests and small side events.
+    The schema in SQLITE_SCHEMA is created if it is not there yet. Sessions
+    from different threads take turns on the store's single connection, so
+    no row locks are needed.
+
+    Reads are cached by default only for ":memory:", which no other process
+    can write to; pass cacheReads=True for a file only this store writes.
+    """
+
+    def __init__(self, path=":memory:", schema=SQLITE_SCHEMA, cacheReads=None):
+        TournamentStore.__init__(self)
+        self.path = path
+        self.cacheReads = path == ":memory:" if cacheReads is None else cacheReads
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA foreign_keys = ON;")
+        with open(schema) as schemaFile:
+            self._db.executescript(schemaFile.read())
+
+    def _begin(self):
+        self._lock.acquire()
+        try:
+            cursor = self._db.cursor()
+            cursor.execute("BEGIN;")
+        except:
+            self._lock.release()
+            raise
+        return self._db, _SQLiteCursor(cursor)
+
+    def _end(self, db, cursor, commit):
+        try:
+            db.execute("COMMIT;" if commit else "ROLLBACK;")
+        except:
+            db.execute("ROLLBACK;")
+            raise
+        finally:
+            cursor.close()
+            self._lock.release()
+
+    def _restart(self, cursor):
+        cursor.execute("ROLLBACK;")
+        cursor.execute("BEGIN;")
+
+    def connect(self):
+        # ":memory:" databases are private to their connection, so share it.
+        return self._db, _SQLiteCursor(self._db.cursor())
+
+    def close(self):
+        self._db.close()
+
+    def insertRows(self, cursor, table, columns, rows, returning=None):
+        sql_statement = "INSERT INTO {0} ({1}) VALUES ({2});".format(
+            table, ", ".join(columns), ", ".join(["%s"] * len(columns)))
+        if not returning:
+            cursor.executemany(sql_statement, rows)
+            return None
+
+        # lastrowid is the new row's INTEGER PRIMARY KEY, i.e. its serial ID.
+        newValues = []
+        for row in rows:
+            cursor.execute(sql_statement, row)
+            newValues.append(cursor.lastrowid)
+        return newValues
+
+    def incrementRows(self, cursor, table, keyColumns, columns, rows, returning=None):
+        sql_statement = "UPDATE {0} SET {1} WHERE {2};".format(
+            table,
+            ", ".join("{0} = {0} + %s".format(col) for col in columns),
+            " AND ".join("{0} = %s".format(col) for col in keyColumns))
+        nKeys = len(keyColumns)
+        cursor.executemany(sql_statement,
+                           [tuple(row[nKeys:]) + tuple(row[:nKeys]) for row in rows])
+        if not returning:
+            return None
+
+        # executemany cannot return rows, so read the new values back.
+        template = "(" + ", ".join(["%s"] * nKeys) + ")"
+        newValues = []
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[start:start + INSERT_BATCH_SIZE]
+            cursor.execute("SELECT {0} FROM {1} WHERE ({2}) IN (VALUES {3});".format(
+                ", ".join(returning), table, ", ".join(keyColumns),
+                ", ".join([template] * len(batch))),
+                [value for row in batch for value in row[:nKeys]])
+            newValues.extend(tuple(row) for row in cursor.fetchall())
+        return newValues
+
+    def streamRows(self, cursor, sql, params=(), size=STREAM_BATCH_SIZE):
+        # sqlite3 steps through results lazily; a cursor of its own keeps the
+        # session's cursor free for other statements meanwhile.
+        stream = _SQLiteCursor(self._db.cursor())
+        try:
+            stream.execute(sql, params)
+            rows = stream.fetchmany(size)
+            while rows:
+                for row in rows:
+                    yield row
+                rows = stream.fetchmany(size)
+        finally:
+            stream.close()
+
+    def copyRows(self, cursor, table, columns, rows):
+        sql_statement = "INSERT INTO {0} ({1}) VALUES ({2});".format(
+            table, ", ".join(columns), ", ".join(["%s"] * len(columns)))
+        rows = iter(rows)
+        nRows = 0
+        batch = list(islice(rows, INSERT_BATCH_SIZE))
+        while batch:
+            cursor.executemany(sql_statement, batch)
+            nRows += len(batch)
+            batch = list(islice(rows, INSERT_BATCH_SIZE))
+        return nRows
+
+    def reserveIds(self, cursor, table, column, n):
+        # AUTOINCREMENT continues after the highest ID ever used, which
+        # explicit inserts raise too. Sessions hold the store's lock anyway.
+        cursor.execute("SELECT COALESCE(MAX({0}), 0) FROM {1};".format(column, table))
+        highest = cursor.fetchone()[0]
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s;", (table,))
+        row = cursor.fetchone()
+        return max(highest, row[0] if row else 0) + 1
+
+
+class ResultCache(object):
+    """Least-recently-used cache of reads, such as standings, per tournament.
+
+    Holds results for up to maxsize tournaments, evicting the tournament read
+    least recently. Writes drop a tournament's results with invalidate(), and
+    a result read before an invalidation is never stored after it. Only
+    changes made through this process, or heard of by a ChangeListener, are
+    seen, so it is only used for stores with cacheReads set.
+
+    Attributes:
+        hits: number of reads answered from the cache
+        misses: number of reads that went to the database
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, tournament_id, key, default=None):
+        """Returns a tournament's cached result for key, or default."""
+        with self._lock:
+            entries = self._entries.pop(tournament_id, None)
+            if entries is None or key not in entries:
+                self.misses += 1
+                if entries is not None:
+                    self._entries[tournament_id] = entries
+                return default
+            self._entries[tournament_id] = entries
+            self.hits += 1
+            return entries[key]
+
+    def generation(self, tournament_id):
+        """Returns a token for put(), taken before reading the database."""
+        with self._lock:
+            return (self._epoch, self._generations.get(tournament_id, 0))
+
+    def put(self, tournament_id, key, value, generation):
+        """Caches a result unless the tournament changed since generation."""
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(tournament_id, 0)):
+                return
+            entries = self._entries.pop(tournament_id, {})
+            entries[key] = value
+            self._entries[tournament_id] = entries
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tournament_id=None):
+        """Drops one tournament's cached results, or every tournament's."""
+        with self._lock:
+            if tournament_id is None:
+                self._epoch += 1
+                self._entries.clear()
+                self._generations.clear()
+            else:
+                self._generations[tournament_id] = (
+                    self._generations.get(tournament_id, 0) + 1)
+                self._entries.pop(tournament_id, None)
+
+    def read(self, tournament_id, key, function, store=None):
+        """Returns function()'s result for a tournament, cached under key.
+
+        Reads inside a session bypass the cache, since they may see the
+        session's own uncommitted writes, as do reads from a store without
+        cacheReads, which other processes may write to.
+        """
+        store = store or _store
+        if store.inSession() or not store.cacheReads:
+            return function()
+        value = self.get(tournament_id, key, self._MISSING)
+        if value is self._MISSING:
+            generation = self.generation(tournament_id)
+            value = function()
+            self.put(tournament_id, key, value, generation)
+        return value
+
+
+_store = PostgresStore()
+_cache = ResultCache()
+
+
+def getStore():
+    """Returns the TournamentStore used by the module-level functions."""
+    return _store
+
+
+def setStore(store):
+    """Replaces the TournamentStore used by the module-level functions.
+
+    Returns the previous store, which is not closed.
+    """
+    global _store
+    previous = _store
+    _store = store
+    _cache.invalidate()
+    return previous
+
+
+def getCache():
+    """Returns the ResultCache used by playerStandings and swissPairings."""
+    return _cache
+
+
+def setCache(cache):
+    """Replaces the ResultCache; ResultCache(maxsize=0) turns caching off.
+
+    Returns the previous cache.
+    """
+    global _cache
+    previous = _cache
+    _cache = cache
+    return previous
+
+
+def _invalidate(tournament_id=None, store=None):
+    """Drops cached reads of a tournament, or all, when the session commits."""
+    (store or _store).afterCommit(lambda: _cache.invalidate(tournament_id))
+
+
+# Change feed: each write publishes an event for the tournament it changed,
+# so that displays can follow a tournament instead of polling it. An event is
+# a dict that converts to JSON, with tournament_id, kind, and per kind:
+#   'results': matches were recorded. players is a list of [player_id,
+#       points, matches_played] with the new totals of everyone who played,
+#       enough to update a copy of playerStandings (see applyChanges).
+#   'enrollment': players joined; players lists them with 0 points and 0
+#       matches. Their names are not included.
+#   'round': round (its number) was started, with tables, a list of the
+#       player IDs at each table in pairing order, or closed (closed is True).
+#   'bracket': the playoff bracket changed; read bracketState again.
+#   'reset': anything else, such as deletes; read everything again. The
+#       tournament_id is None when every tournament was affected.
+# Subscribers are called on the writing thread once its transaction commits,
+# in commit order, and must not raise. Nothing is published when the
+# transaction rolls back.
+_subscribers = ()
+_subscribersLock = threading.Lock()
+
+
+def subscribe(callback, tournament_id=None):
+    """Starts calling callback(event) for changes to a tournament, or to all."""
+    global _subscribers
+    with _subscribersLock:
+        _subscribers = _subscribers + ((callback, tournament_id),)
+
+
+def unsubscribe(callback, tournament_id=None):
+    """Stops calling a callback added with subscribe."""
+    global _subscribers
+    with _subscribersLock:
+        subscribers = list(_subscribers)
+        subscribers.remove((callback, tournament_id))
+        _subscribers = tuple(subscribers)
+
+
+def _publishing(tournament_id, store=None):
+    """Returns whether a change to a tournament would reach anyone."""
+    return (store or _store).notify or any(
+        subscribed is None or tournament_id is None or subscribed == tournament_id
+        for callback, subscribed in _subscribers)
+
+
+def _publish(cursor, tournament_id, kind, store=None, **details):
+    """Publishes a change event when the session commits; see subscribe."""
+    store = store or _store
+    if not _publishing(tournament_id, store):
+        return
+    event = dict(details, tournament_id=tournament_id, kind=kind)
+    if store.notify:
+        store.sendEvent(cursor, event)
+    store.afterCommit(lambda: _deliver(event))
+
+
+def _deliver(event):
+    """Calls the subscribers interested in an event."""
+    tournament_id = event['tournament_id']
+    for callback, subscribed in _subscribers:
+        if subscribed is None or tournament_id is None or subscribed == tournament_id:
+            callback(event)
+
+
+def _notifyPayloads(event):
+    """Returns an event as JSON payloads short enough for NOTIFY.
+
+    A long list of players is split over several events; anything else too
+    long is sent without its lists and with truncated set, meaning that the
+    listener has to read the tournament again.
+    """
+    payload = json.dumps(event, separators=(",", ":"), sort_keys=True)
+    if len(payload) <= NOTIFY_MAX_PAYLOAD:
+        return [payload]
+    players = event.get('players')
+    if players and len(players) > 1:
+        half = len(players) // 2
+        return (_notifyPayloads(dict(event, players=players[:half])) +
+                _notifyPayloads(dict(event, players=players[half:])))
+    return [json.dumps(dict([(key, value) for key, value in event.items()
+                             if not isinstance(value, list)], truncated=True),
+                       separators=(",", ":"), sort_keys=True)]
+
+
+class ChangeListener(threading.Thread):
+    """Delivers change events from other processes to this one's subscribers.
+
+    Listens on CHANGE_CHANNEL, over a PostgreSQL connection of its own, for
+    events sent by writers using PostgresStore(notify=True), and calls the
+    subscribers with them on its own thread, after dropping the tournament's
+    cached reads. Events are seen from start() until stop(). A process that
+    also writes through a notifying store gets its own events twice,
+    directly and through the listener.
+
+    Usage:
+        subscribe(screen.update, tournament_id)
+        listener = ChangeListener()
+        listener.start()
+    """
+
+    def __init__(self, store=None, channel=CHANGE_CHANNEL):
+        threading.Thread.__init__(self, name="tournament-changes")
+        self.daemon = True
+        self.store = store or _store
+        self.channel = channel
+        self._listening = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Starts listening; returns once changes committed from now on will be seen."""
+        threading.Thread.start(self)
+        self._listening.wait()
+
+    def stop(self):
+        """Stops listening and waits for the thread to finish."""
+        self._stopping.set()
+        self.join()
+
+    def run(self):
+        db = None
+        try:
+            db, c = self.store.connect()
+            db.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            c.execute("LISTEN {0};".format(self.channel))
+            self._listening.set()
+            while not self._stopping.is_set():
+                if not select.select([db], [], [], LISTEN_POLL_SECONDS)[0]:
+                    continue
+                db.poll()
+                while db.notifies:
+                    event = json.loads(db.notifies.pop(0).payload)
+                    # another process changed the tournament; drop what this one cached.
+                    _cache.invalidate(event['tournament_id'])
+                    _deliver(event)
+        finally:
+            # start() must not wait forever if connecting failed.
+            self._listening.set()
+            if db is not None:
+                db.close()
+
+
+def applyChanges(standings, event):
+    """Updates a copy of playerStandings(tournament_id) with a change event.
+
+    Args:
+        standings: rows as returned by playerStandings without tiebreakers
+        event: an event for the same tournament, as passed to subscribers
+
+    Returns:
+        the updated standings, in the order playerStandings would return
+        them, or None if the event cannot be applied and the standings have
+        to be read again
+    """
+    if event['kind'] in ('round', 'bracket'):
+        return list(standings)
+    if event['kind'] != 'results' or event.get('truncated'):
+        return None
+
+    changes = dict((player, (points, matches))
+                   for player, points, matches in event['players'])
+    updated = [row if row[0] not in changes else
+               (row[0], row[1]) + changes[row[0]] for row in standings]
+    updated.sort(key=lambda row: (-row[2], row[0]))
+    return updated
+
+
+def session():
+    """Groups several calls into one transaction on one connection.
+
+    Usage:
+        with session():
+            p = registerPlayer("Ajani")
+            registerPlayerInTournament(p, tournament_id)
+    """
+    return _store.session()
 
 
 def connect():
-    """Connect to the PostgreSQL database.  Returns database connection and cursor."""
+    """Connect to the tournament database.  Returns database connection and cursor.
+
+    Opens a dedicated connection outside of the pool (for SQLiteStore, shares
+    its connection); the module functions themselves use sessions instead.
+    """
     try: 
-        db = psycopg2.connect("dbname=tournament")
-        cursor = db.cursor()
-        return db, cursor
+        connection = _store.connect()
+        if _hooks:
+            _countConnection()
+        return connection
     except:
         print "Database connection failed. Does tournament database exist for this user?"
 
@@ -40,34 +1315,26 @@ def addTournament(description):
         new_tournament_id: serial ID of newly created tournament
     """
 
-    argDict = locals()
-    checkCleanArgs(argDict)
-
-    db, c = connect()
+    description = validText(description, "description", DESCRIPTION_MAX_LENGTH,
+                            allowEmpty=True)
 
-    # don't need to check input description type because SQL will convert it to
-    # varchar upon insertion.
-    sql_statement = ("INSERT INTO tournaments (tournament_id, t_description) "
-                     "VALUES (DEFAULT, %s) "
-                     "RETURNING tournament_id;")        
-    c.execute(sql_statement, (description,))
-    db.commit()
+    with _store.session() as c:
+        new_tournament_id = _store.insertRows(
+            c, "tournaments", ("t_description",), [(description,)],
+            returning="tournament_id")[0]
 
-    new_tournament_id = c.fetchone()[0]
     print "Created tournament with ID: {0}".format(new_tournament_id)
 
-    db.close()
-
     return new_tournament_id
 
 
 def checkTournament(tournament_id, cursor):
     """Checks that a tournament exists. Needs a db cursor."""
 
-    # any function using this one must have checkCleanArgs first.
+    # any function using this one must have validated its IDs first.
 
     sql_statement = "SELECT COUNT(*) FROM tournaments WHERE tournament_id = (%s);"
-    cursor.execute(sql_statement, clean(tournament_id),)
+    cursor.execute(sql_statement, (tournament_id,))
     assert int(cursor.fetchone()[0]) == 1, "Invalid tournament ID"
 
 
@@ -75,71 +1342,62 @@ def deleteTournaments():
     """Deletes all tournaments from tournaments table."""
     # figure out how "cascade" works - will this delete all
     # matches/match_players, etc.? it should.
-    db, c = connect()
-
-    c.execute("DELETE FROM tournaments;")
-    db.commit()
-    db.close()
+    with _store.session() as c:
+        c.execute("DELETE FROM tournaments;")
+        _invalidate()
+        _publish(c, None, 'reset')
 
 
 def deleteThisTournament(tournament_id):
     """Deletes tournament with given id."""
 
-    argDict = locals()
-    checkCleanArgs(argDict)
-
-    db, c = connect()
+    tournament_id = validId(tournament_id, "tournament ID")
 
-    checkTournament(tournament_id, c)
+    with _store.session() as c:
+        sql_statement = "DELETE FROM tournaments WHERE tournament_id=(%s);"
 
-    sql_statement = "DELETE FROM tournaments WHERE tournament_id=(%s);"
-
-    c.execute(sql_statement, (tournament_id,))
-    db.commit()
-    db.close()
+        c.execute(sql_statement, (tournament_id,))
+        assert c.rowcount == 1, "Invalid tournament ID"
+        _invalidate(tournament_id)
+        _publish(c, tournament_id, 'reset')
 
 
 def deletePlayers():
     """Remove all the player records from the database."""
 
-    db, c = connect()
-
-    sql_statement = "DELETE FROM players;"
+    with _store.session() as c:
+        sql_statement = "DELETE FROM players;"
 
-    c.execute(sql_statement)
-    db.commit()
-    db.close()
+        c.execute(sql_statement)
+        _invalidate()
+        _publish(c, None, 'reset')
 
 
 def deletePlayersInTournament(tournament_id):
     """Remove all the player records in a given tournament from the database."""
 
-    argDict = locals()
-    checkCleanArgs(argDict)
-
-    db, c = connect()
+    tournament_id = validId(tournament_id, "tournament ID")
 
-    # check that tournament exists
-    checkTournament(tournament_id, c)
+    with _store.session() as c:
+        sql_statement = "DELETE FROM tournament_players WHERE tournament_id=(%s);"
 
-    sql_statement = "DELETE FROM tournament_players WHERE tournament_id=(%s);"
-
-    c.execute(sql_statement, (tournament_id,))
-    db.commit()
-    db.close()
+        c.execute(sql_statement, (tournament_id,))
+        # only an empty tournament needs checking for existence.
+        if c.rowcount == 0:
+            checkTournament(tournament_id, c)
+        _invalidate(tournament_id)
+        _publish(c, tournament_id, 'reset')
 
 
 def countPlayers():
     """Returns the number of players currently registered as nPlayers."""
 
-    db, c = connect()
-
-    sql_statement = "SELECT COUNT(*) FROM players;"
+    with _store.session() as c:
+        sql_statement = "SELECT COUNT(*) FROM players;"
 
-    c.execute(sql_statement)
-    nPlayers = int(c.fetchone()[0])  # should only be one row and one col in c
+        c.execute(sql_statement)
+        nPlayers = int(c.fetchone()[0])  # should only be one row and one col in c
 
-    db.close()
     return nPlayers
 
 
@@ -153,19 +1411,16 @@ def countPlayersInTournament(tournament_id):
         nPlayers: number of players in this tournament
         """
 
-    argDict = locals()
-    checkCleanArgs(argDict)
-
-    db, c = connect()
-
-    checkTournament(tournament_id, c)
+    tournament_id = validId(tournament_id, "tournament ID")
 
-    sql_statement = "SELECT COUNT(*) FROM tournament_players WHERE tournament_id=(%s);"
+    with _store.session() as c:
+        sql_statement = "SELECT COUNT(*) FROM tournament_players WHERE tournament_id=(%s);"
 
-    c.execute(sql_statement, (tournament_id,))
-    nPlayers = int(c.fetchone()[0])  # should only be one row and one col in c
+        c.execute(sql_statement, (tournament_id,))
+        nPlayers = int(c.fetchone()[0])  # should only be one row and one col in c
+        if nPlayers == 0:
+            checkTournament(tournament_id, c)
 
-    db.close()
     return nPlayers
 
 
@@ -182,22 +1437,41 @@ def registerPlayer(name):
         new_player_id: new player's serial ID
     """
 
-    argDict = locals()
-    checkCleanArgs(argDict)
+    name = validText(name, "name", NAME_MAX_LENGTH)
 
-    db, c = connect()
+    with _store.session() as c:
+        new_player_id = _store.insertRows(
+            c, "players", ("p_name",), [(name,)], returning="player_id")[0]
 
-    sql_statement = "INSERT INTO players (p_name) VALUES (%s) RETURNING player_id;"
+    print "Created player {0} with ID: {1}".format(name, new_player_id)
 
-    c.execute(sql_statement, (name,))
-    db.commit()
+    return new_player_id
 
-    new_player_id = c.fetchone()[0]
-    print "Created player {0} with ID: {1}".format(name, new_player_id)
 
-    db.close()
+def registerPlayers(names):
+    """Adds many players to the tournament database in one transaction.
 
-    return new_player_id
+    Args:
+        names: sequence of the players' full names (need not be unique).
+
+    Returns:
+        new_player_ids: list of the new players' serial IDs, in the order of names
+    """
+
+    names = [validText(name, "name", NAME_MAX_LENGTH) for name in names]
+
+    if not names:
+        return []
+
+    with _store.session() as c:
+        new_player_ids = _store.insertRows(
+            c, "players", ("p_name",), [(name,) for name in names],
+            returning="player_id")
+
+    print "Created {0} players with IDs {1} to {2}".format(
+        len(new_player_ids), new_player_ids[0], new_player_ids[-1])
+
+    return new_player_ids
 
 
 def checkPlayer(player_id, cursor):
@@ -208,7 +1482,7 @@ def checkPlayer(player_id, cursor):
         cursor: cursor from connection to tournament database
     """
 
-    # any function using this one must have checkCleanArgs first.
+    # any function using this one must have validated its IDs first.
 
     cursor.execute(
         "SELECT COUNT(*) FROM players WHERE player_id = %s;", (player_id,))
@@ -227,9 +1501,8 @@ def checkPlayerInTournament(player_id, tournament_id, cursor):
         number of registered players with given player and tournament id (1 or 0)
     """
 
-    argDict = locals()
-    argDict.pop('cursor', None)
-    checkCleanArgs(argDict)
+    player_id = validId(player_id, "player ID")
+    tournament_id = validId(tournament_id, "tournament ID")
 
     checkTournament(tournament_id, cursor)
     checkPlayer(player_id, cursor)
@@ -250,28 +1523,88 @@ def registerPlayerInTournament(player_id, tournament_id):
         player_id: serial ID of player to be added
         tournament_id: serial ID of tournament player is to be added to
     """
-    db, c = connect()
 
-    # check that player and tournament exist and args are clean (in checkPlayerInTournament),
-    # then check that player with this info doesn't already exist.
-    assert checkPlayerInTournament(
-        player_id, tournament_id, c) == 0, "Player already registered."
+    player_id = validId(player_id, "player ID")
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    with _store.session() as c:
+        def diagnose():
+            # check that player and tournament exist (in checkPlayerInTournament),
+            # then that the player was already registered.
+            assert checkPlayerInTournament(
+                player_id, tournament_id, c) == 0, "Player already registered."
+
+        # the keys on tournament_players do the checking; the queries above
+        # only run to explain a failure.
+        sql_statement = ("INSERT INTO tournament_players (player_id, tournament_id)"
+                         " VALUES (%s, %s);")
+
+        with _store.constraintCheck(c, diagnose):
+            c.execute(sql_statement, (player_id, tournament_id,))
+        _invalidate(tournament_id)
+        _publish(c, tournament_id, 'enrollment', players=[[player_id, 0, 0]])
+
 
-    sql_statement = ("INSERT INTO tournament_players (player_id, tournament_id)"
-                     " VALUES (%s, %s);")
+def registerPlayersInTournament(player_ids, tournament_id):
+    """Adds many pre-registered players to a pre-existing tournament at once.
 
-    c.execute(sql_statement, (player_id, tournament_id,))
-    db.commit()
-    db.close()
+    The whole batch is written with one statement, and nothing is
+    registered unless every player is.
+
+    Args:
+        player_ids: sequence of serial IDs of players to be added
+        tournament_id: serial ID of tournament players are to be added to
+
+    Returns:
+        player_ids: list of the registered players' IDs, in input order
+    """
+
+    player_ids = [validId(player_id, "player ID") for player_id in player_ids]
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    assert len(set(player_ids)) == len(player_ids), "Duplicate player IDs."
+
+    if not player_ids:
+        return []
+
+    with _store.session() as c:
+        def diagnose():
+            checkTournament(tournament_id, c)
+
+            c.execute("SELECT player_id FROM players WHERE player_id IN %s;",
+                      (tuple(player_ids),))
+            missing = set(player_ids) - set(row[0] for row in c.fetchall())
+            assert not missing, "No such player ID registered: {0}".format(
+                sorted(missing))
+
+            c.execute("SELECT player_id FROM tournament_players"
+                      " WHERE tournament_id = %s AND player_id IN %s;",
+                      (tournament_id, tuple(player_ids),))
+            registered = [row[0] for row in c.fetchall()]
+            assert not registered, "Player already registered: {0}".format(
+                sorted(registered))
+
+        with _store.constraintCheck(c, diagnose):
+            _store.insertRows(c, "tournament_players",
+                              ("player_id", "tournament_id"),
+                              [(player_id, tournament_id) for player_id in player_ids])
+        _invalidate(tournament_id)
+        _publish(c, tournament_id, 'enrollment',
+                 players=[[player_id, 0, 0] for player_id in player_ids])
+
+    return player_ids
 
 
 def checkTournamentPlayerCount(tournament_id):
     """Makes sure a tournament has the correct number of players without byes.
 
+    Byes are supported, so nothing calls this any more; it is kept for
+    organizers who want to check the field before starting.
+
     Args:
         tournament_id: serial ID of tournament whose player count you want
     """
-    # note that the provided tournament_id is checked to be clean and the
+    # note that the provided tournament_id is checked to be valid and the
     # tournament_id is checked to be valid within countPlayersInTournament,
     # so any function using this one does not need to do those things redundantly.
 
@@ -287,18 +1620,20 @@ def checkTournamentPlayerCount(tournament_id):
 def deleteMatches():
     """Remove all the match records from the database."""
 
-    db, c = connect()
-
-    sql_statement = "DELETE FROM matches;"
-    c.execute(sql_statement)
+    with _store.session() as c:
+        sql_statement = "DELETE FROM matches;"
+        c.execute(sql_statement)
+        c.execute("DELETE FROM rounds;")
+        c.execute("DELETE FROM bracket_matches;")
+        _invalidate()
+        _publish(c, None, 'reset')
 
-    # Since p_t_score is not calculated, this is necessary.
-    sql_statement_2 = "UPDATE tournament_players SET p_t_score = 0;"
-    c.execute(sql_statement_2)
-
-    db.commit()
-
-    db.close()
+        # Since p_t_score and the match counts are not calculated, this is necessary.
+        sql_statement_2 = ("UPDATE tournament_players SET p_t_score = 0, "
+                           "matches_played = 0, wins = 0, ties = 0, losses = 0, "
+                           "byes = 0, opp_count = 0, opp_mwp = 0, opp_points = 0, "
+                           "sb_points = 0, h2h_points = 0;")
+        c.execute(sql_statement_2)
 
 
 def deleteMatchesInTournament(tournament_id):
@@ -307,26 +1642,28 @@ def deleteMatchesInTournament(tournament_id):
         tournament_id: serial ID of tournament whose matches you want to delete
     """
 
-    argDict = locals()
-    checkCleanArgs(argDict)
-
-    db, c = connect()
+    tournament_id = validId(tournament_id, "tournament ID")
 
-    checkTournament(tournament_id, c)
+    with _store.session() as c:
+        sql_statement = "DELETE FROM matches WHERE tournament_id=(%s);"
+        c.execute(sql_statement, (tournament_id,))
+        c.execute("DELETE FROM rounds WHERE tournament_id = (%s);", (tournament_id,))
+        c.execute("DELETE FROM bracket_matches WHERE tournament_id = (%s);",
+                  (tournament_id,))
+        _invalidate(tournament_id)
+        _publish(c, tournament_id, 'reset')
 
-    sql_statement = "DELETE FROM matches WHERE tournament_id=(%s);"
-    c.execute(sql_statement, (tournament_id,))
+        # Since p_t_score and the match counts are not calculated, this is necessary.
+        sql_statement_2 = ("UPDATE tournament_players SET p_t_score = 0, "
+                           "matches_played = 0, wins = 0, ties = 0, losses = 0, "
+                           "byes = 0, opp_count = 0, opp_mwp = 0, opp_points = 0, "
+                           "sb_points = 0, h2h_points = 0 WHERE tournament_id = (%s);")
+        c.execute(sql_statement_2, (tournament_id,))
+        if c.rowcount == 0:
+            checkTournament(tournament_id, c)
 
-    # Since p_t_score is not calculated, this is necessary.
-    sql_statement_2 = ("UPDATE tournament_players SET p_t_score = 0 "
-                       "WHERE tournament_id = (%s);")
-    c.execute(sql_statement_2, (tournament_id,))
 
-    db.commit()
-    db.close()
-
-
-def playerStandings(tournament_id):
+def playerStandings(tournament_id, tiebreakers=None):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a player
@@ -334,6 +1671,17 @@ def playerStandings(tournament_id):
 
     Args:
         tournament_id: serial ID of tournament whose standings you want
+        tiebreakers: optional sequence of names from TIEBREAKERS, most
+            important first, used to order players on the same score and
+            added to each row. Defaults to DEFAULT_TIEBREAKERS.
+                omw: opponents' match-win percentage, each opponent's at
+                     least MIN_MATCH_WIN_PERCENTAGE
+                buchholz: sum of opponents' tournament scores
+                sonneborn_berger: sum of beaten opponents' scores plus half
+                                  of tied opponents' scores
+                head_to_head: points scored against players on the same score
+            Each report keeps the tiebreakers' totals up to date, so they
+            are read along with the scores.
 
     Returns:
         A list of tuples, each of which contains (id, name, tournament score, matches):
@@ -342,153 +1690,1674 @@ def playerStandings(tournament_id):
             tournament_score: the player's score in the tournament by WotC rules: 
                               (win=3,tie=1,loss=0)
             matches: the number of matches the player has played
+        followed by one value per requested tiebreaker, in the order requested.
     """
 
-    argDict = locals()
-    checkCleanArgs(argDict)
+    if tiebreakers is None:
+        tiebreakers = DEFAULT_TIEBREAKERS
+    for name in tiebreakers:
+        assert name in TIEBREAKERS, "Unknown tiebreaker: {0}".format(name)
+
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    standings = _cache.read(tournament_id, ('standings', tuple(tiebreakers)),
+                            lambda: _loadStandings(tournament_id, tiebreakers))
+    return list(standings)
+
+
+def _loadStandings(tournament_id, tiebreakers):
+    """Reads playerStandings' rows from the database; IDs must be validated."""
+
+    with _store.session() as c:
+        if tiebreakers:
+            # each report keeps every tiebreaker's totals up to date (see
+            # _tiebreakerChanges), so this is the same read as the plain
+            # standings, with a few more columns to sort on.
+            sql_statement = ("SELECT tp.player_id, p.p_name, tp.p_t_score,"
+                             " tp.matches_played, {0}"
+                             " FROM tournament_players AS tp"
+                             " INNER JOIN players AS p ON (tp.player_id = p.player_id)"
+                             " WHERE tp.tournament_id = %s"
+                             " ORDER BY tp.p_t_score DESC, {1}, tp.player_id;").format(
+                ", ".join("{0} AS {1}".format(_TIEBREAKER_COLUMNS[name], name)
+                          for name in tiebreakers),
+                ", ".join(name + " DESC" for name in tiebreakers))
+            c.execute(sql_statement, (tournament_id,))
+
+            standings = c.fetchall()
+        else:
+            # a single read of tournament_players_tournament_idx, no aggregation.
+            # player_id keeps the order of tied players stable between calls.
+            sql_statement = ("SELECT tp.player_id, p.p_name, tp.p_t_score,"
+                             " tp.matches_played FROM tournament_players AS tp"
+                             " INNER JOIN players AS p ON (tp.player_id = p.player_id)"
+                             " WHERE tp.tournament_id = %s"
+                             " ORDER BY tp.p_t_score DESC, tp.player_id;")
+            c.execute(sql_statement, (tournament_id,))
+
+            standings = c.fetchall()
+
+        # only an empty tournament needs the extra query to tell it apart
+        # from a missing one.
+        if not standings:
+            checkTournament(tournament_id, c)
+
+    return standings
 
-    db, c = connect()
 
-    # make sure the number of players in the tournament works without byes,
-    # bonus tournament_id check.
-    checkTournamentPlayerCount(tournament_id)
+def checkPlayersInTournament(player_ids, tournament_id, cursor, lock=False):
+    """Checks that every given player is registered in a tournament, in one query.
 
-    # standings is a function selecting a parameterized subset of rows/columns
-    # from full_player_info view. Allows all logic to remain in .sql file.
+    Args:
+        player_ids: sequence of serial IDs of players to check
+        tournament_id: serial ID of tournament the players should be registered in
+        cursor: cursor from connection to tournament database
+        lock: whether to also lock the players' rows in players until the
+            transaction ends, so concurrent results for the same players
+            take turns
 
-    sql_statement = """SELECT * from standings(%s);"""
-    c.execute(sql_statement, (tournament_id,))
+    Returns:
+        missing: set of the given IDs that are not registered in the tournament
+    """
 
-    standings = c.fetchall()
+    # any function using this one must have validated its IDs first.
 
-    db.close()
+    if not player_ids:
+        return set()
 
-    return standings
+    sql_statement = ("SELECT player_id FROM tournament_players"
+                     " WHERE tournament_id = %s AND player_id IN %s")
+    if lock and _store.forNoKeyUpdate:
+        # a consistent lock order keeps concurrent reports from deadlocking:
+        # the players' rows first, in player order, as _updateRatings takes
+        # them. Their tournament_players rows are locked by _recordMatches,
+        # after the tournament's row.
+        cursor.execute("SELECT player_id FROM players WHERE player_id IN %s"
+                       " ORDER BY player_id" + _store.forNoKeyUpdate + ";",
+                       (tuple(set(player_ids)),))
+
+    cursor.execute(sql_statement + ";", (tournament_id, tuple(set(player_ids)),))
+
+    return set(player_ids) - set(row[0] for row in cursor.fetchall())
+
+
+def _matchPoints(winner_id, players):
+    """Returns a list of (player_id, points) earned by each player in a match.
+
+    Args:
+        winner_id: the id of the player who won, or 0 if a tie
+        players: all players in the match, including the winner; a bye
+            has a single player, who is also the winner
+    """
+    if len(players) == 1:
+        return [(players[0], BYE_POINTS)]
+    if winner_id == 0:
+        return [(player, TIE_POINTS) for player in players]
+    return [(player, WIN_POINTS if player == winner_id else LOSS_POINTS)
+            for player in players]
+
+
+def _ratingPairs(winner_id, players):
+    """Yields (player, opponent, score, weight) for each pair of players in a match.
+
+    A multiplayer match counts as one game between every two of its
+    players: the winner beats each of the others, who draw among
+    themselves, and each game is weighted so a player's rating moves as
+    much as in one two-player match. A bye is not rated.
+    """
+    if len(players) < 2:
+        return
+    weight = 1.0 / (len(players) - 1)
+    for i, player in enumerate(players):
+        for opponent in players[i + 1:]:
+            if player == winner_id:
+                score = 1.0
+            elif opponent == winner_id:
+                score = 0.0
+            else:
+                score = 0.5
+            yield player, opponent, score, weight
+
+
+def _ratingChanges(ratings, results):
+    """Returns the Elo rating changes for results played at the same time.
+
+    Args:
+        ratings: dict of player ID -> rating before the results
+        results: sequence of (winner_id, players) pairs
+
+    Returns:
+        dict of player ID -> [rating change, rated matches], for every
+            player in a rated match
+    """
+    changes = {}
+    for winner_id, players in results:
+        for player, opponent, score, weight in _ratingPairs(winner_id, players):
+            expected = 1.0 / (1.0 + 10.0 ** (
+                (ratings[opponent] - ratings[player]) / RATING_SCALE))
+            change = RATING_K_FACTOR * weight * (score - expected)
+            changes.setdefault(player, [0.0, 0])[0] += change
+            changes.setdefault(opponent, [0.0, 0])[0] -= change
+        if len(players) > 1:
+            for player in players:
+                changes[player][1] += 1
+    return changes
+
+
+def _updateRatings(cursor, results, store):
+    """Applies the rating changes from results to their players, in two statements.
+
+    The players' rows are locked while their ratings are read, in player
+    order, so reports from other tournaments sharing a player wait their turn.
+    With RATING_K_FACTOR at 0 the ratings stay put, but the matches are still
+    counted in rated_matches, as recomputeRatings counts them.
+    """
+    players = sorted(set(player for winner_id, players in results
+                         if len(players) > 1 for player in players))
+    if not players:
+        return
+
+    cursor.execute("SELECT player_id, rating FROM players WHERE player_id IN %s"
+                   " ORDER BY player_id" + store.forNoKeyUpdate + ";", (tuple(players),))
+    ratings = dict(cursor.fetchall())
+    if len(ratings) < len(players):
+        # an unknown player; the foreign keys reject the match itself.
+        return
+
+    changes = _ratingChanges(ratings, results)
+    store.incrementRows(cursor, "players", ("player_id",),
+                        ("rating", "rated_matches"),
+                        [(player,) + tuple(changes[player]) for player in players])
+
+
+def _checkPairings(cursor, tournament_id, results):
+    """Checks results against the pairings of the tournament's open round.
+
+    One query reads the open round, if any, together with the stored pairing
+    of every reported player and whether their table was already reported.
+
+    Args:
+        cursor: cursor from session()
+        tournament_id: which tournament the matches were in
+        results: sequence of (winner_id, players) pairs
+
+    Returns:
+        (round_id, tables): the open round's serial ID and the table number of
+            each result, or (None, None) if no round is open
+    """
+    sql_statement = ("SELECT r.round_id, r.round_number, rp.player_id,"
+                     " rp.table_number, rp.seats, m.match_id FROM rounds AS r"
+                     " LEFT JOIN round_pairings AS rp"
+                     " ON (rp.round_id = r.round_id AND rp.player_id IN %s)"
+                     " LEFT JOIN matches AS m"
+                     " ON (m.round_id = r.round_id AND m.table_number = rp.table_number)"
+                     " WHERE r.tournament_id = %s AND NOT r.closed;")
+    cursor.execute(sql_statement, (
+        tuple(set(player for winner_id, players in results for player in players)),
+        tournament_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        return None, None
+
+    round_id, round_number = rows[0][:2]
+    seating = dict((row[2], row[3:]) for row in rows if row[2] is not None)
+    tables = []
+    for winner_id, players in results:
+        for player in players:
+            assert player in seating, "Player ID {0} not paired in round {1}.".format(
+                player, round_number)
+        table, seats, match_id = seating[players[0]]
+        assert seats == len(players) and all(
+            seating[player][0] == table for player in players), (
+            "Player IDs {0} were not paired together in round {1}.".format(
+                ", ".join(str(player) for player in players), round_number))
+        assert match_id is None, "Table {0} of round {1} was already reported.".format(
+            table, round_number)
+        tables.append(table)
+    return round_id, tables
+
+
+# each player's side of each Swiss match with an opponent, with both players'
+# standings; {0} is the condition choosing the players.
+_OPPONENT_SEATS = (
+    "SELECT a.tournament_id, a.match_id, m.winner_id,"
+    " a.player_id, ta.p_t_score, ta.matches_played,"
+    " b.player_id, tb.p_t_score, tb.matches_played"
+    " FROM match_players AS a"
+    " INNER JOIN matches AS m ON (m.match_id = a.match_id)"
+    " INNER JOIN match_players AS b"
+    "   ON (b.match_id = a.match_id AND b.player_id <> a.player_id)"
+    " INNER JOIN tournament_players AS ta"
+    "   ON (ta.tournament_id = a.tournament_id AND ta.player_id = a.player_id)"
+    " INNER JOIN tournament_players AS tb"
+    "   ON (tb.tournament_id = a.tournament_id AND tb.player_id = b.player_id)"
+    " WHERE {0} AND NOT m.is_playoff;")
+
+
+def _opponentTotals(player, score, opponentScore, opponentMatches, winner_id):
+    """Returns what one opponent in one Swiss match adds to a player's tiebreakers.
+
+    Args:
+        player: the player's ID
+        score: the player's points
+        opponentScore: the opponent's points
+        opponentMatches: the opponent's matches played
+        winner_id: the match's winner, None for a tie
+
+    Returns:
+        tuple of additions to the _TIEBREAKER_TOTALS columns
+    """
+    mwp = float(opponentScore) / (WIN_POINTS * opponentMatches) if opponentMatches else 0
+    if winner_id == player:
+        sb, h2h = opponentScore, WIN_POINTS
+    elif winner_id is None:
+        sb, h2h = opponentScore / 2.0, TIE_POINTS
+    else:
+        sb, h2h = 0, LOSS_POINTS
+    return (1, max(mwp, MIN_MATCH_WIN_PERCENTAGE), opponentScore, float(sb),
+            h2h if score == opponentScore else 0)
+
+
+def _tiebreakerChanges(cursor, tournament_id, stats, match_ids):
+    """Returns how new Swiss results change the players' tiebreaker totals.
+
+    A player's totals change with each new opponent, and with each past
+    opponent whose points or match count change; head-to-head points also
+    change with the player's own points. Every Swiss match of the players
+    in stats, the new ones included, is read in one query, once for each
+    pair of opponents, with both sides' standings before the results.
+
+    Args:
+        cursor: cursor from session()
+        tournament_id: which tournament the matches were in
+        stats: dict of player ID -> [points, matches played, ...] the
+            results add, as _recordMatches builds it
+        match_ids: IDs of the new matches
+
+    Returns:
+        dict of player ID -> list of changes to the _TIEBREAKER_TOTALS columns
+    """
+    players = tuple(stats)
+    cursor.execute(_OPPONENT_SEATS.format(
+        "a.tournament_id = %s AND a.player_id IN %s"
+        " AND (b.player_id > a.player_id OR b.player_id NOT IN %s)"),
+        (tournament_id, players, players,))
+    new = set(match_ids)
+    changes = {}
+
+    def change(player, before, after):
+        row = changes.setdefault(player, [0, 0.0, 0, 0.0, 0])
+        for i, value in enumerate(after):
+            row[i] += value - (before[i] if before else 0)
+
+    for t, match_id, winner_id, a, scoreA, matchesA, b, scoreB, matchesB \
+            in cursor.fetchall():
+        old = match_id not in new
+        newA = (scoreA + stats[a][0], matchesA + stats[a][1])
+        newB = (scoreB + stats[b][0], matchesB + stats[b][1]) if b in stats else (
+            scoreB, matchesB)
+        change(a, old and _opponentTotals(a, scoreA, scoreB, matchesB, winner_id),
+               _opponentTotals(a, newA[0], newB[0], newB[1], winner_id))
+        change(b, old and _opponentTotals(b, scoreB, scoreA, matchesA, winner_id),
+               _opponentTotals(b, newB[0], newA[0], newA[1], winner_id))
+    return changes
+
+
+def recomputeTiebreakers(tournament_ids, cursor):
+    """Rebuilds the tiebreaker totals of tournaments from their matches.
+
+    Reporting keeps them up to date; this is for matches written some other
+    way, such as importData's.
+
+    Args:
+        tournament_ids: sequence of IDs of the tournaments
+        cursor: cursor from connection to tournament database
+    """
+
+    # any function using this one must have validated its IDs first.
+
+    if not tournament_ids:
+        return
+    cursor.execute("UPDATE tournament_players SET {0} WHERE tournament_id IN %s;".format(
+        ", ".join(column + " = 0" for column in _TIEBREAKER_TOTALS)),
+        (tuple(tournament_ids),))
+    totals = {}
+    seats = _store.streamRows(cursor, _OPPONENT_SEATS.format("a.tournament_id IN %s"),
+                              (tuple(tournament_ids),))
+    for t, match_id, winner_id, a, scoreA, matchesA, b, scoreB, matchesB in seats:
+        row = totals.setdefault((t, a), [0, 0.0, 0, 0.0, 0])
+        for i, value in enumerate(_opponentTotals(a, scoreA, scoreB, matchesB, winner_id)):
+            row[i] += value
+    _store.incrementRows(cursor, "tournament_players", ("tournament_id", "player_id"),
+                         _TIEBREAKER_TOTALS,
+                         [key + tuple(row) for key, row in sorted(totals.items())])
+
+
+def _recordMatches(cursor, tournament_id, results, store=None, keys=None,
+                   playoff=False):
+    """Writes validated match results with one batched statement per table.
+
+    Callers must have checked the winners already. An unknown tournament or
+    unregistered player violates a foreign key instead of being looked up;
+    callers explain it through TournamentStore.constraintCheck.
+    If the tournament has an open round, the results are checked against its
+    pairings here and counted towards its completion. The players' ratings
+    are updated as if the results were played at the same time, and so are
+    the tiebreaker totals of the players and everyone they have played.
 
+    Args:
+        cursor: cursor from session()
+        tournament_id: which tournament the matches were in
+        results: sequence of (winner_id, players) pairs, winner_id 0 for a
+            tie; a single player who is also the winner is a bye
+        store: TournamentStore the cursor came from, default the module's
+        keys: optional idempotency keys, one per result
+        playoff: whether these are playoff matches, which are rated but
+            left out of the players' Swiss scores and match counts
+
+    Returns:
+        match_ids: list of the new matches' serial IDs, in the order of results
+    """
+    if not results:
+        return []
+    store = store or _store
+    keys = keys or [None] * len(results)
+    round_id, tables = _checkPairings(cursor, tournament_id, results)
+    # first, so the players' rows are locked before anything else touches them.
+    _updateRatings(cursor, results, store)
+    if not playoff and store.forNoKeyUpdate:
+        # the tiebreaker totals below are worked out from other players' rows,
+        # so reports in the same tournament take turns from here on.
+        cursor.execute("SELECT tournament_id FROM tournaments WHERE tournament_id = %s"
+                       + store.forNoKeyUpdate + ";", (tournament_id,))
+
+    # ties are stored with a NULL winner_id.
+    match_ids = store.insertRows(
+        cursor, "matches",
+        ("tournament_id", "winner_id", "is_bye", "idempotency_key",
+         "round_id", "table_number", "is_playoff"),
+        [(tournament_id, winner_id or None, len(players) == 1, key, round_id, table,
+          playoff)
+         for (winner_id, players), key, table
+         in zip(results, keys, tables or [None] * len(results))],
+        returning="match_id")
+
+    if round_id is not None:
+        cursor.execute("UPDATE rounds SET matches_reported = matches_reported + %s"
+                       " WHERE round_id = %s;", (len(results), round_id))
+    _invalidate(tournament_id, store)
+
+    store.insertRows(
+        cursor, "match_players", ("match_id", "tournament_id", "player_id"),
+        [(match_id, tournament_id, player)
+         for match_id, (winner_id, players) in zip(match_ids, results)
+         for player in players])
+    if playoff:
+        return match_ids
+
+    # per player: [points, matches played, wins, ties, losses, byes]
+    stats = {}
+    for winner_id, players in results:
+        for player, points in _matchPoints(winner_id, players):
+            row = stats.setdefault(player, [0, 0, 0, 0, 0, 0])
+            row[0] += points
+            row[1] += 1
+            if len(players) == 1:
+                row[2] += 1
+                row[5] += 1
+            elif winner_id == 0:
+                row[3] += 1
+            elif player == winner_id:
+                row[2] += 1
+            else:
+                row[4] += 1
+
+    # the players' opponents' tiebreakers change along with their scores.
+    changes = _tiebreakerChanges(cursor, tournament_id, stats, match_ids)
+    rows = [(tournament_id, player) + tuple(stats.get(player, [0] * 6)) +
+            tuple(changes.get(player, [0, 0.0, 0, 0.0, 0]))
+            for player in sorted(set(stats) | set(changes))]
+
+    # the new totals are only read back when someone is following the changes.
+    publishing = _publishing(tournament_id, store)
+    totals = store.incrementRows(
+        cursor, "tournament_players", ("tournament_id", "player_id"),
+        ("p_t_score", "matches_played", "wins", "ties", "losses", "byes") +
+        _TIEBREAKER_TOTALS,
+        # in player order, so concurrent reports lock shared rows in the same
+        # order. Lock order: players (in _updateRatings, or earlier in
+        # checkPlayersInTournament with lock=True), then the tournament, then
+        # tournament_players.
+        [row for row in rows if any(row[2:])],
+        returning=("player_id", "p_t_score", "matches_played") if publishing else None)
+    if publishing:
+        _publish(cursor, tournament_id, 'results', store,
+                 players=sorted(list(row) for row in totals if row[0] in stats))
+
+    return match_ids
+
+
+def _reportResults(cursor, tournament_id, results, keys=None):
+    """Records validated results at most once per idempotency key.
+
+    When keys are given, callers must have locked the players' rows
+    (checkPlayersInTournament with lock=True), so a retry racing the
+    original waits for it to commit and then finds its matches instead of
+    recording them again.
+
+    Args:
+        cursor: cursor from session()
+        tournament_id: which tournament the matches were in
+        results: sequence of (winner_id, players) pairs, as for _recordMatches
+        keys: optional idempotency keys, one per result
 
-def reportMatch(tournament_id, winner_id, *args):
+    Returns:
+        match_ids: list of the matches' serial IDs, in the order of results,
+            whether recorded now or by an earlier call with the same keys
+    """
+    if keys:
+        sql_statement = ("SELECT m.idempotency_key, m.match_id, m.winner_id,"
+                         " mp.player_id FROM matches AS m"
+                         " INNER JOIN match_players AS mp ON (mp.match_id = m.match_id)"
+                         " WHERE m.tournament_id = %s AND m.idempotency_key IN %s;")
+        cursor.execute(sql_statement, (tournament_id, tuple(keys),))
+        existing = {}
+        for key, match_id, winner_id, player in cursor.fetchall():
+            existing.setdefault(key, (match_id, winner_id or 0, set()))[2].add(player)
+
+        if existing:
+            # a retry: it must repeat exactly what was recorded the first time.
+            for key, (winner_id, players) in zip(keys, results):
+                assert (key in existing and
+                        existing[key][1:] == (winner_id, set(players))), (
+                    "Idempotency key {0} was already used for a different "
+                    "result.".format(key))
+            return [existing[key][0] for key in keys]
+
+    return _recordMatches(cursor, tournament_id, results, keys=keys)
+
+
+def _explainReportError(cursor, tournament_id, results, winner_id=0, keys=None):
+    """Raises the error behind a constraint violation while recording results.
+
+    The foreign keys on matches and match_players reject a missing tournament
+    or a player not registered in it; this finds which, with one query. A
+    table of the open round that another report recorded after the pairings
+    were checked violates its unique key on matches instead, and gets the
+    same error as if it had been reported first.
+
+    Args:
+        cursor: cursor from session()
+        tournament_id: which tournament the matches were in
+        results: sequence of (winner_id, players) pairs, as for _recordMatches
+        winner_id: for a single match, its winner, to name them in the error
+        keys: the idempotency keys given, if any
+    """
+    players = set(player for result_winner, result_players in results
+                  for player in result_players)
+    missing = checkPlayersInTournament(players, tournament_id, cursor)
+    assert winner_id not in missing, "Winner not a tournament player"
+    assert not missing, "Player ID {0} not in tournament.".format(
+        min(missing) if missing else None)
+    _checkPairings(cursor, tournament_id, results)
+    # otherwise the same key raced in for other players; the database kept the first.
+    assert not keys, "Idempotency key already used for a different result."
+
+
+def reportMatch(tournament_id, winner_id, *args, **kwargs):
     """Records the outcome of a single match between two players.
 
+    The match is written without checking the tournament and players first:
+    the schema's foreign keys reject it if they are not registered, and the
+    error is then explained. Give an idempotency_key to make resubmissions
+    safe; the players' rows are then locked while the match is recorded, and
+    a second report with the same key returns the first one's match_id
+    without recording anything, or fails if its result differs.
+
     Args:
         tournament_id: which tournament this match was in
         winner_id:  the id of the player who won, or 0 if a tie
         args: additional arguments are a list of players in the match (allows >2 players)
             *Note this is ALL the match players, not just losers.*
+        idempotency_key: optional keyword argument, a string unique to this
+            result within the tournament, such as a table and round number,
+            up to IDEMPOTENCY_KEY_MAX_LENGTH characters
+
+    Returns:
+        match_id: serial ID of the recorded match
     """
 
+    idempotency_key = kwargs.pop('idempotency_key', None)
+    assert not kwargs, "Unexpected arguments: {0}".format(sorted(kwargs))
+
     # check there are the correct # players in the match before recording outcome.
-    # using set() differently could allow for "byes" in future iterations.
-    assert len(set(args)) == PLAYERS_PER_MATCH, "Bad number of players"
+    # byes are recorded with reportBye instead.
+    assert _isMatchSize(len(set(args))), "Bad number of players"
 
-    # Make sure all data is clean
+    # Make sure all data is well-formed
 
-    argDict = locals()
-    checkCleanArgs(argDict)
+    tournament_id = validId(tournament_id, "tournament ID")
+    winner_id = validId(winner_id, "winner ID", allowZero=True)
+    args = tuple(validId(player, "player ID") for player in args)
+    if idempotency_key is not None:
+        idempotency_key = validText(idempotency_key, "idempotency key",
+                                    IDEMPOTENCY_KEY_MAX_LENGTH)
 
-    # need to separately check player *args, as they come as a [list].
+    # check that winner is a valid player or 0 (tie)
+    if winner_id != 0 and winner_id not in args:
+        raise ValueError("Invalid winner ID.")
 
-    aKeys = range(len(args))
-    pDict = dict(zip(aKeys, args))
+    keys = [idempotency_key] if idempotency_key is not None else None
 
-    checkCleanArgs(pDict)
+    with _store.session() as c:
+        if keys:
+            # a retry must wait for the original to commit, so lock the players.
+            missing = checkPlayersInTournament(args, tournament_id, c, lock=True)
+            assert winner_id not in missing, "Winner not a tournament player"
+            assert not missing, "Player ID {0} not in tournament.".format(
+                min(missing) if missing else None)
 
-    # make sure the number of players in the tournament works without byes,
-    # bonus tournament_id check.
-    checkTournamentPlayerCount(tournament_id)
+        with _store.constraintCheck(c, lambda: _explainReportError(
+                c, tournament_id, [(winner_id, args)], winner_id, keys)):
+            match_id = _reportResults(c, tournament_id, [(winner_id, args)], keys)[0]
 
-    db, c = connect()
+    return match_id
 
-    # check that all players in args are tournament players
 
-    # check that winner is a valid player or 0 (tie); 'is' is pickier than '=='
-    # assert clean(winner_id) in args or winner_id is 0, "Invalid winner ID"
-    # easier to handle the above in match-creation conditional.
+def reportRound(tournament_id, results, idempotency_key=None):
+    """Records the outcomes of a whole round of matches in one transaction.
 
-    # check that match should be played in this tournament round
+    Args:
+        tournament_id: which tournament the round was in
+        results: sequence of tuples (winner_id, player, player, ...), one per
+            match, laid out like the arguments to reportMatch: winner_id is 0
+            for a tie, and ALL the match players follow it. A bye is given
+            as (player_id, player_id).
+        idempotency_key: optional string unique to this round within the
+            tournament; resubmitting the same round with it is a no-op, as
+            for reportMatch
 
-    # create a match with the given data
-    # we want to make sure all the provided data is correct, though.
+    Returns:
+        match_ids: list of the recorded matches' serial IDs, in the order of results
+    """
 
-    # case: there is a tie
-    if winner_id is 0:
+    tournament_id = validId(tournament_id, "tournament ID")
+    results = [(validId(result[0], "winner ID", allowZero=True),
+                tuple(validId(player, "player ID") for player in result[1:]))
+               for result in results]
+    keys = None
+    if idempotency_key is not None:
+        idempotency_key = validText(idempotency_key, "idempotency key",
+                                    IDEMPOTENCY_KEY_MAX_LENGTH)
+        keys = ["{0}/{1}".format(idempotency_key, n) for n in range(len(results))]
+
+    seen = set()
+    for n, (winner_id, players) in enumerate(results):
+        isBye = len(players) == 1 and winner_id == players[0]
+        assert isBye or (len(players) == len(set(players)) and
+                         _isMatchSize(len(players))), (
+            "Bad number of players in match {0}".format(n))
+        if winner_id != 0 and winner_id not in players:
+            raise ValueError("Invalid winner ID in match {0}.".format(n))
+        for player in players:
+            assert player not in seen, (
+                "Player ID {0} reported twice in round.".format(player))
+            seen.add(player)
+
+    def diagnose():
         checkTournament(tournament_id, c)
-        c.execute("INSERT INTO matches (tournament_id) VALUES (%s)"
-                  " RETURNING match_id;", (tournament_id,))
-        match_id = int(c.fetchone()[0])
-        for player in args:
-            assert checkPlayerInTournament(
-                player, tournament_id, c) == 1, "Player ID {0} not in tournament.".format(player)
-            c.execute("INSERT INTO match_players (match_id,player_id)"
-                      " VALUES (%s, %s);", (match_id, player,))
-            c.execute("UPDATE tournament_players SET p_t_score = p_t_score + 1 "
-                      "WHERE tournament_id = %s AND player_id = %s;",
-                      (tournament_id, player_id,))
-    # case: there is a winner
-    elif winner_id in args:
-        assert checkPlayerInTournament(
-            winner_id, tournament_id, c) == 1, "Winner not a tournament player"
-        c.execute("INSERT INTO matches (tournament_id, winner_id) VALUES (%s, %s) "
-                  "RETURNING match_id;", (tournament_id, winner_id,))
-        match_id = int(c.fetchone()[0])
-        for player in args:
-            assert checkPlayerInTournament(
-                player, tournament_id, c) == 1, "Player ID {0} not in tournament.".format(player)
-            c.execute("INSERT INTO match_players (match_id,player_id)"
-                      " VALUES (%s, %s);", (match_id, player,))
-            if player is winner_id:
-                c.execute("UPDATE tournament_players SET p_t_score = p_t_score + 3 "
-                          "WHERE tournament_id = %s AND player_id = %s;",
-                          (tournament_id, player,))
+        _explainReportError(c, tournament_id, results, keys=keys)
+
+    with _store.session() as c:
+        # with nothing to write, only the tournament needs checking.
+        if keys or not results:
+            checkTournament(tournament_id, c)
+            # a retry must wait for the original to commit, so lock the players.
+            missing = checkPlayersInTournament(seen, tournament_id, c, lock=True)
+            assert not missing, "Player ID {0} not in tournament.".format(
+                min(missing) if missing else None)
+
+        with _store.constraintCheck(c, diagnose):
+            match_ids = _reportResults(c, tournament_id, results, keys)
+
+    return match_ids
+
+
+def reportBye(tournament_id, player_id):
+    """Records a bye: a round the player sits out, scored as a win.
+
+    Args:
+        tournament_id: which tournament the bye was in
+        player_id: the player receiving the bye
+
+    Returns:
+        match_id: serial ID of the match recording the bye
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+    player_id = validId(player_id, "player ID")
+
+    with _store.session() as c:
+        with _store.constraintCheck(c, lambda: _explainReportError(
+                c, tournament_id, [(player_id, (player_id,))])):
+            match_id = _recordMatches(c, tournament_id, [(player_id, (player_id,))])[0]
+
+    return match_id
+
+
+def playerRatings(tournament_id=None):
+    """Returns players' ratings, highest first.
+
+    Args:
+        tournament_id: optional serial ID of a tournament, to list only its players
+
+    Returns:
+        A list of tuples (id, name, rating, matches):
+            id: the player's unique id
+            name: the player's full name
+            rating: the player's Elo rating across all tournaments
+            matches: the number of rated matches it is based on (byes are not rated)
+    """
+
+    with _store.session() as c:
+        if tournament_id is None:
+            c.execute("SELECT player_id, p_name, rating, rated_matches FROM players"
+                      " ORDER BY rating DESC, player_id;")
+            return [tuple(row) for row in c.fetchall()]
+
+        tournament_id = validId(tournament_id, "tournament ID")
+        c.execute("SELECT p.player_id, p.p_name, p.rating, p.rated_matches"
+                  " FROM tournament_players AS tp"
+                  " INNER JOIN players AS p ON (tp.player_id = p.player_id)"
+                  " WHERE tp.tournament_id = %s ORDER BY p.rating DESC, p.player_id;",
+                  (tournament_id,))
+        ratings = [tuple(row) for row in c.fetchall()]
+        if not ratings:
+            checkTournament(tournament_id, c)
+
+    return ratings
+
+
+def _replayBatches(rows):
+    """Groups (match_id, winner_id, player_id) rows, in match order, into batches.
+
+    Each batch is a run of consecutive matches with no player in common, as
+    in a round, so rating them at the same time gives the same ratings as
+    rating them one by one.
+
+    Yields:
+        lists of (winner_id, players) pairs
+    """
+    batch = []
+    seen = set()
+    current = None
+    for match_id, winner_id, player_id in rows:
+        if match_id != current:
+            if current is not None:
+                if seen.intersection(players):
+                    yield batch
+                    batch = []
+                    seen = set()
+                batch.append((winner, tuple(players)))
+                seen.update(players)
+            current, winner, players = match_id, winner_id or 0, []
+        players.append(player_id)
+    if current is not None:
+        if seen.intersection(players):
+            yield batch
+            batch = []
+        batch.append((winner, tuple(players)))
+    if batch:
+        yield batch
+
+
+def _replayRatings(ratings, batches):
+    """Rates batches of results in order, changing ratings in place.
+
+    Returns a dict of player ID -> number of rated matches.
+    """
+    counts = {}
+    for batch in batches:
+        for player, (change, matches) in _ratingChanges(ratings, batch).iteritems():
+            ratings[player] += change
+            counts[player] = counts.get(player, 0) + matches
+    return counts
+
+
+def _replayRatingsVectorized(ratings, batches):
+    """Does what _replayRatings does with one set of numpy operations per batch."""
+    index = dict((player, i) for i, player in enumerate(ratings))
+    values = numpy.array([ratings[player] for player in ratings], dtype=float)
+    counts = numpy.zeros(len(values), dtype=int)
+    for batch in batches:
+        pairs = [(index[player], index[opponent], score, weight)
+                 for winner_id, players in batch
+                 for player, opponent, score, weight in _ratingPairs(winner_id, players)]
+        if not pairs:
+            continue
+        player, opponent, score, weight = (numpy.array(column) for column in zip(*pairs))
+        expected = 1.0 / (1.0 + 10.0 ** ((values[opponent] - values[player]) / RATING_SCALE))
+        change = RATING_K_FACTOR * weight * (score - expected)
+        numpy.add.at(values, player, change)
+        numpy.add.at(values, opponent, -change)
+        numpy.add.at(counts, [index[p] for winner_id, players in batch
+                              if len(players) > 1 for p in players], 1)
+    for player, i in index.iteritems():
+        ratings[player] = float(values[i])
+    return dict((player, int(counts[i])) for player, i in index.iteritems() if counts[i])
+
+
+def recomputeRatings():
+    """Recomputes every player's rating from the whole match history.
+
+    Matches are replayed in the order they were recorded, starting everyone
+    from INITIAL_RATING. Runs of matches with no player in common, such as
+    a round, are rated together, with numpy if it is installed; this gives
+    the same ratings as reporting the matches did. Use it after importing
+    or deleting matches, or changing the rating constants.
+    """
+
+    with _store.session() as c:
+        c.execute("SELECT player_id FROM players;")
+        ratings = dict((row[0], INITIAL_RATING) for row in c.fetchall())
+
+        rows = _store.streamRows(
+            c, "SELECT m.match_id, m.winner_id, mp.player_id FROM matches AS m"
+               " INNER JOIN match_players AS mp ON (mp.match_id = m.match_id)"
+               " WHERE NOT m.is_bye ORDER BY m.match_id, mp.player_id;")
+        if numpy is not None:
+            counts = _replayRatingsVectorized(ratings, _replayBatches(rows))
+        else:
+            counts = _replayRatings(ratings, _replayBatches(rows))
+
+        c.execute("UPDATE players SET rating = %s, rated_matches = 0;", (INITIAL_RATING,))
+        _store.incrementRows(
+            c, "players", ("player_id",), ("rating", "rated_matches"),
+            [(player, ratings[player] - INITIAL_RATING, counts.get(player, 0))
+             for player in sorted(ratings) if player in counts])
+
+
+def loadOpponents(tournament_id, cursor):
+    """Returns a dict of player ID -> set of IDs of everyone they have played.
+
+    Reads the tournament's whole match history in one query.
+    """
+
+    # any function using this one must have validated its IDs first.
+
+    sql_statement = ("SELECT a.player_id, b.player_id FROM match_players AS a"
+                     " INNER JOIN match_players AS b"
+                     " ON (a.match_id = b.match_id AND a.player_id <> b.player_id)"
+                     " WHERE a.tournament_id = %s;")
+    cursor.execute(sql_statement, (tournament_id,))
+
+    opponents = {}
+    for player, opponent in cursor.fetchall():
+        opponents.setdefault(player, set()).add(opponent)
+    return opponents
+
+
+def _searchPairs(ranked, opponents, limit=PAIRING_SEARCH_LIMIT):
+    """Pairs players without rematches, keeping partners as close in rank as possible.
+
+    The first descent is a greedy pass: the best unpaired player takes the
+    nearest-ranked unpaired player they have not met, which floats players
+    down into the next score group when their own group runs out. Dead ends
+    backtrack to the most recent choice. Unpaired positions are kept in a
+    doubly linked list so each step is O(1) and backtracking is exact.
+
+    Args:
+        ranked: player IDs, best first
+        opponents: dict of player ID -> set of previous opponents' IDs
+        limit: maximum number of candidates to examine before giving up
+
+    Returns:
+        list of (position, position) pairs into ranked, or None if no
+        rematch-free pairing was found within the limit.
+    """
+    n = len(ranked)
+    head = n
+    nxt = range(1, n + 1) + [0]
+    prv = [head] + range(n)
+    met = [opponents.get(player, ()) for player in ranked]
+
+    def remove(x):
+        nxt[prv[x]] = nxt[x]
+        prv[nxt[x]] = prv[x]
+
+    def restore(x):
+        nxt[prv[x]] = x
+        prv[nxt[x]] = x
+
+    stack = []
+    steps = 0
+    i = nxt[head]
+    while i != head:
+        remove(i)
+        j = nxt[i]
+        while j != head and ranked[j] in met[i]:
+            j = nxt[j]
+            steps += 1
+        while j == head:
+            # dead end: undo the latest pair and try that player's next candidate.
+            restore(i)
+            steps += 1
+            if not stack or steps > limit:
+                return None
+            i, j = stack.pop()
+            restore(j)
+            j = nxt[j]
+            while j != head and ranked[j] in met[i]:
+                j = nxt[j]
+                steps += 1
+        remove(j)
+        stack.append((i, j))
+        i = nxt[head]
+
+    return stack
+
+
+def _minCostPairs(positions, cost):
+    """Exact minimum-cost perfect matching of a small, even set of positions.
+
+    Dynamic programming over subsets, always pairing the lowest remaining
+    position, so it is only used on windows of PAIRING_WINDOW or fewer.
+    """
+    k = len(positions)
+    best = {0: (0, None)}
+
+    def solve(mask):
+        if mask in best:
+            return best[mask][0]
+        low = (mask & -mask).bit_length() - 1
+        rest = mask & ~(1 << low)
+        result = None
+        for other in range(low + 1, k):
+            if rest & (1 << other):
+                total = (cost(positions[low], positions[other]) +
+                         solve(rest & ~(1 << other)))
+                if result is None or total < result[0]:
+                    result = (total, other)
+        best[mask] = (result[0], (low, result[1]))
+        return result[0]
+
+    mask = (1 << k) - 1
+    solve(mask)
+    pairs = []
+    while mask:
+        low, other = best[mask][1]
+        pairs.append((positions[low], positions[other]))
+        mask &= ~(1 << low) & ~(1 << other)
+    return pairs
+
+
+def _weightedPairs(ranked, opponents):
+    """Pairs players when no rematch-free pairing was found, minimizing rematches.
+
+    A greedy pass pairs everyone it can, then the players it strands are
+    re-matched together with the lowest-ranked greedy pairs by an exact
+    minimum-cost matching, where a rematch costs more than any difference
+    in rank. Large leftovers are matched in consecutive rank windows. A
+    window only reaches nearby players, so each rematch left over is then
+    broken up if any two players anywhere in the field can swap partners
+    with it without a rematch, nearest in rank first.
+    """
+    met = [opponents.get(player, ()) for player in ranked]
+
+    def cost(a, b):
+        return abs(a - b) + (REMATCH_COST if ranked[b] in met[a] else 0)
+
+    n = len(ranked)
+    pairs = []
+    stranded = []
+    paired = set()
+    for i in xrange(n):
+        if i in paired:
+            continue
+        for j in xrange(i + 1, n):
+            if j not in paired and ranked[j] not in met[i]:
+                pairs.append((i, j))
+                paired.update((i, j))
+                break
+        else:
+            stranded.append(i)
+            paired.add(i)
+
+    # give the matching room to swap partners with nearby greedy pairs.
+    while pairs and len(stranded) < PAIRING_WINDOW:
+        stranded.extend(pairs.pop())
+    stranded.sort()
+
+    for start in range(0, len(stranded), PAIRING_WINDOW):
+        window = stranded[start:start + PAIRING_WINDOW]
+        pairs.extend(_minCostPairs(window, cost))
+
+    partner = {}
+    for a, b in pairs:
+        partner[a] = b
+        partner[b] = a
+    for a in xrange(n):
+        b = partner[a]
+        if ranked[b] not in met[a]:
+            continue
+        # float a's nearest unplayed partner c down to a, and b takes c's partner.
+        for distance in xrange(1, n):
+            for c in (a - distance, a + distance):
+                if not 0 <= c < n or c == b or ranked[c] in met[a]:
+                    continue
+                d = partner[c]
+                if d != a and ranked[d] not in met[b]:
+                    partner.update({a: c, c: a, b: d, d: b})
+                    break
             else:
-                pass
+                continue
+            break
+    return [(a, b) for a, b in partner.iteritems() if a < b]
+
+
+def loadByes(tournament_id, cursor):
+    """Returns a dict of player ID -> number of byes, for players with any."""
+
+    # any function using this one must have validated its IDs first.
+
+    sql_statement = ("SELECT player_id, byes FROM tournament_players"
+                     " WHERE tournament_id = %s AND byes > 0;")
+    cursor.execute(sql_statement, (tournament_id,))
+    return dict(cursor.fetchall())
+
+
+def _pickBye(ranked, byes):
+    """Returns the lowest-ranked player with the fewest byes so far."""
+    fewest = min(byes.get(player, 0) for player in ranked)
+    for player in reversed(ranked):
+        if byes.get(player, 0) == fewest:
+            return player
+
+
+def _pairPlayers(ranked, opponents):
+    """Returns pairs of player IDs for the next round.
+
+    Args:
+        ranked: player IDs, best first; must have an even length
+        opponents: dict of player ID -> set of previous opponents' IDs
+
+    Returns:
+        list of (id1, id2) tuples, in rank order of each pair's better player
+    """
+    pairs = _searchPairs(ranked, opponents)
+    if pairs is None:
+        pairs = _weightedPairs(ranked, opponents)
+    pairs = sorted(tuple(sorted(pair)) for pair in pairs)
+    return [(ranked[a], ranked[b]) for a, b in pairs]
+
+
+def _podSizes(nPlayers):
+    """Returns the table sizes for a round of nPlayers, largest first.
+
+    As few tables as PLAYERS_PER_MATCH allows, filled as evenly as possible,
+    so a remainder is spread over smaller tables at the bottom (10 players
+    in pods of 4 sit 4, 3, 3). A table of 1 is a bye, which only happens
+    in two-player matches or to a lone player.
+    """
+    if not nPlayers:
+        return []
+    tables = -(-nPlayers // PLAYERS_PER_MATCH)
+    return [nPlayers // tables + (1 if table < nPlayers % tables else 0)
+            for table in range(tables)]
+
+
+def _needsBye(nPlayers):
+    """Returns whether a round of nPlayers has a bye."""
+    return _podSizes(nPlayers)[-1:] == [1]
+
+
+def _isMatchSize(nPlayers):
+    """Returns whether a match (not a bye) can have nPlayers players."""
+    return 2 <= nPlayers <= PLAYERS_PER_MATCH
+
+
+def _podPlayers(ranked, opponents, sizes):
+    """Seats players at tables of the given sizes, close in rank and avoiding rematches.
+
+    Tables are filled from the top of the standings: each table's best
+    unseated player is joined by the nearest-ranked unseated players who
+    have met nobody at the table yet, looking POD_SEARCH_WINDOW players
+    ahead, or else by whoever there has met the fewest. Then any player
+    with a rematch at their table is swapped with a player up to
+    POD_SWAP_RANGE tables away whenever that lowers the number of
+    rematches, until no swap does.
+
+    Args:
+        ranked: player IDs, best first; as many as sizes add up to
+        opponents: dict of player ID -> set of previous opponents' IDs
+        sizes: number of players at each table, as from _podSizes
 
+    Returns:
+        list of tuples of player IDs, one per table, each in rank order, in
+        rank order of each table's best player
+    """
+    n = len(ranked)
+    head = n
+    nxt = range(1, n + 1) + [0]
+    prv = [head] + range(n)
+    met = [opponents.get(player, ()) for player in ranked]
+
+    def remove(x):
+        nxt[prv[x]] = nxt[x]
+        prv[nxt[x]] = prv[x]
+
+    def rematches(pod, x, skip=None):
+        return sum(1 for k in pod if k != skip and ranked[x] in met[k])
+
+    pods = []
+    for size in sizes:
+        pod = [nxt[head]]
+        remove(pod[0])
+        while len(pod) < size:
+            best = bestCount = None
+            j = nxt[head]
+            for _ in xrange(POD_SEARCH_WINDOW):
+                if j == head:
+                    break
+                count = rematches(pod, j)
+                if bestCount is None or count < bestCount:
+                    best, bestCount = j, count
+                    if not count:
+                        break
+                j = nxt[j]
+            remove(best)
+            pod.append(best)
+        pods.append(pod)
+
+    def swap(a, x):
+        """Swaps x out of table a if that lowers the rematches; returns whether it did."""
+        podA = pods[a]
+        countX = rematches(podA, x, x)
+        nearby = sorted(range(max(a - POD_SWAP_RANGE, 0),
+                              min(a + POD_SWAP_RANGE + 1, len(pods))),
+                        key=lambda b: abs(b - a))
+        for b in nearby[1:]:
+            podB = pods[b]
+            for y in podB:
+                before = countX + rematches(podB, y, y)
+                if rematches(podA, y, x) + rematches(podB, x, y) < before:
+                    podA[podA.index(x)] = y
+                    podB[podB.index(y)] = x
+                    return True
+        return False
+
+    # every swap removes at least one rematch, so this ends.
+    swapped = True
+    while swapped:
+        swapped = False
+        for a, pod in enumerate(pods):
+            for x in list(pod):
+                if rematches(pod, x, x) and swap(a, x):
+                    swapped = True
+
+    pods = sorted(sorted(pod) for pod in pods)
+    return [tuple(ranked[i] for i in pod) for pod in pods]
+
+
+def _roundPairings(standings, opponents, byes, isNewRound=None, ratings=None):
+    """Pairs the next round from standings rows, as swissPairings returns it.
+
+    Args:
+        standings: rows of (id, name, score, matches), best first
+        opponents: dict of player ID -> set of previous opponents' IDs
+        byes: dict of player ID -> number of byes, for players with any
+        isNewRound: whether the last round is complete, if known; otherwise
+            it is worked out from the players' match counts
+        ratings: optional dict of player ID -> rating to seed the first
+            round by; ignored once anyone has played
+    """
+    if isNewRound is None:
+        nMatchesOnly = [x[3] for x in standings]
+
+        # check if all players have played the same number of matches as the top player.
+        isNewRound = True if all(
+            playerMatches == standings[0][3] for playerMatches in nMatchesOnly) else False
+
+    if not isNewRound:
+        print("Warning: using swissPairings before a round is complete can "
+              "result in meaningless pairings.")
+
+    names = dict((row[0], row[1]) for row in standings)
+    ranked = [row[0] for row in standings]
+    sizes = _podSizes(len(ranked))
+    seeded = ratings is not None and not any(row[3] for row in standings)
+    if seeded:
+        ranked.sort(key=lambda player: (-ratings[player], player))
+
+    byePlayer = None
+    if sizes and sizes[-1] == 1:
+        byePlayer = _pickBye(ranked, byes)
+        ranked.remove(byePlayer)
+        sizes.pop()
+
+    if seeded:
+        # the top of the field meets the next band down, as in a seeded Swiss:
+        # with pairs, the top half plays the bottom half in order.
+        tables = [tuple(ranked[table::len(sizes)]) for table in range(len(sizes))]
+    elif PLAYERS_PER_MATCH == 2:
+        tables = _pairPlayers(ranked, opponents)
     else:
-        raise ValueError("Invalid winner ID.")
+        tables = _podPlayers(ranked, opponents, sizes)
+    roundPairings = [sum(((player, names[player]) for player in table), ())
+                     for table in tables]
+    if byePlayer is not None:
+        roundPairings.append((byePlayer, names[byePlayer], None, None))
 
-    db.commit()
-    db.close()
+    return roundPairings
 
 
-def swissPairings(tournament_id):
+def swissPairings(tournament_id, seeded=False):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings.  Each player is paired
+    with another player with an equal or nearly-equal win record, that is, a
+    player adjacent to him or her in the standings, skipping anyone they have
+    already played. Rematches only happen when the search finds no other
+    pairing and no swap of partners across the field avoids them.
+    With an odd number of players, the lowest-ranked player who has not had a
+    bye yet gets one; record it with reportBye (or as (id1, id1) in
+    reportRound).
+
+    If PLAYERS_PER_MATCH is more than 2, players are seated in pods of that
+    many instead, with as few repeat opponents at each table as possible.
+    When the field does not divide evenly, the lowest tables are one or more
+    seats smaller rather than anyone getting a bye.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+        id2: the second player's unique id, or None for a bye
+        name2: the second player's name, or None for a bye
+      For pods, each tuple continues with the id and name of every other
+      player at the table. The bye, if any, is the last tuple.
+
+    Args:
+      tournament_id: serial ID of the tournament
+      seeded: if True and no one has played yet, seed the first round by
+        rating instead of player ID: the top-rated half of the field plays
+        the bottom half, and in pods each table gets one player from each
+        band of ratings
     """
 
-    argDict = locals()
-    checkCleanArgs(argDict)
+    tournament_id = validId(tournament_id, "tournament ID")
 
-    db, c = connect()
+    if seeded:
+        # ratings change with other tournaments' results, so this is not cached.
+        roundPairings = _loadPairings(tournament_id, seeded)
+    else:
+        roundPairings = list(_cache.read(tournament_id, ('pairings',),
+                                         lambda: _loadPairings(tournament_id)))
 
-    standings = playerStandings(tournament_id)
-    # playerStandings also internally asserts correct number of players.
-    nMatchesOnly = [x[3] for x in standings]
+    print(roundPairings)
 
-    # check if all players have played the same number of matches as the top player.
-    isNewRound = True if all(
-        playerMatches == standings[0][3] for playerMatches in nMatchesOnly) else False
+    return roundPairings
 
-    if not isNewRound:
-        print("Warning: using swissPairings before a round is complete can "
-              "result in meaningless pairings.")
 
-    sql_statement = """SELECT * FROM pairings(%s);"""
-    c.execute(sql_statement, (tournament_id,))
+def _loadPairings(tournament_id, seeded=False):
+    """Pairs the next round from the database; IDs must be validated."""
 
-    roundPairings = c.fetchall()
+    with _store.session() as c:
+        # shares this session's connection rather than opening another one.
+        standings = playerStandings(tournament_id)
+        opponents = loadOpponents(tournament_id, c)
+        byes = loadByes(tournament_id, c) if _needsBye(len(standings)) else {}
+        latest = _latestRound(c, tournament_id)
+        ratings = _seedRatings(tournament_id, standings) if seeded else None
 
-    db.close()
+    # started rounds count their reported matches, so no scan is needed.
+    isNewRound = None if latest is None else latest[3] or latest[1] == latest[2]
+    return _roundPairings(standings, opponents, byes, isNewRound, ratings)
+
+
+def _seedRatings(tournament_id, standings):
+    """Returns the players' ratings to seed the first round by, or None after it."""
+    if any(row[3] for row in standings):
+        return None
+    return dict((row[0], row[2]) for row in playerRatings(tournament_id))
+
+
+def _latestRound(cursor, tournament_id):
+    """Returns the latest round's (number, matches reported, matches, closed), or None."""
+
+    # any function using this one must have validated its IDs first.
+
+    sql_statement = ("SELECT round_number, matches_reported, matches_total, closed"
+                     " FROM rounds WHERE tournament_id = %s"
+                     " ORDER BY round_number DESC LIMIT 1;")
+    cursor.execute(sql_statement, (tournament_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return (row[0], row[1], row[2], bool(row[3]))
+
+
+def startRound(tournament_id, seeded=False):
+    """Pairs the next round and stores its pairings.
+
+    Until the round is closed, every result reported in the tournament must
+    be for one of its tables, and each table can only be reported once.
+
+    Args:
+        tournament_id: serial ID of the tournament
+        seeded: whether to seed the first round by rating, as for swissPairings
+
+    Returns:
+        the round's pairings, as swissPairings returns them
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    with _store.session() as c:
+        latest = _latestRound(c, tournament_id)
+        assert latest is None or latest[3], "Round {0} is still open.".format(
+            latest[0] if latest else None)
+        c.execute("SELECT COUNT(*) FROM bracket_matches WHERE tournament_id = %s;",
+                  (tournament_id,))
+        assert not c.fetchone()[0], (
+            "Tournament {0} has gone on to its playoff.".format(tournament_id))
+
+        standings = playerStandings(tournament_id)
+        assert standings, "Tournament {0} has no players.".format(tournament_id)
+        opponents = loadOpponents(tournament_id, c)
+        byes = loadByes(tournament_id, c) if _needsBye(len(standings)) else {}
+        ratings = _seedRatings(tournament_id, standings) if seeded else None
+        roundPairings = _roundPairings(standings, opponents, byes, True, ratings)
+
+        round_number = latest[0] + 1 if latest else 1
+        try:
+            round_id = _store.insertRows(
+                c, "rounds", ("tournament_id", "round_number", "matches_total"),
+                [(tournament_id, round_number, len(roundPairings))],
+                returning="round_id")[0]
+        except _store.IntegrityError:
+            # another call started the same round first.
+            raise AssertionError("Round {0} was already started.".format(round_number))
+
+        _invalidate(tournament_id)
+        seating = []
+        for table, pairing in enumerate(roundPairings, 1):
+            players = [player for player in pairing[0::2] if player is not None]
+            seating.extend((round_id, player, table, len(players)) for player in players)
+        _store.insertRows(
+            c, "round_pairings", ("round_id", "player_id", "table_number", "seats"),
+            seating)
+        _publish(c, tournament_id, 'round', round=round_number, closed=False,
+                 tables=[[player for player in pairing[0::2] if player is not None]
+                         for pairing in roundPairings])
+
+    return roundPairings
+
+
+def currentRound(tournament_id):
+    """Returns the status of a tournament's latest round, read from one row.
+
+    Args:
+        tournament_id: serial ID of the tournament
+
+    Returns:
+        A tuple (round_number, matches_reported, matches, closed), or None if
+        no round has been started:
+            round_number: 1 for the first round started
+            matches_reported: how many of its tables have a result
+            matches: how many tables it has, including a bye
+            closed: whether closeRound has been called for it
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    with _store.session() as c:
+        latest = _latestRound(c, tournament_id)
+        if latest is None:
+            checkTournament(tournament_id, c)
+
+    return latest
+
+
+def closeRound(tournament_id):
+    """Closes a tournament's open round once every table has reported.
+
+    Args:
+        tournament_id: serial ID of the tournament
+
+    Returns:
+        round_number: number of the closed round
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    with _store.session() as c:
+        latest = _latestRound(c, tournament_id)
+        if latest is None:
+            checkTournament(tournament_id, c)
+        assert latest is not None and not latest[3], "No round is open."
+
+        # the counter test repeats in the UPDATE in case a result is in flight.
+        c.execute("UPDATE rounds SET closed = %s WHERE tournament_id = %s"
+                  " AND round_number = %s AND matches_reported = matches_total;",
+                  (True, tournament_id, latest[0]))
+        _invalidate(tournament_id)
+        assert c.rowcount == 1, (
+            "Round {0} is not complete: {1} of {2} matches reported.".format(*latest[:3]))
+        _publish(c, tournament_id, 'round', round=latest[0], closed=True)
+
+    return latest[0]
+
+
+def _bracketOrder(size):
+    """Returns seeds 1 to size in first-round bracket order.
+
+    Adjacent seeds play each other, and the better of each pair meets the
+    better of the next pair, so the top two seeds can only meet in the
+    final: for 8, 1-8, 4-5, 2-7, 3-6.
+    """
+    order = [1]
+    while len(order) < size:
+        order = [seed for top in order for seed in (top, 2 * len(order) + 1 - top)]
+    return order
+
+
+def startBracket(tournament_id, size=8, tiebreakers=BRACKET_TIEBREAKERS):
+    """Seeds a single-elimination playoff from the final standings and stores it.
+
+    Args:
+        tournament_id: serial ID of the tournament
+        size: number of players in the playoff, a power of two
+        tiebreakers: tiebreakers to order the standings by, as for playerStandings
+
+    Returns:
+        The first round's matches, as swissPairings returns them: tuples of
+        (id1, name1, id2, name2) with the better seed first, in bracket order.
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+    assert size >= 2 and size & (size - 1) == 0, "Bracket size must be a power of two."
+
+    with _store.session() as c:
+        latest = _latestRound(c, tournament_id)
+        assert latest is None or latest[3], "Round {0} is still open.".format(
+            latest[0] if latest else None)
+
+        standings = playerStandings(tournament_id, tiebreakers)
+        assert len(standings) >= size, (
+            "Tournament {0} has {1} players, too few for a top {2}.".format(
+                tournament_id, len(standings), size))
+
+        order = _bracketOrder(size)
+        rows = [(tournament_id, 1, slot, top, standings[top - 1][0],
+                 bottom, standings[bottom - 1][0])
+                for slot, (top, bottom) in enumerate(zip(order[0::2], order[1::2]), 1)]
+        bracketRound = 2
+        while size > 2:
+            size //= 2
+            rows.extend((tournament_id, bracketRound, slot, None, None, None, None)
+                        for slot in range(1, size // 2 + 1))
+            bracketRound += 1
+
+        def diagnose():
+            c.execute("SELECT COUNT(*) FROM bracket_matches WHERE tournament_id = %s;",
+                      (tournament_id,))
+            assert not c.fetchone()[0], "Tournament {0} already has a bracket.".format(
+                tournament_id)
+
+        with _store.constraintCheck(c, diagnose):
+            _store.insertRows(c, "bracket_matches",
+                              ("tournament_id", "bracket_round", "slot",
+                               "seed_a", "player_a", "seed_b", "player_b"),
+                              rows)
+        _invalidate(tournament_id)
+        _publish(c, tournament_id, 'bracket')
+
+    return [(row[4], standings[row[3] - 1][1], row[6], standings[row[5] - 1][1])
+            for row in rows if row[1] == 1]
+
+
+def bracketState(tournament_id):
+    """Returns a tournament's whole playoff bracket, read with one indexed query.
+
+    Args:
+        tournament_id: serial ID of the tournament
+
+    Returns:
+        A list of tuples, by round and then slot (empty if no bracket was started):
+            (round, slot, seed1, id1, name1, seed2, id2, name2, winner_id)
+            round: 1 for the first round of the playoff
+            slot: the match's place in its round, from 1; the winner of
+                slot n goes on to slot (n + 1) / 2 of the next round
+            seed1, id1, name1: the first player's seed, id and name, or
+                None until they have advanced
+            seed2, id2, name2: the same for the second player
+            winner_id: the winner's id, or None until reported
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+
+    return list(_cache.read(tournament_id, ('bracket',),
+                            lambda: _loadBracket(tournament_id)))
 
-    print(roundPairings)
 
-    return roundPairings
\ No newline at end of file
+def _loadBracket(tournament_id):
+    """Reads bracketState's rows from the database; IDs must be validated."""
+
+    with _store.session() as c:
+        c.execute("SELECT b.bracket_round, b.slot, b.seed_a, b.player_a, a.p_name,"
+                  " b.seed_b, b.player_b, o.p_name, b.winner_id"
+                  " FROM bracket_matches AS b"
+                  " LEFT JOIN players AS a ON (a.player_id = b.player_a)"
+                  " LEFT JOIN players AS o ON (o.player_id = b.player_b)"
+                  " WHERE b.tournament_id = %s ORDER BY b.bracket_round, b.slot;",
+                  (tournament_id,))
+        bracket = [tuple(row) for row in c.fetchall()]
+        if not bracket:
+            checkTournament(tournament_id, c)
+
+    return bracket
+
+
+def nextBracketMatches(tournament_id):
+    """Returns the playoff matches ready to be played, from bracketState.
+
+    Returns:
+        tuples of (id1, name1, id2, name2), as swissPairings returns them,
+        better seed first; empty once the final has been reported
+    """
+
+    return [(row[3], row[4], row[6], row[7]) if row[2] < row[5] else
+            (row[6], row[7], row[3], row[4])
+            for row in bracketState(tournament_id)
+            if row[3] is not None and row[6] is not None and row[8] is None]
+
+
+def reportBracketMatch(tournament_id, winner_id):
+    """Records the result of a playoff match and advances the winner.
+
+    The match is recorded like any other (see reportMatch) and counts
+    towards the players' ratings, but not their Swiss scores, match counts
+    or tiebreakers, so the standings stay as they were seeded from. There
+    are no ties in a playoff.
+
+    Args:
+        tournament_id: serial ID of the tournament
+        winner_id: the player who won their current playoff match
+
+    Returns:
+        match_id: serial ID of the recorded match
+    """
+
+    tournament_id = validId(tournament_id, "tournament ID")
+    winner_id = validId(winner_id, "winner ID")
+
+    with _store.session() as c:
+        c.execute("SELECT bracket_round, slot, seed_a, player_a, seed_b, player_b"
+                  " FROM bracket_matches WHERE tournament_id = %s AND winner_id IS NULL"
+                  " AND (player_a = %s OR player_b = %s)" + _store.forUpdate + ";",
+                  (tournament_id, winner_id, winner_id))
+        row = c.fetchone()
+        if row is None:
+            checkTournament(tournament_id, c)
+        assert row is not None, "Player ID {0} has no playoff match to play.".format(
+            winner_id)
+        bracketRound, slot, seed_a, player_a, seed_b, player_b = row
+        assert player_a is not None and player_b is not None, (
+            "Player ID {0}'s playoff opponent is not decided yet.".format(winner_id))
+
+        match_id = _recordMatches(c, tournament_id, [(winner_id, (player_a, player_b))],
+                                  playoff=True)[0]
+
+        c.execute("UPDATE bracket_matches SET winner_id = %s, match_id = %s"
+                  " WHERE tournament_id = %s AND bracket_round = %s AND slot = %s;",
+                  (winner_id, match_id, tournament_id, bracketRound, slot))
+        # odd slots fill the first place of the next match, even ones the second.
+        side = "a" if slot % 2 else "b"
+        c.execute("UPDATE bracket_matches SET seed_{0} = %s, player_{0} = %s"
+                  " WHERE tournament_id = %s AND bracket_round = %s AND slot = %s;".format(side),
+                  (seed_a if winner_id == player_a else seed_b, winner_id,
+                   tournament_id, bracketRound + 1, (slot + 1) // 2))
+        _publish(c, tournament_id, 'bracket')
+
+    return match_id
+
+
+class TournamentState(object):
+    """In-memory copy of one tournament for serving a live event.
+
+    Loads the tournament's players, scores, match counts, byes and previous
+    opponents once, then answers standings, pairings and membership checks
+    from memory. Results reported through it are written to the database
+    first, in one transaction, and applied to memory only if the write
+    succeeds.
+
+    Changes made to the tournament by anything else (other processes, or the
+    module-level functions) are not seen until reload() is called.
+    """
+
+    def __init__(self, tournament_id, store=None):
+        self.tournament_id = tournament_id
+        self.store = store or _store
+        self.reload()
+
+    def reload(self):
+        """Re-reads the tournament from the database."""
+
+        self.tournament_id = validId(self.tournament_id, "tournament ID")
+
+        with self.store.session() as c:
+            checkTournament(self.tournament_id, c)
+            c.execute("SELECT tp.player_id, p.p_name, tp.p_t_score,"
+                      " tp.matches_played, tp.byes"
+                      " FROM tournament_players AS tp"
+                      " INNER JOIN players AS p ON (tp.player_id = p.player_id)"
+                      " WHERE tp.tournament_id = %s ORDER BY tp.player_id;",
+                      (self.tournament_id,))
+            rows = c.fetchall()
+            opponents = loadOpponents(self.tournament_id, c)
+
+        self.players = array('l', [row[0] for row in rows])
+        self.names = [row[1] for row in rows]
+        self.scores = array('l', [row[2] for row in rows])
+        self.matches = array('l', [row[3] for row in rows])
+        self.byes = array('l', [row[4] for row in rows])
+        self.opponents = [opponents.get(row[0], set()) for row in rows]
+        self._index = dict((player, i) for i, player in enumerate(self.players))
+        self._standings = None
+
+    def isMember(self, player_id):
+        """Returns whether a player is registered in this tournament."""
+        return player_id in self._index
+
+    def standings(self):
+        """Returns the same rows as playerStandings(tournament_id)."""
+        if self._standings is None:
+            order = sorted(range(len(self.players)),
+                           key=lambda i: (-self.scores[i], self.players[i]))
+            self._standings = [(self.players[i], self.names[i],
+                                self.scores[i], self.matches[i])
+                               for i in order]
+        return list(self._standings)
+
+    def pairings(self):
+        """Returns the same pairings as swissPairings(tournament_id)."""
+        opponents = dict(zip(self.players, self.opponents))
+        byes = dict((player, n) for player, n in zip(self.players, self.byes) if n)
+        return _roundPairings(self.standings(), opponents, byes)
+
+    def reportMatch(self, winner_id, *args):
+        """Records one match like reportMatch(tournament_id, winner_id, *args).
+
+        Returns:
+            match_id: serial ID of the recorded match
+        """
+        assert _isMatchSize(len(set(args))), "Bad number of players"
+        return self.reportRound([(winner_id,) + args])[0]
+
+    def reportBye(self, player_id):
+        """Records a bye like reportBye(tournament_id, player_id)."""
+        return self.reportRound([(player_id, player_id)])[0]
+
+    def reportRound(self, results):
+        """Records many results like reportRound(tournament_id, results).
+
+        Membership is checked in memory. Only a started round's results are
+        checked in the database, against its stored pairings, in one query.
+        """
+        results = [(validId(result[0], "winner ID", allowZero=True),
+                    tuple(validId(player, "player ID") for player in result[1:]))
+                   for result in results]
+
+        seen = set()
+        for n, (winner_id, players) in enumerate(results):
+            isBye = len(players) == 1 and winner_id == players[0]
+            assert isBye or (len(players) == len(set(players)) and
+                             _isMatchSize(len(players))), (
+                "Bad number of players in match {0}".format(n))
+            if winner_id != 0 and winner_id not in players:
+                raise ValueError("Invalid winner ID in match {0}.".format(n))
+            for player in players:
+                assert player in self._index, (
+                    "Player ID {0} not in tournament.".format(player))
+                assert player not in seen, (
+                    "Player ID {0} reported twice in round.".format(player))
+                seen.add(player)
+
+        with self.store.session() as c:
+            match_ids = _recordMatches(c, self.tournament_id, results, self.store)
+
+        for winner_id, players in results:
+            for player, points in _matchPoints(winner_id, players):
+                i = self._index[player]
+                self.scores[i] += points
+                self.matches[i] += 1
+                if len(players) == 1:
+                    self.byes[i] += 1
+                self.opponents[i].update(p for p in players if p != player)
+        self._standings = None
+
+        return match_ids
+
+
+# every public function, and TournamentState's methods, report to the hooks.
+for _function in (sanitize, connect, addTournament, checkTournament,
+                  deleteTournaments, deleteThisTournament, deletePlayers,
+                  deletePlayersInTournament, countPlayers, countPlayersInTournament,
+                  registerPlayer, registerPlayers, checkPlayer,
+                  checkPlayerInTournament, registerPlayerInTournament,
+                  registerPlayersInTournament, checkTournamentPlayerCount,
+                  deleteMatches, deleteMatchesInTournament, playerStandings,
+                  checkPlayersInTournament, reportMatch, reportRound, reportBye,
+                  playerRatings, recomputeRatings, recomputeTiebreakers,
+                  loadOpponents, loadByes,
+                  swissPairings, startRound, currentRound, closeRound,
+                  startBracket, bracketState, nextBracketMatches,
+                  reportBracketMatch, applyChanges):
+    globals()[_function.__name__] = _instrumented(_function)
+for _function in (TournamentState.reload, TournamentState.standings,
+                  TournamentState.pairings, TournamentState.reportMatch,
+                  TournamentState.reportBye, TournamentState.reportRound):
+    setattr(TournamentState, _function.__name__, _instrumented(
+        _function.__func__, "TournamentState." + _function.__name__))
+del _function
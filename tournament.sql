@@ -22,7 +22,10 @@ CREATE TABLE tournaments(
 DROP TABLE IF EXISTS players;
 CREATE TABLE players(
     player_id   SERIAL PRIMARY KEY,
-    p_name      VARCHAR(30) NOT NULL
+    p_name      VARCHAR(30) NOT NULL,
+    -- Elo rating across all tournaments, updated with each reported match.
+    rating      DOUBLE PRECISION NOT NULL DEFAULT 1500,
+    rated_matches INTEGER NOT NULL DEFAULT 0
 );
 
 DROP TABLE IF EXISTS tournament_players;
@@ -33,9 +36,39 @@ CREATE TABLE tournament_players(
                             ON UPDATE CASCADE ON DELETE CASCADE,
     p_t_score       INTEGER DEFAULT 0,
     -- this score field will get updated frequently, to minimize #queries to get standings.
+    -- so are these per-tournament aggregates, in the same transaction as each match.
+    matches_played  INTEGER NOT NULL DEFAULT 0,
+    wins            INTEGER NOT NULL DEFAULT 0,
+    ties            INTEGER NOT NULL DEFAULT 0,
+    losses          INTEGER NOT NULL DEFAULT 0,
+    byes            INTEGER NOT NULL DEFAULT 0,
+    -- tiebreaker totals over the opponents met in Swiss matches, kept up to
+    -- date with the opponents' scores: how many were met, the sum of their
+    -- floored match-win percentages, their points, their points weighted by
+    -- the result (Sonneborn-Berger) and the points earned against those on
+    -- the same score.
+    opp_count       INTEGER NOT NULL DEFAULT 0,
+    opp_mwp         DOUBLE PRECISION NOT NULL DEFAULT 0,
+    opp_points      INTEGER NOT NULL DEFAULT 0,
+    sb_points       DOUBLE PRECISION NOT NULL DEFAULT 0,
+    h2h_points      INTEGER NOT NULL DEFAULT 0,
     primary key (player_id, tournament_id)
 );
 
+DROP TABLE IF EXISTS rounds;
+CREATE TABLE rounds(
+    round_id        SERIAL PRIMARY KEY,
+    tournament_id   INTEGER NOT NULL REFERENCES tournaments(tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    round_number    INTEGER NOT NULL,
+    -- kept up to date by startRound and each reported match, so round status
+    -- is read from one row.
+    matches_total   INTEGER NOT NULL,
+    matches_reported INTEGER NOT NULL DEFAULT 0,
+    closed          BOOLEAN NOT NULL DEFAULT FALSE,
+    UNIQUE (tournament_id, round_number)
+);
+
 DROP TABLE IF EXISTS matches;
 CREATE TABLE matches(
     match_id        SERIAL PRIMARY KEY,
@@ -43,52 +76,105 @@ CREATE TABLE matches(
                             ON UPDATE CASCADE ON DELETE CASCADE,
     -- winnerID is serial ID of player if there was a winner, and 0 if there was a tie.
     winner_id       INTEGER REFERENCES players(player_id)
-                            ON UPDATE CASCADE ON DELETE CASCADE
+                            ON UPDATE CASCADE ON DELETE CASCADE,
                     -- deleting winner player deletes the match.
+    -- a bye has the receiving player as both winner and only match player.
+    is_bye          BOOLEAN NOT NULL DEFAULT FALSE,
+    -- set by reportMatch/reportRound callers to make retries safe.
+    idempotency_key VARCHAR(100),
+    -- the started round and table the match was paired at, if any.
+    round_id        INTEGER REFERENCES rounds(round_id)
+                            ON UPDATE CASCADE ON DELETE SET NULL,
+    table_number    INTEGER,
+    -- a playoff match (see bracket_matches): rated, but not counted in the
+    -- Swiss scores or tiebreakers.
+    is_playoff      BOOLEAN NOT NULL DEFAULT FALSE,
     -- constraint on winner_id values is managed in Python code.
+    -- lets match_players reference the match and its tournament together.
+    UNIQUE (match_id, tournament_id),
+    -- a key records at most one match; NULL keys never conflict.
+    UNIQUE (tournament_id, idempotency_key),
+    -- each table of a round is reported once.
+    UNIQUE (round_id, table_number),
+    -- a bye is always won. That a winner played in the match is checked in
+    -- Python: a CHECK cannot see match_players.
+    CHECK (winner_id IS NOT NULL OR NOT is_bye)
 );
 
 DROP TABLE IF EXISTS match_players;
 CREATE TABLE match_players(
-    match_id    INTEGER REFERENCES matches(match_id)
-                        ON UPDATE CASCADE ON DELETE CASCADE,
-    player_id   INTEGER REFERENCES players(player_id)
-                        ON UPDATE CASCADE ON DELETE CASCADE
+    match_id        INTEGER NOT NULL,
+    -- copied from matches so per-tournament counts never touch other tournaments.
+    tournament_id   INTEGER NOT NULL,
+    player_id       INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- leads with the foreign key's columns, so the ON DELETE CASCADE from
+    -- matches finds rows through it (SQLite needs all of them to use an index).
+    primary key (match_id, tournament_id, player_id),
+    FOREIGN KEY (match_id, tournament_id) REFERENCES matches(match_id, tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- only registered players play; reports rely on this instead of checking.
+    FOREIGN KEY (player_id, tournament_id)
+                            REFERENCES tournament_players(player_id, tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+DROP TABLE IF EXISTS round_pairings;
+CREATE TABLE round_pairings(
+    round_id        INTEGER NOT NULL REFERENCES rounds(round_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    player_id       INTEGER NOT NULL REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- players at the same table play each other; a bye has a table to itself.
+    table_number    INTEGER NOT NULL,
+    seats           INTEGER NOT NULL,
+    primary key (round_id, player_id)
 );
 
--- helper view used to simplify standings and pairings functions
+DROP TABLE IF EXISTS bracket_matches;
+CREATE TABLE bracket_matches(
+    tournament_id   INTEGER NOT NULL REFERENCES tournaments(tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- 1 for the first round of the playoff; slot n of a round feeds slot
+    -- (n + 1) / 2 of the next.
+    bracket_round   INTEGER NOT NULL,
+    slot            INTEGER NOT NULL,
+    -- players are filled in as the previous round's winners advance.
+    seed_a          INTEGER,
+    player_a        INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    seed_b          INTEGER,
+    player_b        INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    winner_id       INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- the result, recorded in matches like any other.
+    match_id        INTEGER REFERENCES matches(match_id)
+                            ON UPDATE CASCADE ON DELETE SET NULL,
+    -- also how the whole bracket is read, in order.
+    primary key (tournament_id, bracket_round, slot)
+);
+
+-- standings and pairings only ever read one tournament at a time.
+CREATE INDEX tournament_players_tournament_idx
+    ON tournament_players (tournament_id, p_t_score DESC, player_id);
+CREATE INDEX matches_tournament_idx ON matches (tournament_id);
+CREATE INDEX match_players_tournament_idx ON match_players (tournament_id, player_id);
+-- used by the ON DELETE CASCADE from players.
+CREATE INDEX matches_winner_idx ON matches (winner_id);
+CREATE INDEX match_players_player_idx ON match_players (player_id);
+CREATE INDEX round_pairings_player_idx ON round_pairings (player_id);
+-- used by the ON DELETE SET NULL from matches.
+CREATE INDEX bracket_matches_match_idx ON bracket_matches (match_id);
+-- at most one open round per tournament; also finds it.
+CREATE UNIQUE INDEX rounds_open_idx ON rounds (tournament_id) WHERE NOT closed;
+
+-- helper view with every player's score and match count in every tournament,
+-- for browsing the data in psql. tournament.py queries the tables directly so
+-- the same SQL also runs on SQLite (see tournament_sqlite.sql).
 CREATE OR REPLACE VIEW full_player_info AS
-    SELECT tp.player_id, tp.tournament_id, tp.p_t_score, mp.nmatches, p.p_name
+    SELECT tp.player_id, tp.tournament_id, tp.p_t_score,
+        tp.matches_played AS nmatches, p.p_name
     FROM tournament_players AS tp
-        LEFT OUTER JOIN
-        --CAST is used because otherwise returns an ugly long int type.
-        (SELECT player_id, CAST(COUNT(*) AS INT) AS nmatches 
-            FROM match_players GROUP BY player_id) AS mp 
-        ON (tp.player_id = mp.player_id) 
         INNER JOIN players AS p ON (tp.player_id = p.player_id)
     ORDER BY tp.p_t_score DESC;
-
--- functions used to accept tournament_id parameter in Python code.
---used in tournament.playerStandings
-CREATE OR REPLACE FUNCTION standings(tourn_id INT)
-    RETURNS TABLE(player_id INT, p_name VARCHAR(30), p_t_score INT, nmatches INT)
-    AS $func$
-    SELECT player_id, p_name, p_t_score, 
-        CASE WHEN nmatches IS NULL THEN 0 ELSE nmatches END
-    FROM full_player_info
-    WHERE tournament_id = tourn_id
-    $func$ LANGUAGE SQL;
-
---used in tournament.swissPairings
-CREATE OR REPLACE FUNCTION pairings(tourn_id INT)
-    RETURNS TABLE(a_player_id INT, a_p_name VARCHAR(30), b_player_id INT, b_p_name VARCHAR(30))
-    AS $func$
-    SELECT a.player_id, a.p_name, b.player_id, b.p_name
-    FROM (SELECT row_number() OVER () AS rn, * 
-        FROM full_player_info) AS a, 
-    (SELECT row_number() OVER () AS rn, * 
-        FROM full_player_info) AS b
-    WHERE a.tournament_id = tourn_id AND b.tournament_id = tourn_id AND
-    -- Change second argument to MOD in addition to overall structure if PLAYERS_PER_MATCH changes 
-        MOD(a.rn,2) = 1 AND b.rn = a.rn + 1
-    $func$ LANGUAGE SQL;
\ No newline at end of file
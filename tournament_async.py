@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# tournament_async.py -- non-blocking versions of the tournament.py functions
+#
+
+# Each function here takes the same arguments as its namesake in tournament.py
+# and runs it on a worker thread, returning at once with a
+# multiprocessing.pool.AsyncResult. Call .get() on it for the result (or the
+# exception the call raised), or pass callback=f to have f called with the
+# result when it is ready, e.g. to hand it back to an event loop. Validation
+# and results are exactly those of the blocking functions, which the workers
+# call, through the same store (see tournament.setStore).
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+import tournament
+
+_workers = None
+_workersLock = threading.Lock()
+
+
+def _getWorkers():
+    """Starts the worker threads on first use, one per pooled connection."""
+    global _workers
+    if _workers is None:
+        with _workersLock:
+            if _workers is None:
+                # SQLiteStore serializes sessions, so more workers would only wait.
+                _workers = ThreadPool(getattr(tournament.getStore(), 'maxconn', 1))
+    return _workers
+
+
+def close():
+    """Waits for submitted calls to finish and stops the worker threads."""
+    global _workers
+    with _workersLock:
+        if _workers is not None:
+            _workers.close()
+            _workers.join()
+            _workers = None
+
+
+def _nonBlocking(function):
+    """Returns a version of function that runs on the worker threads."""
+
+    def call(*args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return _getWorkers().apply_async(function, args, kwargs, callback)
+
+    call.__name__ = function.__name__
+    call.__doc__ = ("Non-blocking tournament.{0}; returns an AsyncResult.\n\n"
+                    "Takes an optional callback=f keyword argument.\n\n"
+                    "{1}").format(function.__name__, function.__doc__)
+    return call
+
+
+addTournament = _nonBlocking(tournament.addTournament)
+deleteTournaments = _nonBlocking(tournament.deleteTournaments)
+deleteThisTournament = _nonBlocking(tournament.deleteThisTournament)
+deletePlayers = _nonBlocking(tournament.deletePlayers)
+deletePlayersInTournament = _nonBlocking(tournament.deletePlayersInTournament)
+countPlayers = _nonBlocking(tournament.countPlayers)
+countPlayersInTournament = _nonBlocking(tournament.countPlayersInTournament)
+registerPlayer = _nonBlocking(tournament.registerPlayer)
+registerPlayers = _nonBlocking(tournament.registerPlayers)
+registerPlayerInTournament = _nonBlocking(tournament.registerPlayerInTournament)
+registerPlayersInTournament = _nonBlocking(tournament.registerPlayersInTournament)
+deleteMatches = _nonBlocking(tournament.deleteMatches)
+deleteMatchesInTournament = _nonBlocking(tournament.deleteMatchesInTournament)
+playerStandings = _nonBlocking(tournament.playerStandings)
+playerRatings = _nonBlocking(tournament.playerRatings)
+recomputeRatings = _nonBlocking(tournament.recomputeRatings)
+reportMatch = _nonBlocking(tournament.reportMatch)
+reportBye = _nonBlocking(tournament.reportBye)
+reportRound = _nonBlocking(tournament.reportRound)
+swissPairings = _nonBlocking(tournament.swissPairings)
+startRound = _nonBlocking(tournament.startRound)
+currentRound = _nonBlocking(tournament.currentRound)
+closeRound = _nonBlocking(tournament.closeRound)
+startBracket = _nonBlocking(tournament.startBracket)
+bracketState = _nonBlocking(tournament.bracketState)
+nextBracketMatches = _nonBlocking(tournament.nextBracketMatches)
+reportBracketMatch = _nonBlocking(tournament.reportBracketMatch)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# tournament_bench.py -- timings of whole simulated Swiss tournaments
+#
+
+# For each field size, registers the players, enrolls them in a new
+# tournament and plays log2(size) rounds of random results, timing every call
+# to tournament.py. Reports latency percentiles and SQL statements per call
+# (counted with tournament.addHook) for each kind of operation, as a table
+# and optionally as JSON.
+#
+#   python tournament_bench.py --sizes 64 1024 --json results.json
+#   python tournament_bench.py --sqlite            # in-memory SQLite
+#   python tournament_bench.py --pod-size 4        # four-player pods
+#
+# Against PostgreSQL it uses the tournament database (see tournament.DSN) and
+# deletes what it created afterwards.
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+import tournament
+
+DEFAULT_SIZES = (64, 256, 1024, 4096, 16384)
+# share of simulated matches that end in a tie.
+TIE_RATE = 0.1
+PERCENTILES = (50, 99)
+
+
+class Bench(object):
+    """Collects timings and statement counts per operation."""
+
+    def __init__(self):
+        self.statements = 0
+        self.samples = {}
+        tournament.addHook(self._hook)
+
+    def _hook(self, event, details):
+        if event == 'statement':
+            self.statements += 1
+
+    @contextmanager
+    def timing(self, operation):
+        """Times the body as one call of operation, with its output hidden."""
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        statements = self.statements
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            sys.stdout.close()
+            sys.stdout = stdout
+            self.samples.setdefault(operation, []).append(
+                (elapsed, self.statements - statements))
+
+    def call(self, operation, function, *args, **kwargs):
+        """Times one call of function as operation; returns its result."""
+        with self.timing(operation):
+            return function(*args, **kwargs)
+
+    def close(self):
+        """Stops counting statements."""
+        tournament.removeHook(self._hook)
+
+    def summary(self):
+        """Returns a dict of operation -> statistics of its calls."""
+        results = {}
+        for operation, samples in self.samples.items():
+            times = sorted(sample[0] for sample in samples)
+            result = {
+                'calls': len(samples),
+                'total_s': sum(times),
+                'max_ms': times[-1] * 1000,
+                'statements_per_call': float(sum(s[1] for s in samples)) / len(samples),
+            }
+            for p in PERCENTILES:
+                # nearest-rank percentile.
+                rank = max(int(math.ceil(p / 100.0 * len(times))) - 1, 0)
+                result['p{0}_ms'.format(p)] = times[rank] * 1000
+            results[operation] = result
+        return results
+
+
+def _playResult(rng, players):
+    """Returns a random winner_id for a match: 0 for a tie."""
+    return 0 if rng.random() < TIE_RATE else rng.choice(players)
+
+
+def runEvent(bench, size, rounds, rng, batch=False, tiebreakers=('omw',)):
+    """Simulates one tournament of size players over rounds rounds."""
+
+    t_id = bench.call("addTournament", tournament.addTournament,
+                      "Benchmark, {0} players".format(size))
+    player_ids = [bench.call("registerPlayer", tournament.registerPlayer,
+                             "Player {0}".format(n))
+                  for n in range(size)]
+    try:
+        for player in player_ids:
+            bench.call("registerPlayerInTournament",
+                       tournament.registerPlayerInTournament, player, t_id)
+
+        for n in range(rounds):
+            pairings = bench.call("swissPairings", tournament.swissPairings, t_id)
+            results = []
+            for pairing in pairings:
+                players = tuple(p for p in pairing[0::2] if p is not None)
+                if len(players) == 1:
+                    results.append(players * 2)
+                else:
+                    results.append((_playResult(rng, players),) + players)
+
+            if batch:
+                bench.call("reportRound", tournament.reportRound, t_id, results)
+            else:
+                for result in results:
+                    if len(result) == 2:
+                        bench.call("reportBye", tournament.reportBye, t_id, result[0])
+                    else:
+                        bench.call("reportMatch", tournament.reportMatch, t_id, *result)
+
+            bench.call("playerStandings", tournament.playerStandings, t_id)
+            bench.call("playerStandings (cached)", tournament.playerStandings, t_id)
+            if tiebreakers:
+                bench.call("playerStandings (tiebreakers)",
+                           tournament.playerStandings, t_id, tiebreakers)
+            # every tiebreaker, each ready from the totals kept with the scores.
+            bench.call("playerStandings (all tiebreakers)",
+                       tournament.playerStandings, t_id, tournament.TIEBREAKERS)
+    finally:
+        # the players are not part of the tournament, so go separately.
+        with bench.timing("cleanup"):
+            tournament.deleteThisTournament(t_id)
+            with tournament.session() as c:
+                c.execute("DELETE FROM players WHERE player_id IN %s;",
+                          (tuple(player_ids),))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time simulated Swiss tournaments of several sizes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        metavar="N", help="numbers of players (default: %(default)s)")
+    parser.add_argument("--rounds", type=int,
+                        help="rounds per event (default: log2 of its size)")
+    parser.add_argument("--batch", action="store_true",
+                        help="report each round with reportRound")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--pod-size", type=int, default=tournament.PLAYERS_PER_MATCH,
+                        metavar="N", help="players per match (default: %(default)s)")
+    parser.add_argument("--sqlite", nargs="?", const=":memory:", metavar="PATH",
+                        help="use SQLite (default in memory) instead of PostgreSQL")
+    parser.add_argument("--dsn", default=tournament.DSN, help="PostgreSQL DSN")
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the results as JSON ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        store = tournament.SQLiteStore(args.sqlite)
+        backend = "sqlite"
+    else:
+        # the benchmark is the database's only writer, so reads can be cached.
+        store = tournament.PostgresStore(args.dsn, cacheReads=True)
+        backend = "postgres"
+    tournament.setStore(store)
+    tournament.PLAYERS_PER_MATCH = args.pod_size
+
+    rng = random.Random(args.seed)
+    runs = []
+    for size in args.sizes:
+        rounds = args.rounds or max(int(math.ceil(math.log(size, 2))), 1)
+        bench = Bench()
+        start = time.time()
+        runEvent(bench, size, rounds, rng, args.batch)
+        elapsed = time.time() - start
+        bench.close()
+        operations = bench.summary()
+        runs.append({'players': size, 'rounds': rounds, 'total_s': elapsed,
+                     'operations': operations})
+
+        print >> sys.stderr, "{0} players, {1} rounds: {2:.2f} s".format(
+            size, rounds, elapsed)
+        print >> sys.stderr, "  {0:<34} {1:>7} {2:>9} {3:>9} {4:>9} {5:>8}".format(
+            "operation", "calls", "p50 ms", "p99 ms", "max ms", "stmts")
+        for name in sorted(operations):
+            op = operations[name]
+            print >> sys.stderr, (
+                "  {0:<34} {1:>7} {2:>9.3f} {3:>9.3f} {4:>9.3f} {5:>8.1f}".format(
+                    name, op['calls'], op['p50_ms'], op['p99_ms'], op['max_ms'],
+                    op['statements_per_call']))
+
+    results = {'backend': backend, 'batch': args.batch, 'seed': args.seed,
+               'players_per_match': args.pod_size, 'runs': runs}
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
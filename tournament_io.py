@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+#
+# tournament_io.py -- streaming export and bulk import of tournament data
+#
+
+# Rows are read through a server-side cursor (see TournamentStore.streamRows)
+# and written out one at a time, so exports of any size run in constant
+# memory. Each export is one read-only session on the current store (see
+# tournament.setStore); other calls made from the same thread while an
+# export is being read share its transaction.
+#
+# Imports read files of tournaments, players, enrollments and matches from
+# another system, identified by that system's own keys. They are streamed
+# into staging tables (with COPY on PostgreSQL, see TournamentStore.copyRows),
+# checked and merged with a few set-based statements, and every player's
+# score and match counts are computed in the same pass that enrolls them.
+# The tiebreakers are worked out from the merged matches afterwards.
+#
+# From the command line:
+#   python tournament_io.py matches --format jsonl --first 10 --last 20 > out
+#   python tournament_io.py import --players p.csv --enrollments e.csv ...
+
+import argparse
+import csv
+import json
+import sys
+from collections import OrderedDict
+
+import tournament
+
+# exportable tables: their columns, in output order, the condition limiting
+# them to a range of tournaments ({0} stands for the range test on
+# tournament_id) and the order rows are written in. tournament_players comes
+# out in standings order.
+EXPORT_TABLES = {
+    'tournaments': (('tournament_id', 't_description'),
+                    "{0}", "tournament_id"),
+    'players': (('player_id', 'p_name'),
+                "player_id IN (SELECT player_id FROM tournament_players WHERE {0})",
+                "player_id"),
+    'tournament_players': (('tournament_id', 'player_id', 'p_t_score',
+                            'matches_played', 'wins', 'ties', 'losses', 'byes'),
+                           "{0}", "tournament_id, p_t_score DESC, player_id"),
+    'matches': (('match_id', 'tournament_id', 'winner_id', 'is_bye', 'round_id',
+                 'table_number', 'idempotency_key', 'is_playoff'),
+                "{0}", "match_id"),
+    'match_players': (('match_id', 'tournament_id', 'player_id'),
+                      "{0}", "match_id, tournament_id, player_id"),
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# SQLite stores booleans as integers; they are exported as booleans.
+_BOOLEAN_COLUMNS = ('is_bye', 'is_playoff')
+
+# importable files and their fields, in the order staged. Keys are the other
+# system's IDs, read as strings. A match with no winner is a tie, and one
+# with no player2 is a bye for player1, who must also be its winner.
+IMPORT_FIELDS = OrderedDict([
+    ('tournaments', ('tournament', 'description')),
+    ('players', ('player', 'name')),
+    ('enrollments', ('tournament', 'player')),
+    ('matches', ('tournament', 'winner', 'player1', 'player2')),
+])
+# fields an imported row cannot leave empty.
+_REQUIRED_FIELDS = {
+    'tournaments': ('tournament',),
+    'players': ('player', 'name'),
+    'enrollments': ('tournament', 'player'),
+    'matches': ('tournament', 'player1'),
+}
+
+# staging tables, one per file; line is the row's number in its file.
+_STAGING_TABLES = (
+    "CREATE TEMP TABLE import_tournaments (line INTEGER PRIMARY KEY,"
+    " tournament_key TEXT NOT NULL, description TEXT);",
+    "CREATE TEMP TABLE import_players (line INTEGER PRIMARY KEY,"
+    " player_key TEXT NOT NULL, name TEXT NOT NULL);",
+    "CREATE TEMP TABLE import_enrollments (line INTEGER PRIMARY KEY,"
+    " tournament_key TEXT NOT NULL, player_key TEXT NOT NULL);",
+    "CREATE TEMP TABLE import_matches (line INTEGER PRIMARY KEY,"
+    " tournament_key TEXT NOT NULL, winner_key TEXT, player1_key TEXT NOT NULL,"
+    " player2_key TEXT);",
+    "CREATE TEMP TABLE import_rejects (kind TEXT NOT NULL, line INTEGER NOT NULL,"
+    " reason TEXT NOT NULL);",
+    "CREATE INDEX import_tournaments_key_idx"
+    " ON import_tournaments (tournament_key, line);",
+    "CREATE INDEX import_players_key_idx ON import_players (player_key, line);",
+    "CREATE INDEX import_enrollments_key_idx"
+    " ON import_enrollments (tournament_key, player_key, line);",
+    "CREATE INDEX import_rejects_kind_idx ON import_rejects (kind, line);",
+)
+_STAGING_COLUMNS = {
+    'tournaments': ('line', 'tournament_key', 'description'),
+    'players': ('line', 'player_key', 'name'),
+    'enrollments': ('line', 'tournament_key', 'player_key'),
+    'matches': ('line', 'tournament_key', 'winner_key', 'player1_key', 'player2_key'),
+}
+
+# checks on staged rows, in order: the kind of row, why it is rejected, and
+# the condition on the staged row s that rejects it. Of rows with the same
+# key, the first is kept.
+_IMPORT_CHECKS = (
+    ('tournaments', "Duplicate tournament.",
+     "EXISTS (SELECT 1 FROM import_tournaments AS d"
+     " WHERE d.tournament_key = s.tournament_key AND d.line < s.line)"),
+    ('players', "Duplicate player.",
+     "EXISTS (SELECT 1 FROM import_players AS d"
+     " WHERE d.player_key = s.player_key AND d.line < s.line)"),
+    ('enrollments', "Unknown tournament.",
+     "NOT EXISTS (SELECT 1 FROM import_tournaments AS t"
+     " WHERE t.tournament_key = s.tournament_key)"),
+    ('enrollments', "Unknown player.",
+     "NOT EXISTS (SELECT 1 FROM import_players AS p"
+     " WHERE p.player_key = s.player_key)"),
+    ('enrollments', "Duplicate enrollment.",
+     "EXISTS (SELECT 1 FROM import_enrollments AS d"
+     " WHERE d.tournament_key = s.tournament_key"
+     " AND d.player_key = s.player_key AND d.line < s.line)"),
+    ('matches', "Unknown tournament.",
+     "NOT EXISTS (SELECT 1 FROM import_tournaments AS t"
+     " WHERE t.tournament_key = s.tournament_key)"),
+    ('matches', "Player not enrolled in tournament.",
+     "NOT EXISTS (SELECT 1 FROM import_enrollments AS e"
+     " WHERE e.tournament_key = s.tournament_key AND e.player_key = s.player1_key)"
+     " OR (s.player2_key IS NOT NULL AND NOT EXISTS"
+     " (SELECT 1 FROM import_enrollments AS e"
+     " WHERE e.tournament_key = s.tournament_key AND e.player_key = s.player2_key))"),
+    ('matches', "Player listed twice.", "s.player1_key = s.player2_key"),
+    ('matches', "Invalid winner.",
+     "(s.winner_key IS NOT NULL AND s.winner_key <> s.player1_key"
+     " AND (s.player2_key IS NULL OR s.winner_key <> s.player2_key))"
+     " OR (s.player2_key IS NULL AND s.winner_key IS NULL)"),
+)
+
+
+def iterRows(table, firstTournament=None, lastTournament=None):
+    """Yields a table's rows as tuples, reading them in batches.
+
+    Args:
+        table: name from EXPORT_TABLES
+        firstTournament: optional lowest tournament ID to include
+        lastTournament: optional highest tournament ID to include; players
+            are included if they are registered in a tournament in range
+    """
+    assert table in EXPORT_TABLES, "Unknown table: {0}".format(table)
+    columns, where, order = EXPORT_TABLES[table]
+
+    tests = []
+    params = []
+    if firstTournament is not None:
+        tests.append("tournament_id >= %s")
+        params.append(tournament.validId(firstTournament, "first tournament ID"))
+    if lastTournament is not None:
+        tests.append("tournament_id <= %s")
+        params.append(tournament.validId(lastTournament, "last tournament ID"))
+
+    sql_statement = "SELECT {0} FROM {1}".format(", ".join(columns), table)
+    if tests:
+        sql_statement += " WHERE " + where.format(" AND ".join(tests))
+    sql_statement += " ORDER BY {0};".format(order)
+
+    booleans = [i for i, column in enumerate(columns) if column in _BOOLEAN_COLUMNS]
+    store = tournament.getStore()
+    with store.session() as c:
+        for row in store.streamRows(c, sql_statement, tuple(params)):
+            if booleans:
+                row = list(row)
+                for i in booleans:
+                    row[i] = bool(row[i])
+            yield tuple(row)
+
+
+def _csvValue(value):
+    """Returns a value as the csv module can write it."""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def exportTable(table, out, format='csv', firstTournament=None, lastTournament=None):
+    """Writes a table to a file as CSV or JSON Lines.
+
+    Args:
+        table: name from EXPORT_TABLES
+        out: file object to write to
+        format: 'csv' for a header row and then one row per line, or 'jsonl'
+            for one JSON object per line
+        firstTournament: optional lowest tournament ID to include
+        lastTournament: optional highest tournament ID to include
+
+    Returns:
+        nRows: number of rows written
+    """
+    assert format in EXPORT_FORMATS, "Unknown format: {0}".format(format)
+    columns = EXPORT_TABLES.get(table, ((),))[0]
+    rows = iterRows(table, firstTournament, lastTournament)
+
+    nRows = 0
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_csvValue(value) for value in row])
+            nRows += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(OrderedDict(zip(columns, row))) + "\n")
+            nRows += 1
+
+    return nRows
+
+
+def _readRecords(infile, format, fields):
+    """Yields (line, values, error) for each row of a CSV (with a header) or JSONL file.
+
+    values holds the row's fields in the order given, None where empty, or
+    is None itself for a line that cannot be read, with error saying why.
+    """
+    if format == 'csv':
+        reader = csv.reader(infile)
+        header = next(reader, [])
+        columns = [header.index(field) if field in header else None
+                   for field in fields]
+        for line, row in enumerate(reader, 1):
+            try:
+                yield line, tuple(
+                    row[i].decode("utf-8") if i is not None and i < len(row) and row[i]
+                    else None for i in columns), None
+            except UnicodeDecodeError:
+                yield line, None, "Invalid UTF-8."
+    else:
+        for line, text in enumerate(infile, 1):
+            try:
+                record = json.loads(text)
+                assert isinstance(record, dict)
+            except UnicodeDecodeError:
+                yield line, None, "Invalid UTF-8."
+                continue
+            except (ValueError, AssertionError):
+                yield line, None, "Not a JSON object."
+                continue
+            yield line, tuple(record.get(field) for field in fields), None
+
+
+def _stagedRows(kind, infile, format, rejects):
+    """Yields an import file's rows for staging, adding bad ones to rejects."""
+    fields = IMPORT_FIELDS[kind]
+    required = [fields.index(field) for field in _REQUIRED_FIELDS[kind]]
+    texts = [(i, field, maxLength, allowEmpty) for i, field in enumerate(fields)
+             for name, maxLength, allowEmpty in (
+                 ('name', tournament.NAME_MAX_LENGTH, False),
+                 ('description', tournament.DESCRIPTION_MAX_LENGTH, True))
+             if field == name]
+
+    for line, values, error in _readRecords(infile, format, fields):
+        if values is None:
+            rejects.append((kind, line, error))
+            continue
+        try:
+            for i in required:
+                assert values[i] not in (None, ""), "Missing {0}.".format(fields[i])
+            values = list(values)
+            for i, value in enumerate(values):
+                # keys from JSON may be numbers; everything is staged as text.
+                if value is not None and not isinstance(value, unicode):
+                    assert isinstance(value, (str, int, long)), (
+                        "Invalid {0}.".format(fields[i]))
+                    values[i] = unicode(value)
+            for i, field, maxLength, allowEmpty in texts:
+                if values[i] is not None:
+                    values[i] = tournament.validText(values[i], field, maxLength,
+                                                     allowEmpty)
+        except AssertionError as e:
+            rejects.append((kind, line, str(e)))
+            continue
+        yield (line,) + tuple(values)
+
+
+def importData(tournaments=None, players=None, enrollments=None, matches=None,
+               format='csv'):
+    """Imports tournaments and their results from another system, in one transaction.
+
+    Each file is CSV with a header row, or JSON Lines, with the fields in
+    IMPORT_FIELDS. Rows refer to each other by the other system's keys, so
+    enrollments and matches can only name tournaments and players from the
+    same import. Bad rows are skipped and reported; the rest are imported
+    with new IDs, and players' scores and match counts are computed from the
+    imported matches.
+
+    Args:
+        tournaments: file of tournaments: tournament key, description
+        players: file of players: player key, name
+        enrollments: file of registrations: tournament key, player key
+        matches: file of results: tournament key, winner key (empty for a
+            tie), player1 key, player2 key (empty for a bye)
+        format: 'csv' or 'jsonl'
+
+    Returns:
+        A tuple (imported, rejects):
+            imported: dict of kind -> number of rows imported
+            rejects: list of (kind, line, reason) for each skipped row, where
+                line counts the file's rows from 1, after any header
+    """
+    assert format in EXPORT_FORMATS, "Unknown format: {0}".format(format)
+    files = dict(zip(IMPORT_FIELDS, (tournaments, players, enrollments, matches)))
+    rejects = []
+    imported = {}
+    store = tournament.getStore()
+
+    with store.session() as c:
+        for statement in _STAGING_TABLES:
+            c.execute(statement)
+        lines = {}
+        for kind in IMPORT_FIELDS:
+            if files[kind] is not None:
+                staged = _stagedRows(kind, files[kind], format, rejects)
+                store.copyRows(c, "import_" + kind, _STAGING_COLUMNS[kind], staged)
+            c.execute("ANALYZE import_{0};".format(kind))
+
+        for kind, reason, condition in _IMPORT_CHECKS:
+            c.execute("INSERT INTO import_rejects (kind, line, reason)"
+                      " SELECT %s, line, %s FROM import_{0} AS s WHERE {1};".format(
+                          kind, condition), (kind, reason))
+            c.execute("DELETE FROM import_{0} WHERE line IN"
+                      " (SELECT line FROM import_rejects WHERE kind = %s);".format(kind),
+                      (kind,))
+
+        for kind in IMPORT_FIELDS:
+            c.execute("SELECT COUNT(*), COALESCE(MAX(line), 0)"
+                      " FROM import_{0};".format(kind))
+            imported[kind], lines[kind] = c.fetchone()
+
+        # new IDs are the reserved block's start plus the row's line number.
+        base = {}
+        for kind, table, column in (('tournaments', 'tournaments', 'tournament_id'),
+                                    ('players', 'players', 'player_id'),
+                                    ('matches', 'matches', 'match_id')):
+            if lines[kind]:
+                base[kind] = store.reserveIds(c, table, column, lines[kind]) - 1
+        t, p, m = base.get('tournaments'), base.get('players'), base.get('matches')
+
+        c.execute("INSERT INTO tournaments (tournament_id, t_description)"
+                  " SELECT %s + line, description FROM import_tournaments;", (t,))
+        c.execute("INSERT INTO players (player_id, p_name)"
+                  " SELECT %s + line, name FROM import_players;", (p,))
+
+        # every player's results in one pass over the matches, once from each
+        # side of the table.
+        c.execute(
+            "INSERT INTO tournament_players (player_id, tournament_id, p_t_score,"
+            " matches_played, wins, ties, losses, byes)"
+            " SELECT %s + p.line, %s + t.line, COALESCE(r.points, 0),"
+            " COALESCE(r.played, 0), COALESCE(r.wins, 0), COALESCE(r.ties, 0),"
+            " COALESCE(r.losses, 0), COALESCE(r.byes, 0)"
+            " FROM import_enrollments AS e"
+            " INNER JOIN import_tournaments AS t ON (t.tournament_key = e.tournament_key)"
+            " INNER JOIN import_players AS p ON (p.player_key = e.player_key)"
+            " LEFT OUTER JOIN"
+            "   (SELECT tournament_key, player_key,"
+            "      SUM(CASE WHEN opponent_key IS NULL THEN %s"
+            "          WHEN winner_key IS NULL THEN %s"
+            "          WHEN winner_key = player_key THEN %s ELSE %s END) AS points,"
+            "      COUNT(*) AS played,"
+            "      SUM(CASE WHEN winner_key = player_key THEN 1 ELSE 0 END) AS wins,"
+            "      SUM(CASE WHEN winner_key IS NULL THEN 1 ELSE 0 END) AS ties,"
+            "      SUM(CASE WHEN winner_key <> player_key THEN 1 ELSE 0 END) AS losses,"
+            "      SUM(CASE WHEN opponent_key IS NULL THEN 1 ELSE 0 END) AS byes"
+            "    FROM (SELECT tournament_key, winner_key, player1_key AS player_key,"
+            "            player2_key AS opponent_key FROM import_matches"
+            "          UNION ALL"
+            "          SELECT tournament_key, winner_key, player2_key, player1_key"
+            "            FROM import_matches WHERE player2_key IS NOT NULL) AS x"
+            "    GROUP BY tournament_key, player_key) AS r"
+            "   ON (r.tournament_key = e.tournament_key AND r.player_key = e.player_key);",
+            (p, t, tournament.BYE_POINTS, tournament.TIE_POINTS,
+             tournament.WIN_POINTS, tournament.LOSS_POINTS))
+
+        c.execute("INSERT INTO matches (match_id, tournament_id, winner_id, is_bye)"
+                  " SELECT %s + m.line, %s + t.line, %s + w.line,"
+                  " m.player2_key IS NULL"
+                  " FROM import_matches AS m"
+                  " INNER JOIN import_tournaments AS t"
+                  "   ON (t.tournament_key = m.tournament_key)"
+                  " LEFT OUTER JOIN import_players AS w ON (w.player_key = m.winner_key);",
+                  (m, t, p))
+        for column in ('player1_key', 'player2_key'):
+            c.execute("INSERT INTO match_players (match_id, tournament_id, player_id)"
+                      " SELECT %s + m.line, %s + t.line, %s + p.line"
+                      " FROM import_matches AS m"
+                      " INNER JOIN import_tournaments AS t"
+                      "   ON (t.tournament_key = m.tournament_key)"
+                      " INNER JOIN import_players AS p"
+                      "   ON (p.player_key = m.{0});".format(column),
+                      (m, t, p))
+        # the tiebreaker totals need everyone's final scores, so come last.
+        c.execute("SELECT %s + line FROM import_tournaments;", (t,))
+        tournament.recomputeTiebreakers([row[0] for row in c.fetchall()], c)
+
+        c.execute("SELECT kind, line, reason FROM import_rejects;")
+        rejects.extend(c.fetchall())
+        for table in ('import_rejects',) + tuple("import_" + kind for kind in IMPORT_FIELDS):
+            c.execute("DROP TABLE {0};".format(table))
+
+    order = list(IMPORT_FIELDS)
+    rejects.sort(key=lambda reject: (order.index(reject[0]), reject[1]))
+
+    print "Imported {0}; rejected {1} rows".format(
+        ", ".join("{0} {1}".format(imported[kind], kind) for kind in IMPORT_FIELDS),
+        len(rejects))
+
+    return imported, rejects
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a tournament table to standard output, or import "
+                    "files from another system.")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES) + ["import"])
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--first", type=int, help="lowest tournament ID to export")
+    parser.add_argument("--last", type=int, help="highest tournament ID to export")
+    for kind in IMPORT_FIELDS:
+        parser.add_argument("--" + kind, type=argparse.FileType("r"), metavar="FILE",
+                            help="{0} to import".format(kind))
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="use an SQLite database instead of PostgreSQL")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        tournament.setStore(tournament.SQLiteStore(args.sqlite))
+    if args.table == "import":
+        imported, rejects = importData(args.tournaments, args.players,
+                                       args.enrollments, args.matches, args.format)
+        for kind, line, reason in rejects:
+            print >> sys.stderr, "{0} line {1}: {2}".format(kind, line, reason)
+    else:
+        exportTable(args.table, sys.stdout, args.format, args.first, args.last)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# tournament_projection.py -- Monte Carlo projection of final standings
+#
+
+# Plays out a tournament's remaining rounds many times from its current
+# standings and counts how often each player finishes in each band of the
+# final standings (first place, the rest of the top 8, and so on), to answer
+# "what are X's chances of making the cut".
+#
+# Each simulated round is paired by the Swiss rule: players ordered by points,
+# at random within a score group, play the next players down, in tables of
+# PLAYERS_PER_MATCH with smaller tables at the bottom as in swissPairings.
+# Rematch avoidance is left out. Results are drawn from the players' Elo
+# ratings: a table is tied with the tournament's tie rate so far, and otherwise
+# won by each player in proportion to 10 ** (rating / RATING_SCALE), which for
+# two players is the Elo expectation. Players level on points at the end are
+# ordered at random, standing in for tiebreakers.
+#
+# Simulations run in batches, each one a set of numpy arrays with a row per
+# simulation, so there are no per-match Python loops; batches can be spread
+# over a process pool. numpy is required.
+#
+# From the command line:
+#   python tournament_projection.py 12 --rounds 3 --cut 1 8 --processes 4
+
+import argparse
+import math
+import multiprocessing
+
+import tournament
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_SIMULATIONS = 10000
+# simulations per batch of arrays; memory use is about 40 bytes per player
+# per simulation in a batch.
+SIMULATION_BATCH = 500
+# top-N cuts the finishing bands are split at.
+DEFAULT_CUTS = (8,)
+# share of tables tied when the tournament has no results yet.
+DEFAULT_TIE_RATE = 0.05
+
+
+def _tableSegments(sizes):
+    """Returns [first seat, table size, tables] for each run of equal-sized tables."""
+    segments = []
+    start = 0
+    for size in sizes:
+        if segments and segments[-1][1] == size:
+            segments[-1][2] += 1
+        else:
+            segments.append([start, size, 1])
+        start += size
+    return segments
+
+
+def _simulateBatch(task):
+    """Simulates one batch; returns an array of how often each player made each cut.
+
+    Args:
+        task: tuple (points, strengths, rounds, segments, tieRate, cuts,
+            simulations, seed), as built by projectStandings
+
+    Returns:
+        array of shape (len(cuts), players): row k counts the simulations
+            in which each player finished in the top cuts[k]
+    """
+    points, strengths, rounds, segments, tieRate, cuts, simulations, seed = task
+    rng = numpy.random.RandomState(seed)
+    nPlayers = len(points)
+    totals = numpy.tile(numpy.asarray(points, dtype=numpy.int32), (simulations, 1))
+    rows = numpy.arange(simulations)[:, None, None]
+
+    def rankKeys():
+        # most points first, in random order within a score group.
+        return (-totals << 16) | rng.randint(0, 1 << 16, totals.shape).astype(numpy.int32)
+
+    for _ in range(rounds):
+        order = numpy.argsort(rankKeys(), axis=1)
+        for start, size, tables in segments:
+            seats = order[:, start:start + size * tables].reshape(
+                simulations, tables, size)
+            if size == 1:
+                totals[rows, seats] += tournament.BYE_POINTS
+                continue
+            # one draw per table: below tieRate is a tie, and the rest of the
+            # range is split between the players in proportion to strength.
+            draw = rng.random_sample((simulations, tables, 1))
+            weights = strengths[seats].cumsum(axis=2)
+            share = (draw - tieRate) / max(1 - tieRate, 1e-12)
+            winner = (weights < share * weights[:, :, -1:]).sum(axis=2)
+            gains = numpy.where(draw < tieRate, tournament.TIE_POINTS, numpy.where(
+                numpy.arange(size) == winner[:, :, None],
+                tournament.WIN_POINTS, tournament.LOSS_POINTS))
+            totals[rows, seats] += gains
+
+    # only who is above each cut matters, not the order within it.
+    order = numpy.argpartition(rankKeys(), [cut - 1 for cut in cuts], axis=1)
+    return numpy.array([numpy.bincount(order[:, :cut].ravel(), minlength=nPlayers)
+                        for cut in cuts])
+
+
+def projectStandings(tournament_id, rounds=None, cuts=DEFAULT_CUTS,
+                     simulations=DEFAULT_SIMULATIONS, processes=None, seed=None):
+    """Returns each player's chances of finishing in each band of the standings.
+
+    Args:
+        tournament_id: serial ID of the tournament
+        rounds: rounds left to play; by default, enough to make log2(players)
+            in all, less the most matches anyone has played
+        cuts: increasing top-N positions to split the bands at: (1, 8) gives
+            the bands first place, second to eighth, and the rest
+        simulations: how many times to play out the remaining rounds
+        processes: number of worker processes to spread the batches over;
+            by default they run in this process
+        seed: optional random seed, for repeatable projections; the result
+            does not depend on the number of processes
+
+    Returns:
+        A list of tuples (id, name, points, chances), in current standings order:
+            id: the player's unique id
+            name: the player's full name
+            points: the player's current points
+            chances: tuple of the probability of finishing in each band,
+                len(cuts) + 1 of them, adding up to 1
+    """
+    if numpy is None:
+        raise ImportError("projectStandings needs numpy.")
+
+    tournament_id = tournament.validId(tournament_id, "tournament ID")
+    cuts = tuple(int(cut) for cut in cuts)
+    assert cuts and all(a < b for a, b in zip((0,) + cuts, cuts)), (
+        "Cuts must be increasing positive positions.")
+    assert simulations > 0, "At least one simulation is needed."
+
+    with tournament.session() as c:
+        standings = tournament.playerStandings(tournament_id)
+        ratings = dict((row[0], row[2]) for row in tournament.playerRatings(tournament_id))
+        c.execute("SELECT COUNT(*), COALESCE(SUM(CASE WHEN winner_id IS NULL"
+                  " THEN 1 ELSE 0 END), 0) FROM matches"
+                  " WHERE tournament_id = %s AND NOT is_bye AND NOT is_playoff;",
+                  (tournament_id,))
+        played, ties = c.fetchone()
+
+    if not standings:
+        return []
+    if rounds is None:
+        planned = int(math.ceil(math.log(max(len(standings), 2), 2)))
+        rounds = max(planned - max(row[3] for row in standings), 0)
+    assert rounds >= 0, "Rounds left cannot be negative."
+    tieRate = float(ties) / played if played else DEFAULT_TIE_RATE
+
+    points = [row[2] for row in standings]
+    strengths = 10.0 ** (numpy.array([ratings[row[0]] for row in standings]) /
+                         tournament.RATING_SCALE)
+    segments = _tableSegments(tournament._podSizes(len(standings)))
+    cutsInField = [min(cut, len(standings)) for cut in cuts]
+
+    seeds = numpy.random.RandomState(seed).randint(
+        0, 2 ** 31 - 1, size=-(-simulations // SIMULATION_BATCH))
+    tasks = [(points, strengths, rounds, segments, tieRate, cutsInField,
+              min(SIMULATION_BATCH, simulations - n * SIMULATION_BATCH), int(batchSeed))
+             for n, batchSeed in enumerate(seeds)]
+    if processes and processes > 1:
+        workers = multiprocessing.Pool(processes)
+        try:
+            counts = sum(workers.map(_simulateBatch, tasks))
+        finally:
+            workers.close()
+            workers.join()
+    else:
+        counts = sum(_simulateBatch(task) for task in tasks)
+
+    made = numpy.vstack([numpy.zeros(len(standings)), counts,
+                         numpy.full(len(standings), simulations)]) / float(simulations)
+    chances = numpy.diff(made, axis=0).T
+    return [(row[0], row[1], row[2], tuple(float(p) for p in chance))
+            for row, chance in zip(standings, chances)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print each player's chances of finishing in each band "
+                    "of a tournament's final standings.")
+    parser.add_argument("tournament_id", type=int)
+    parser.add_argument("--rounds", type=int,
+                        help="rounds left to play (default: up to log2 of the players)")
+    parser.add_argument("--cut", type=int, nargs="+", default=DEFAULT_CUTS,
+                        metavar="N", help="top-N positions to split at (default: %(default)s)")
+    parser.add_argument("--simulations", type=int, default=DEFAULT_SIMULATIONS)
+    parser.add_argument("--processes", type=int, help="worker processes to use")
+    parser.add_argument("--seed", type=int, help="random seed")
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="use an SQLite database instead of PostgreSQL")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        tournament.setStore(tournament.SQLiteStore(args.sqlite))
+    projection = projectStandings(args.tournament_id, args.rounds, args.cut,
+                                  args.simulations, args.processes, args.seed)
+
+    bands = ["top {0}".format(args.cut[0])] + [
+        "{0}-{1}".format(a + 1, b) for a, b in zip(args.cut, args.cut[1:])] + ["rest"]
+    print "{0:>8} {1:<30} {2:>6} {3}".format(
+        "id", "name", "points", " ".join("{0:>8}".format(band) for band in bands))
+    for player_id, name, points, chances in projection:
+        print u"{0:>8} {1:<30} {2:>6} {3}".format(
+            player_id, name, points,
+            " ".join("{0:>7.1%}".format(chance) for chance in chances)).encode("utf-8")
+
+
+if __name__ == '__main__':
+    main()
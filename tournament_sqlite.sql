@@ -0,0 +1,154 @@
+-- Table definitions for the tournament project, for SQLite.
+--
+-- The same schema as tournament.sql, in SQLite's dialect. tournament.SQLiteStore
+-- runs this file on every database it opens, so every statement must be safe
+-- to repeat. Foreign keys are switched on per connection by SQLiteStore.
+--
+-- Keep this file in step with tournament.sql.
+
+-- AUTOINCREMENT keeps ids from being reused after deletes, like SERIAL.
+CREATE TABLE IF NOT EXISTS tournaments(
+    tournament_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    t_description   VARCHAR(100)
+);
+
+CREATE TABLE IF NOT EXISTS players(
+    player_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    p_name      VARCHAR(30) NOT NULL,
+    -- Elo rating across all tournaments, updated with each reported match.
+    rating      REAL NOT NULL DEFAULT 1500,
+    rated_matches INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS tournament_players(
+    player_id       INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    tournament_id   INTEGER REFERENCES tournaments(tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    p_t_score       INTEGER DEFAULT 0,
+    matches_played  INTEGER NOT NULL DEFAULT 0,
+    wins            INTEGER NOT NULL DEFAULT 0,
+    ties            INTEGER NOT NULL DEFAULT 0,
+    losses          INTEGER NOT NULL DEFAULT 0,
+    byes            INTEGER NOT NULL DEFAULT 0,
+    -- tiebreaker totals over the opponents met in Swiss matches, kept up to
+    -- date with the opponents' scores: how many were met, the sum of their
+    -- floored match-win percentages, their points, their points weighted by
+    -- the result (Sonneborn-Berger) and the points earned against those on
+    -- the same score.
+    opp_count       INTEGER NOT NULL DEFAULT 0,
+    opp_mwp         REAL NOT NULL DEFAULT 0,
+    opp_points      INTEGER NOT NULL DEFAULT 0,
+    sb_points       REAL NOT NULL DEFAULT 0,
+    h2h_points      INTEGER NOT NULL DEFAULT 0,
+    primary key (player_id, tournament_id)
+);
+
+CREATE TABLE IF NOT EXISTS rounds(
+    round_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    tournament_id   INTEGER NOT NULL REFERENCES tournaments(tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    round_number    INTEGER NOT NULL,
+    -- kept up to date by startRound and each reported match, so round status
+    -- is read from one row.
+    matches_total   INTEGER NOT NULL,
+    matches_reported INTEGER NOT NULL DEFAULT 0,
+    closed          BOOLEAN NOT NULL DEFAULT 0,
+    UNIQUE (tournament_id, round_number)
+);
+
+CREATE TABLE IF NOT EXISTS matches(
+    match_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    tournament_id   INTEGER REFERENCES tournaments(tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- NULL if there was a tie.
+    winner_id       INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    is_bye          BOOLEAN NOT NULL DEFAULT 0,
+    -- set by reportMatch/reportRound callers to make retries safe.
+    idempotency_key VARCHAR(100),
+    -- the started round and table the match was paired at, if any.
+    round_id        INTEGER REFERENCES rounds(round_id)
+                            ON UPDATE CASCADE ON DELETE SET NULL,
+    table_number    INTEGER,
+    -- a playoff match (see bracket_matches): rated, but not counted in the
+    -- Swiss scores or tiebreakers.
+    is_playoff      BOOLEAN NOT NULL DEFAULT 0,
+    UNIQUE (match_id, tournament_id),
+    -- a key records at most one match; NULL keys never conflict.
+    UNIQUE (tournament_id, idempotency_key),
+    -- each table of a round is reported once.
+    UNIQUE (round_id, table_number),
+    -- a bye is always won. That a winner played in the match is checked in
+    -- Python: a CHECK cannot see match_players.
+    CHECK (winner_id IS NOT NULL OR NOT is_bye)
+);
+
+CREATE TABLE IF NOT EXISTS match_players(
+    match_id        INTEGER NOT NULL,
+    tournament_id   INTEGER NOT NULL,
+    player_id       INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- leads with the foreign key's columns, so the ON DELETE CASCADE from
+    -- matches finds rows through it (SQLite needs all of them to use an index).
+    primary key (match_id, tournament_id, player_id),
+    FOREIGN KEY (match_id, tournament_id) REFERENCES matches(match_id, tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- only registered players play; reports rely on this instead of checking.
+    FOREIGN KEY (player_id, tournament_id)
+                            REFERENCES tournament_players(player_id, tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS round_pairings(
+    round_id        INTEGER NOT NULL REFERENCES rounds(round_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    player_id       INTEGER NOT NULL REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- players at the same table play each other; a bye has a table to itself.
+    table_number    INTEGER NOT NULL,
+    seats           INTEGER NOT NULL,
+    primary key (round_id, player_id)
+);
+
+CREATE TABLE IF NOT EXISTS bracket_matches(
+    tournament_id   INTEGER NOT NULL REFERENCES tournaments(tournament_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- 1 for the first round of the playoff; slot n of a round feeds slot
+    -- (n + 1) / 2 of the next.
+    bracket_round   INTEGER NOT NULL,
+    slot            INTEGER NOT NULL,
+    -- players are filled in as the previous round's winners advance.
+    seed_a          INTEGER,
+    player_a        INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    seed_b          INTEGER,
+    player_b        INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    winner_id       INTEGER REFERENCES players(player_id)
+                            ON UPDATE CASCADE ON DELETE CASCADE,
+    -- the result, recorded in matches like any other.
+    match_id        INTEGER REFERENCES matches(match_id)
+                            ON UPDATE CASCADE ON DELETE SET NULL,
+    -- also how the whole bracket is read, in order.
+    primary key (tournament_id, bracket_round, slot)
+);
+
+CREATE INDEX IF NOT EXISTS tournament_players_tournament_idx
+    ON tournament_players (tournament_id, p_t_score DESC, player_id);
+CREATE INDEX IF NOT EXISTS matches_tournament_idx ON matches (tournament_id);
+CREATE INDEX IF NOT EXISTS match_players_tournament_idx
+    ON match_players (tournament_id, player_id);
+CREATE INDEX IF NOT EXISTS matches_winner_idx ON matches (winner_id);
+CREATE INDEX IF NOT EXISTS match_players_player_idx ON match_players (player_id);
+CREATE UNIQUE INDEX IF NOT EXISTS rounds_open_idx ON rounds (tournament_id) WHERE NOT closed;
+CREATE INDEX IF NOT EXISTS round_pairings_player_idx ON round_pairings (player_id);
+-- used by the ON DELETE SET NULL from matches.
+CREATE INDEX IF NOT EXISTS bracket_matches_match_idx ON bracket_matches (match_id);
+
+CREATE VIEW IF NOT EXISTS full_player_info AS
+    SELECT tp.player_id, tp.tournament_id, tp.p_t_score,
+        tp.matches_played AS nmatches, p.p_name
+    FROM tournament_players AS tp
+        INNER JOIN players AS p ON (tp.player_id = p.player_id)
+    ORDER BY tp.p_t_score DESC;
@@ -2,10 +2,71 @@
 #
 # Test cases for tournament.py
 
+import json
+import os
+import random
+import sys
+import tempfile
+from StringIO import StringIO
+
 from tournament import *
+import tournament
+import tournament_async
+import tournament_io
+import tournament_projection
+
+# "python tournament_test.py --sqlite" runs against a fresh in-memory SQLite
+# database instead of the PostgreSQL tournament database.
+if '--sqlite' in sys.argv:
+    setStore(SQLiteStore())
 
 testTourn = addTournament("testTourn")
 
+# the tiebreakers as playerStandings computed them before they were kept up to
+# date with each report: one query joining every match to both players' rows.
+# omw is rounded as playerStandings now rounds it.
+REFERENCE_TIEBREAKERS = (
+    "SELECT tp.player_id, p.p_name, tp.p_t_score, tp.matches_played,"
+    " CAST(ROUND(CAST(COALESCE(AVG(CASE WHEN o.mwp < %s THEN %s"
+    "                   ELSE o.mwp END), 0) AS NUMERIC), 12) AS FLOAT),"
+    " CAST(COALESCE(SUM(o.p_t_score), 0) AS INTEGER),"
+    " CAST(COALESCE(SUM(CASE WHEN m.winner_id = tp.player_id THEN o.p_t_score"
+    "                   WHEN m.winner_id IS NULL THEN o.p_t_score / 2.0"
+    "                   ELSE 0 END), 0) AS FLOAT),"
+    " CAST(COALESCE(SUM(CASE WHEN o.player_id IS NULL"
+    "                        OR o.p_t_score <> tp.p_t_score THEN 0"
+    "                   WHEN m.winner_id = tp.player_id THEN %s"
+    "                   WHEN m.winner_id IS NULL THEN %s"
+    "                   ELSE %s END), 0) AS INTEGER)"
+    " FROM tournament_players AS tp"
+    " INNER JOIN players AS p ON (tp.player_id = p.player_id)"
+    " LEFT OUTER JOIN match_players AS a"
+    "   ON (a.tournament_id = tp.tournament_id AND a.player_id = tp.player_id)"
+    " LEFT OUTER JOIN match_players AS b"
+    "   ON (b.match_id = a.match_id AND b.player_id <> a.player_id)"
+    " LEFT OUTER JOIN matches AS m ON (m.match_id = b.match_id)"
+    " LEFT OUTER JOIN"
+    "   (SELECT player_id, p_t_score,"
+    "      CASE WHEN matches_played = 0 THEN %s"
+    "      ELSE CAST(p_t_score AS FLOAT) / (%s * matches_played) END AS mwp"
+    "    FROM tournament_players WHERE tournament_id = %s) AS o"
+    "   ON (o.player_id = b.player_id AND NOT m.is_playoff)"
+    " WHERE tp.tournament_id = %s"
+    " GROUP BY tp.player_id, p.p_name, tp.p_t_score, tp.matches_played;")
+
+
+def referenceStandings(tournament_id):
+    """Returns playerStandings(tournament_id, TIEBREAKERS) from REFERENCE_TIEBREAKERS."""
+    with getStore().session() as c:
+        c.execute(REFERENCE_TIEBREAKERS, (
+            MIN_MATCH_WIN_PERCENTAGE, MIN_MATCH_WIN_PERCENTAGE,
+            WIN_POINTS, TIE_POINTS, LOSS_POINTS,
+            MIN_MATCH_WIN_PERCENTAGE, WIN_POINTS, tournament_id, tournament_id,))
+        standings = [tuple(row) for row in c.fetchall()]
+    return sorted(standings, key=lambda row: (-row[2],) +
+                  tuple(-value for value in row[4:]) + (row[0],))
+
+
 def testDeleteMatches():
     deleteMatches()
     print "1. Old matches can be deleted."
@@ -177,6 +238,797 @@ def testDeleteTournaments(testTournament, c):
         print "11. Deleting all tournaments works."
 
 
+def testBulkRegister():
+    deleteMatches()
+    deletePlayers()
+    bulkTourn = addTournament("bulkTourn")
+    names = ["Jace Beleren", "Liliana Vess", "Gideon Jura", "Nissa Revane"]
+    ids = registerPlayers(names)
+    if countPlayers() != 4:
+        raise ValueError(
+            "After registering four players at once, countPlayers should be 4.")
+    registerPlayersInTournament(ids, bulkTourn)
+    standings = playerStandings(bulkTourn)
+    if dict((row[0], row[1]) for row in standings) != dict(zip(ids, names)):
+        raise ValueError("registerPlayers should return IDs in input order.")
+    try:
+        registerPlayersInTournament(ids[:1], bulkTourn)
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("Players cannot be registered in a tournament twice.")
+    deleteThisTournament(bulkTourn)
+    print "12. Players can be registered and enrolled in bulk."
+
+
+def testReportRound():
+    deleteMatches()
+    deletePlayers()
+    roundTourn = addTournament("roundTourn")
+    [p1, p2, p3, p4] = registerPlayers(
+        ["Ajani Goldmane", "Chandra Nalaar", "Karn", "Sorin Markov"])
+    registerPlayersInTournament([p1, p2, p3, p4], roundTourn)
+
+    # p1 beats p2, p3 and p4 tie.
+    reportRound(roundTourn, [(p1, p1, p2), (0, p3, p4)])
+
+    expected = {p1: 3, p2: 0, p3: 1, p4: 1}
+    for (i, n, w, m) in playerStandings(roundTourn):
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if w != expected[i]:
+            raise ValueError("reportRound should score wins as 3 and ties as 1.")
+    deleteThisTournament(roundTourn)
+    print "13. A whole round of results can be reported at once."
+
+
+def testNoRematches():
+    deleteMatches()
+    deletePlayers()
+    rematchTourn = addTournament("rematchTourn")
+    [p1, p2, p3, p4] = registerPlayers(
+        ["Elspeth Tirel", "Garruk Wildspeaker", "Tezzeret", "Venser"])
+    registerPlayersInTournament([p1, p2, p3, p4], rematchTourn)
+
+    reportRound(rematchTourn, [(p1, p1, p2), (p3, p3, p4)])
+    reportRound(rematchTourn, [(p1, p1, p3), (p2, p2, p4)])
+
+    # p1 has already played p2 and p3, so must play p4 despite the scores.
+    pairings = swissPairings(rematchTourn)
+    actual_pairs = set(frozenset([a, b]) for (a, na, b, nb) in pairings)
+    if actual_pairs != set([frozenset([p1, p4]), frozenset([p2, p3])]):
+        raise ValueError("swissPairings should not pair players who have "
+                         "already played each other.")
+    deleteThisTournament(rematchTourn)
+
+    # past the search limit, the last player's only unplayed opponent is
+    # still found at the top of a large field.
+    ranked = range(1, 4097)
+    opponents = dict((player, set([4096])) for player in ranked[1:-1])
+    opponents[4096] = set(ranked[1:-1])
+    pairs = tournament._pairPlayers(ranked, opponents)
+    if sorted(p for pair in pairs for p in pair) != ranked or any(
+            b in opponents.get(a, ()) for a, b in pairs):
+        raise ValueError("Pairings should avoid a rematch anywhere in the field.")
+    print "14. Pairings avoid rematches."
+
+
+def testByes():
+    deleteMatches()
+    deletePlayers()
+    byeTourn = addTournament("byeTourn")
+    [p1, p2, p3] = registerPlayers(["Kiora", "Ral Zarek", "Xenagos"])
+    registerPlayersInTournament([p1, p2, p3], byeTourn)
+
+    pairings = swissPairings(byeTourn)
+    if len(pairings) != 2 or pairings[-1][2] is not None:
+        raise ValueError("With three players, one should get a bye.")
+    (id1, name1, id2, name2), (byeId, byeName, none1, none2) = pairings
+    reportRound(byeTourn, [(id1, id1, id2), (byeId, byeId)])
+
+    standings = dict((row[0], row[2:]) for row in playerStandings(byeTourn))
+    if standings[byeId] != (BYE_POINTS, 1):
+        raise ValueError("A bye should count as a match worth BYE_POINTS.")
+    if swissPairings(byeTourn)[-1][0] == byeId:
+        raise ValueError("The same player should not get two byes in a row.")
+    deleteThisTournament(byeTourn)
+    print "15. Odd player counts get byes."
+
+
+def testTiebreakers():
+    deleteMatches()
+    deletePlayers()
+    tbTourn = addTournament("tbTourn")
+    [p1, p2, p3, p4] = registerPlayers(
+        ["Nahiri", "Ob Nixilis", "Dovin Baan", "Saheeli Rai"])
+    registerPlayersInTournament([p1, p2, p3, p4], tbTourn)
+
+    reportRound(tbTourn, [(p1, p1, p2), (p4, p4, p3)])
+    reportRound(tbTourn, [(p1, p1, p4), (p3, p3, p2)])
+
+    # p3 and p4 both have 3 points, but p4's opponents scored more.
+    standings = playerStandings(tbTourn, tiebreakers=('buchholz',))
+    if [row[0] for row in standings] != [p1, p4, p3, p2]:
+        raise ValueError("Tiebreakers should order players on the same score.")
+    if dict((row[0], row[4]) for row in standings) != {p1: 3, p2: 9, p3: 3, p4: 9}:
+        raise ValueError("Buchholz should be the sum of opponents' scores.")
+    deleteThisTournament(tbTourn)
+
+    # the totals kept with each report match the query over every match, in a
+    # field with ties, byes, rematches, a three-player match and a playoff.
+    rng = random.Random(16)
+    bigTourn = addTournament("bigTourn")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Player {0}".format(n) for n in range(41)]), bigTourn)
+    for round_number in range(5):
+        results = []
+        for pairing in swissPairings(bigTourn):
+            players = [player for player in pairing[0::2] if player is not None]
+            if len(players) == 1:
+                results.append((players[0], players[0]))
+            else:
+                results.append((rng.choice(players + [0]),) + tuple(players))
+        if round_number % 2:
+            reportRound(bigTourn, results)
+        else:
+            for n, result in enumerate(results):
+                if len(result) == 2:
+                    reportBye(bigTourn, result[0])
+                else:
+                    reportMatch(bigTourn, *result, idempotency_key="{0}-{1}".format(
+                        round_number, n) if n % 2 else None)
+    reportMatch(bigTourn, ids[0], ids[0], ids[1])
+    tournament.PLAYERS_PER_MATCH = 3
+    try:
+        reportMatch(bigTourn, 0, ids[2], ids[3], ids[4])
+    finally:
+        tournament.PLAYERS_PER_MATCH = 2
+    expected = referenceStandings(bigTourn)
+    startBracket(bigTourn, 4)
+    reportBracketMatch(bigTourn, nextBracketMatches(bigTourn)[0][0])
+    standings = playerStandings(bigTourn, TIEBREAKERS)
+    if [row[0] for row in standings] != [row[0] for row in expected]:
+        raise ValueError("Tiebreakers should order players as the full query does.")
+    if standings != expected or referenceStandings(bigTourn) != expected:
+        raise ValueError("Tiebreakers should have the full query's values.")
+    with getStore().session() as c:
+        recomputeTiebreakers([bigTourn], c)
+    if playerStandings(bigTourn, TIEBREAKERS) != expected:
+        raise ValueError("Recomputed tiebreakers should match the reported ones.")
+    deleteThisTournament(bigTourn)
+    print "16. Tiebreakers order players on the same score."
+
+
+def testTournamentState():
+    deleteMatches()
+    deletePlayers()
+    stateTourn = addTournament("stateTourn")
+    [p1, p2, p3, p4] = registerPlayers(
+        ["Vraska", "Kaya", "Domri Rade", "Teferi"])
+    registerPlayersInTournament([p1, p2, p3, p4], stateTourn)
+
+    state = TournamentState(stateTourn)
+    if not state.isMember(p1) or state.isMember(-1):
+        raise ValueError("TournamentState should know who is registered.")
+    state.reportMatch(p2, p1, p2)
+    state.reportMatch(0, p3, p4)
+    if state.standings() != playerStandings(stateTourn):
+        raise ValueError("TournamentState standings should match the database.")
+    if state.pairings() != swissPairings(stateTourn):
+        raise ValueError("TournamentState pairings should match swissPairings.")
+    deleteThisTournament(stateTourn)
+    print "17. TournamentState serves standings and pairings from memory."
+
+
+def testValidation():
+    for badCall in (lambda: registerPlayer("x" * 31),
+                    lambda: registerPlayer("   "),
+                    lambda: countPlayersInTournament("not an id"),
+                    lambda: countPlayersInTournament(-1)):
+        try:
+            badCall()
+        except AssertionError:
+            pass
+        else:
+            raise ValueError("Malformed names and IDs should be rejected.")
+    print "18. Malformed names and IDs are rejected before reaching the database."
+
+
+def testNonBlocking():
+    deleteMatches()
+    deletePlayers()
+    asyncTourn = addTournament("asyncTourn")
+    ids = registerPlayers(["Player {0}".format(n) for n in range(8)])
+    registerPlayersInTournament(ids, asyncTourn)
+
+    # submit a whole round at once, then wait for every result.
+    pending = [tournament_async.reportMatch(asyncTourn, a, a, b)
+               for a, b in zip(ids[0::2], ids[1::2])]
+    for result in pending:
+        result.get()
+    standings = tournament_async.playerStandings(asyncTourn).get()
+    if standings != playerStandings(asyncTourn) or standings[0][3] != 1:
+        raise ValueError("Non-blocking calls should give the same results.")
+    tournament_async.close()
+    deleteThisTournament(asyncTourn)
+    print "19. Calls can be made without blocking."
+
+
+def testIdempotentReports():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Idempotent")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Ada", "Bo", "Cy", "Di"]), t_id)
+    match_id = reportMatch(t_id, ids[0], ids[0], ids[1], idempotency_key="table-1")
+    if reportMatch(t_id, ids[0], ids[0], ids[1], idempotency_key="table-1") != match_id:
+        raise ValueError("A retried report should return the first match's ID.")
+    try:
+        reportMatch(t_id, ids[1], ids[0], ids[1], idempotency_key="table-1")
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("Reusing a key for a different result should fail.")
+    round_ids = reportRound(t_id, [(ids[0], ids[0], ids[2]), (0, ids[1], ids[3])],
+                            idempotency_key="round-2")
+    if reportRound(t_id, [(ids[0], ids[0], ids[2]), (0, ids[1], ids[3])],
+                   idempotency_key="round-2") != round_ids:
+        raise ValueError("A retried round should return the first round's IDs.")
+    standings = playerStandings(t_id)
+    if sorted(row[3] for row in standings) != [1, 1, 2, 2]:
+        raise ValueError("Retried reports should not be counted twice.")
+    print "20. Retried reports with an idempotency key are recorded once."
+
+
+def testRounds():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Rounds")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Ada", "Bo", "Cy", "Di", "Ed"]), t_id)
+    if currentRound(t_id) is not None:
+        raise ValueError("No round should be started yet.")
+    pairings = startRound(t_id)
+    if currentRound(t_id) != (1, 0, 3, False):
+        raise ValueError("A started round should have 3 tables and no results.")
+    (a, _, b, _), (c, _, d, _), (bye, _, _, _) = pairings
+    for args in ((a, a, c), (a, a, bye)):
+        try:
+            reportMatch(t_id, *args)
+        except AssertionError:
+            pass
+        else:
+            raise ValueError("Players who were not paired should not be reported.")
+    try:
+        reportBye(t_id, a)
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("A paired player should not be given a bye.")
+    try:
+        closeRound(t_id)
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("An incomplete round should not close.")
+    reportMatch(t_id, a, a, b)
+    try:
+        reportMatch(t_id, b, a, b)
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("A table should only be reported once.")
+    try:
+        startRound(t_id)
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("A round should not start while another is open.")
+    reportRound(t_id, [(0, c, d), (bye, bye)])
+    if currentRound(t_id) != (1, 3, 3, False):
+        raise ValueError("Every table of the round should be counted as reported.")
+    if closeRound(t_id) != 1 or currentRound(t_id)[3] is not True:
+        raise ValueError("A complete round should close.")
+    startRound(t_id)
+    if currentRound(t_id)[:3] != (2, 0, 3):
+        raise ValueError("The next round should be numbered 2.")
+    print "21. Results are checked against the pairings of a started round."
+
+
+def testCache():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    cache = getCache()
+    # this process is the only writer, so caching is safe on any store.
+    store = getStore()
+    cacheReads, store.cacheReads = store.cacheReads, True
+    try:
+        t_id = addTournament("Cached")
+        ids = registerPlayersInTournament(registerPlayers(
+            ["Ada", "Bo", "Cy", "Di"]), t_id)
+        misses = cache.misses
+        standings = playerStandings(t_id)
+        hits = cache.hits
+        if playerStandings(t_id) != standings or cache.hits != hits + 1:
+            raise ValueError("Repeated standings should be answered from the cache.")
+        swissPairings(t_id)
+        swissPairings(t_id)
+        if cache.hits != hits + 2 or cache.misses != misses + 2:
+            raise ValueError("Repeated pairings should be answered from the cache.")
+        reportMatch(t_id, ids[0], ids[0], ids[1])
+        if playerStandings(t_id)[0][2] != 3 or cache.misses != misses + 3:
+            raise ValueError("Reporting a match should invalidate the cache.")
+        previous = setCache(ResultCache(maxsize=1))
+        try:
+            other = addTournament("Evicts")
+            playerStandings(t_id)
+            playerStandings(other)
+            playerStandings(t_id)
+            if getCache().hits != 0 or len(getCache()) != 1:
+                raise ValueError("The least recently used tournament should be evicted.")
+        finally:
+            setCache(previous)
+    finally:
+        store.cacheReads = cacheReads
+
+    # a database file can be written by other processes, so reads from it
+    # are not cached unless asked for.
+    path = tempfile.mktemp(suffix=".db")
+    first, second = SQLiteStore(path), SQLiteStore(path)
+    previous = setStore(first)
+    try:
+        t_id = addTournament("Shared")
+        player = registerPlayers(["Ada"])[0]
+        registerPlayerInTournament(player, t_id)
+        playerStandings(t_id)
+        with second.session() as c:
+            c.execute("UPDATE tournament_players SET p_t_score = 3"
+                      " WHERE tournament_id = %s;", (t_id,))
+        if playerStandings(t_id)[0][2] != 3:
+            raise ValueError("Writes by another store should be seen at once.")
+    finally:
+        setStore(previous)
+        first.close()
+        second.close()
+        os.remove(path)
+    print "22. Standings and pairings are cached until the tournament changes."
+
+
+def testExport():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    first = addTournament("Exported")
+    ids = registerPlayersInTournament(registerPlayers(["Ada", "Bo"]), first)
+    reportMatch(first, ids[0], ids[0], ids[1])
+    startBracket(first, 2)
+    reportBracketMatch(first, ids[1])
+    second = addTournament("Not exported")
+    registerPlayersInTournament(registerPlayers(["Cy", "Di"]), second)
+    out = StringIO()
+    if tournament_io.exportTable("players", out, "csv", first, first) != 2:
+        raise ValueError("Only players in the tournament range should be exported.")
+    if out.getvalue().splitlines() != [
+            "player_id,p_name", "{0},Ada".format(ids[0]), "{0},Bo".format(ids[1])]:
+        raise ValueError("Players should be exported as CSV with a header.")
+    out = StringIO()
+    tournament_io.exportTable("matches", out, "jsonl", lastTournament=first)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    if len(rows) != 2 or rows[0]["winner_id"] != ids[0] or rows[0]["is_bye"]:
+        raise ValueError("Matches should be exported as JSON Lines.")
+    if rows[0]["is_playoff"] is not False or rows[1]["is_playoff"] is not True:
+        raise ValueError("Playoff matches should be told apart in the export.")
+    if len(list(tournament_io.iterRows("tournament_players"))) != 4:
+        raise ValueError("Every registration should be exported without a range.")
+    print "23. Tables can be exported as CSV or JSON Lines."
+
+
+def testImport():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournaments = StringIO("tournament,description\nT1,Archived\nT1,Again\n")
+    players = StringIO("player,name\n"
+                       + "".join("p{0},Player {0}\n".format(n) for n in range(5))
+                       + "p9,\np8,Bad \xff\xfe bytes\n")
+    enrollments = StringIO("tournament,player\n"
+                           + "".join("T1,p{0}\n".format(n) for n in range(5))
+                           + "T2,p0\nT1,p9\n")
+    matches = StringIO("tournament,winner,player1,player2\n"
+                       "T1,p0,p0,p1\nT1,,p2,p3\nT1,p4,p4,\n"
+                       "T1,p3,p0,p1\nT1,p0,p0,p9\n")
+    imported, rejects = tournament_io.importData(tournaments, players,
+                                                 enrollments, matches)
+    if imported != {'tournaments': 1, 'players': 5, 'enrollments': 5, 'matches': 3}:
+        raise ValueError("Valid rows should be imported.")
+    if [(kind, line) for kind, line, reason in rejects] != [
+            ('tournaments', 2), ('players', 6), ('players', 7), ('enrollments', 6),
+            ('enrollments', 7), ('matches', 4), ('matches', 5)]:
+        raise ValueError("Invalid rows should be reported with their line numbers.")
+    if rejects[2][2] != "Invalid UTF-8.":
+        raise ValueError("Undecodable rows should be rejected, not end the import.")
+    t_id = list(tournament_io.iterRows("tournaments"))[-1][0]
+    scores = dict((row[1], (row[2], row[3])) for row in playerStandings(t_id))
+    if scores != {"Player 0": (3, 1), "Player 1": (0, 1), "Player 2": (1, 1),
+                  "Player 3": (1, 1), "Player 4": (3, 1)}:
+        raise ValueError("Scores should be computed from the imported matches.")
+    if playerStandings(t_id, TIEBREAKERS) != referenceStandings(t_id):
+        raise ValueError("Tiebreakers should be computed from the imported matches.")
+    if reportMatch(t_id, 0, *[row[0] for row in playerStandings(t_id)[:2]]) is None:
+        raise ValueError("Imported tournaments should accept new results.")
+    print "24. Tournaments can be imported from files, skipping bad rows."
+
+
+def testInstrumentation():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Profiled")
+    ids = registerPlayersInTournament(registerPlayers(["Ada", "Bo"]), t_id)
+    events = []
+
+    def record(event, details):
+        events.append((event, details))
+
+    profiler = Profiler()
+    addHook(profiler)
+    addHook(record)
+    try:
+        reportMatch(t_id, ids[0], ids[0], ids[1])
+        standings = playerStandings(t_id)
+    finally:
+        removeHook(profiler)
+        removeHook(record)
+    summary = profiler.summary()
+    if summary["reportMatch"]["calls"] != 1 or summary["reportMatch"]["connections"] != 1:
+        raise ValueError("Calls should be counted with the connections they take.")
+    if summary["reportMatch"]["statements"] != sum(
+            1 for event, details in events
+            if event == 'statement' and details['call'] in
+            ("reportMatch", "checkPlayersInTournament")):
+        raise ValueError("Statements should be counted for the call running them.")
+    if summary["playerStandings"]["rows"] != len(standings):
+        raise ValueError("Rows fetched should be counted.")
+    if "reportMatch" not in profiler.report():
+        raise ValueError("The report should list the calls made.")
+    print "25. Calls can be profiled through hooks."
+
+
+def testConstraintErrors():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Constrained")
+    ids = registerPlayers(["Ada", "Bo", "Cy"])
+    profiler = Profiler()
+    addHook(profiler)
+    try:
+        registerPlayerInTournament(ids[0], t_id)
+        registerPlayersInTournament(ids[1:], t_id)
+        reportMatch(t_id, ids[0], ids[0], ids[1])
+    finally:
+        removeHook(profiler)
+    summary = profiler.summary()
+    if (summary["registerPlayerInTournament"]["statements"] != 1 or
+            summary["registerPlayersInTournament"]["statements"] != 1):
+        raise ValueError("Registering should be a single statement.")
+    # the pairing check, the match, its players, their opponents, their
+    # scores and their ratings.
+    if summary["reportMatch"]["statements"] != 7:
+        raise ValueError("Reporting should not look the players up first.")
+
+    other = registerPlayer("Di")
+    for badCall, message in (
+            (lambda: registerPlayerInTournament(ids[0], t_id + 1), "Invalid tournament ID"),
+            (lambda: registerPlayerInTournament(other + 1, t_id), "No such player ID registered."),
+            (lambda: registerPlayerInTournament(ids[0], t_id), "Player already registered."),
+            (lambda: registerPlayersInTournament([other, ids[1]], t_id),
+             "Player already registered: [{0}]".format(ids[1])),
+            (lambda: reportMatch(t_id, other, other, ids[2]), "Winner not a tournament player"),
+            (lambda: reportMatch(t_id + 1, 0, ids[0], ids[1]),
+             "Player ID {0} not in tournament.".format(ids[0])),
+            (lambda: reportBye(t_id, other), "Player ID {0} not in tournament.".format(other)),
+            (lambda: reportRound(t_id + 1, [(ids[2], ids[2])]), "Invalid tournament ID"),
+            (lambda: deleteThisTournament(t_id + 1), "Invalid tournament ID")):
+        try:
+            badCall()
+        except AssertionError as e:
+            if str(e) != message:
+                raise ValueError("Expected error {0!r}, got {1!r}.".format(message, str(e)))
+        else:
+            raise ValueError("Expected error {0!r}.".format(message))
+    if countPlayersInTournament(t_id) != 3 or len(playerStandings(t_id)[0]) != 4:
+        raise ValueError("Rejected writes should leave nothing behind.")
+    # inside a caller's transaction, only the failed call's writes are undone.
+    with session():
+        try:
+            registerPlayersInTournament([other, ids[1]], t_id)
+        except AssertionError:
+            pass
+        registerPlayerInTournament(other, t_id)
+    if countPlayersInTournament(t_id) != 4:
+        raise ValueError("A caught error should not spoil the caller's transaction.")
+
+    # two reports of a table racing: both pass the pairing check, and the
+    # second one to write should get the same error as a late resubmission.
+    deleteMatchesInTournament(t_id)
+    pairings = startRound(t_id)
+    table = (pairings[0][0], pairings[0][0], pairings[0][2])
+    with session() as c:
+        checked = tournament._checkPairings(c, t_id, [(table[0], table[1:])])
+    reportMatch(t_id, *table)
+    checkPairings = tournament._checkPairings
+    calls = []
+    def raced(*args):
+        calls.append(args)
+        return checked if len(calls) == 1 else checkPairings(*args)
+    tournament._checkPairings = raced
+    try:
+        reportMatch(t_id, *table)
+    except AssertionError as e:
+        if str(e) != "Table 1 of round 1 was already reported.":
+            raise ValueError("A raced table should be reported as already reported.")
+    else:
+        raise ValueError("A raced table should be rejected.")
+    finally:
+        tournament._checkPairings = checkPairings
+    print "26. Constraints replace existence checks, with the same errors."
+
+
+def testPods():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Pods")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Player {0}".format(n) for n in range(10)]), t_id)
+    met = set()
+    tournament.PLAYERS_PER_MATCH = 4
+    try:
+        for n in range(2):
+            pairings = startRound(t_id)
+            if pairings != TournamentState(t_id).pairings():
+                raise ValueError("Pods should be the same when paired in memory.")
+            tables = [pairing[0::2] for pairing in pairings]
+            if (sorted(map(len, tables), reverse=True) != [4, 3, 3] or
+                    sorted(sum(tables, ())) != sorted(ids)):
+                raise ValueError("10 players should sit at tables of 4, 3 and 3.")
+            pairs = set((a, b) for table in tables for a in table for b in table if a < b)
+            # with only three tables before, one rematch at the table of 4 is unavoidable.
+            if n and len(pairs & met) != 1:
+                raise ValueError("Pods should repeat as few opponents as possible.")
+            met |= pairs
+            reportRound(t_id, [(table[0],) + table for table in tables])
+            closeRound(t_id)
+        try:
+            reportMatch(t_id, ids[0], *ids[:5])
+        except AssertionError:
+            pass
+        else:
+            raise ValueError("A match should not have more than PLAYERS_PER_MATCH players.")
+    finally:
+        tournament.PLAYERS_PER_MATCH = 2
+    if playerStandings(t_id)[0][3] != 2:
+        raise ValueError("Each player should have played two matches.")
+    print "27. Players can be seated in pods of more than two."
+
+
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Rated")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Ada", "Bo", "Cy", "Di", "Ed"]), t_id)
+    reportMatch(t_id, ids[0], ids[0], ids[1])
+    reportBye(t_id, ids[4])
+    ratings = dict((row[0], row[2:]) for row in playerRatings(t_id))
+    if ratings[ids[0]] != (1516.0, 1) or ratings[ids[1]] != (1484.0, 1):
+        raise ValueError("A win between equals should move ratings by half the K factor.")
+    if ratings[ids[4]] != (INITIAL_RATING, 0):
+        raise ValueError("Byes should not be rated.")
+
+    # ratings carry over into other tournaments.
+    other = addTournament("Rated again")
+    registerPlayersInTournament(ids[:4], other)
+    reportRound(other, [(0, ids[0], ids[2]), (ids[3], ids[1], ids[3])])
+    reportMatch(other, ids[0], ids[0], ids[3])
+    reported = playerRatings()
+    if reported[0][0] != ids[0] or reported[0][3] != 3:
+        raise ValueError("Ratings should be updated across tournaments.")
+
+    # replaying the history, with or without numpy, gives the same ratings.
+    for vectorized in (False, True):
+        if vectorized and tournament.numpy is None:
+            continue
+        saved = tournament.numpy
+        if not vectorized:
+            tournament.numpy = None
+        try:
+            recomputeRatings()
+        finally:
+            tournament.numpy = saved
+        replayed = playerRatings()
+        if len(replayed) != len(reported) or any(
+                a[:2] + a[3:] != b[:2] + b[3:] or abs(a[2] - b[2]) > 1e-9
+                for a, b in zip(replayed, reported)):
+            raise ValueError("Recomputed ratings should match the reported ones.")
+
+    # round one seeded by rating: the top half plays the bottom half.
+    seededTourn = addTournament("Seeded")
+    order = [row[0] for row in reported if row[0] in ids[:4]]
+    registerPlayersInTournament(ids[:4], seededTourn)
+    pairings = swissPairings(seededTourn, seeded=True)
+    if [(p[0], p[2]) for p in pairings] != [(order[0], order[2]), (order[1], order[3])]:
+        raise ValueError("Round one should be seeded by rating.")
+
+    # a K factor of 0 freezes ratings, live and replayed, but still counts matches.
+    saved = tournament.RATING_K_FACTOR
+    tournament.RATING_K_FACTOR = 0
+    try:
+        reportMatch(other, ids[2], ids[2], ids[3])
+        frozen = dict((row[0], row[2:]) for row in playerRatings())
+        before = dict((row[0], row[2:]) for row in reported)
+        if frozen[ids[2]] != (before[ids[2]][0], before[ids[2]][1] + 1):
+            raise ValueError("A K factor of 0 should count the match but keep the rating.")
+        recomputeRatings()
+        replayed = dict((row[0], row[2:]) for row in playerRatings())
+        if any(replayed[p] != (INITIAL_RATING, frozen[p][1]) for p in frozen):
+            raise ValueError("Replaying with a K factor of 0 should count matches the same way.")
+    finally:
+        tournament.RATING_K_FACTOR = saved
+    print "28. Ratings are kept up to date across tournaments."
+
+
+def testProjection():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Projected")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Player {0}".format(n) for n in range(8)]), t_id)
+    reportRound(t_id, [(a, a, b) for a, b in zip(ids[0::2], ids[1::2])])
+    if tournament_projection.numpy is None:
+        try:
+            tournament_projection.projectStandings(t_id)
+        except ImportError:
+            print "29. Projections need numpy (not installed)."
+            return
+        raise ValueError("Projections should fail clearly without numpy.")
+
+    projection = tournament_projection.projectStandings(
+        t_id, rounds=2, cuts=(1, 4), simulations=2000, seed=3)
+    if [row[0] for row in projection] != [row[0] for row in playerStandings(t_id)]:
+        raise ValueError("Projections should be in standings order.")
+    if any(len(row[3]) != 3 or abs(sum(row[3]) - 1) > 1e-9 for row in projection):
+        raise ValueError("Each player should have one chance per band, adding up to 1.")
+    winners = sum(row[3][0] + row[3][1] for row in projection if row[2] > 0)
+    if winners <= sum(row[3][0] + row[3][1] for row in projection if row[2] == 0):
+        raise ValueError("Players ahead should be likelier to make the cut.")
+    if projection != tournament_projection.projectStandings(
+            t_id, rounds=2, cuts=(1, 4), simulations=2000, seed=3, processes=2):
+        raise ValueError("A seeded projection should not depend on the processes used.")
+    final = tournament_projection.projectStandings(t_id, rounds=0, cuts=(4,), simulations=100)
+    if any(row[3][0] != (1.0 if row[2] > 0 else 0.0) for row in final):
+        raise ValueError("With no rounds left, the top 4 on points should be certain.")
+    print "29. Final standings can be projected by simulation."
+
+
+def testBracket():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Playoff")
+    ids = registerPlayersInTournament(registerPlayers(
+        ["Player {0}".format(n) for n in range(10)]), t_id)
+    # after two rounds, ids[0] leads alone and ids[9] trails.
+    reportRound(t_id, [(a, a, b) for a, b in zip(ids[0::2], ids[1::2])])
+    reportRound(t_id, [(ids[0], ids[0], ids[2]), (ids[4], ids[4], ids[6]),
+                       (ids[1], ids[1], ids[3]), (ids[5], ids[5], ids[7]),
+                       (0, ids[8], ids[9])])
+    seeds = [row[0] for row in playerStandings(t_id, BRACKET_TIEBREAKERS)]
+    swiss = playerStandings(t_id, TIEBREAKERS)
+
+    first = startBracket(t_id, 4)
+    if [(p[0], p[2]) for p in first] != [(seeds[0], seeds[3]), (seeds[1], seeds[2])]:
+        raise ValueError("Seed 1 should play seed 4, and seed 2 seed 3.")
+    if nextBracketMatches(t_id) != first:
+        raise ValueError("The first round should be ready to play.")
+    for badCall in (lambda: startBracket(t_id, 4), lambda: startBracket(t_id, 3),
+                    lambda: reportBracketMatch(t_id, seeds[5])):
+        try:
+            badCall()
+        except AssertionError:
+            pass
+        else:
+            raise ValueError("Bad bracket calls should be rejected.")
+
+    reportBracketMatch(t_id, seeds[3])
+    try:
+        reportBracketMatch(t_id, seeds[3])
+    except AssertionError:
+        pass
+    else:
+        raise ValueError("A finalist should wait for their opponent.")
+    reportBracketMatch(t_id, seeds[1])
+    if [(p[0], p[2]) for p in nextBracketMatches(t_id)] != [(seeds[1], seeds[3])]:
+        raise ValueError("Winners should advance to the final.")
+    match_id = reportBracketMatch(t_id, seeds[1])
+    bracket = bracketState(t_id)
+    if [row[:2] for row in bracket] != [(1, 1), (1, 2), (2, 1)] or bracket[-1][-1] != seeds[1]:
+        raise ValueError("The bracket should show every result.")
+    if nextBracketMatches(t_id) or match_id not in [
+            row[0] for row in tournament_io.iterRows('matches', t_id, t_id)]:
+        raise ValueError("Playoff results should be recorded as matches.")
+    if playerStandings(t_id, TIEBREAKERS) != swiss:
+        raise ValueError("Playoff results should leave the Swiss standings alone.")
+    try:
+        startRound(t_id)
+    except AssertionError as e:
+        if str(e) != "Tournament {0} has gone on to its playoff.".format(t_id):
+            raise
+    else:
+        raise ValueError("No Swiss round should start after the playoff.")
+    print "30. Top players can play off in a single-elimination bracket."
+
+
+def testChangeFeed():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t_id = addTournament("Followed")
+    other = addTournament("Not followed")
+    events = []
+    subscribe(events.append, t_id)
+    try:
+        ids = registerPlayersInTournament(registerPlayers(
+            ["Player {0}".format(n) for n in range(5)]), t_id)
+        registerPlayersInTournament([ids[0]], other)
+        if [(e['kind'], e['players']) for e in events] != [
+                ('enrollment', [[player, 0, 0] for player in ids])]:
+            raise ValueError("Enrollment should be published for its tournament only.")
+
+        standings = playerStandings(t_id)
+        pairings = startRound(t_id)
+        if events[-1]['tables'] != [[p for p in pairing[0::2] if p is not None]
+                                    for pairing in pairings]:
+            raise ValueError("A new round should publish its pairings.")
+        try:
+            with session():
+                reportMatch(t_id, pairings[0][0], pairings[0][0], pairings[0][2])
+                raise RuntimeError("rolled back")
+        except RuntimeError:
+            pass
+        if events[-1]['kind'] != 'round':
+            raise ValueError("Nothing should be published for a rollback.")
+
+        for pairing in pairings[:-1]:
+            reportMatch(t_id, pairing[2], pairing[0], pairing[2])
+        reportBye(t_id, pairings[-1][0])
+        for event in events[2:]:
+            standings = applyChanges(standings, event)
+        if standings != playerStandings(t_id):
+            raise ValueError("Results should carry the players' new totals.")
+
+        deleteMatchesInTournament(t_id)
+        if events[-1]['kind'] != 'reset' or applyChanges(standings, events[-1]) is not None:
+            raise ValueError("Deleting matches should ask for a fresh read.")
+    finally:
+        unsubscribe(events.append, t_id)
+
+    # long events are split to fit NOTIFY, players and all.
+    event = {'tournament_id': t_id, 'kind': 'results',
+             'players': [[n, 3, 1] for n in range(2000)]}
+    payloads = tournament._notifyPayloads(event)
+    if (len(payloads) < 2 or max(len(p) for p in payloads) > NOTIFY_MAX_PAYLOAD or
+            sum((json.loads(p)['players'] for p in payloads), []) != event['players']):
+        raise ValueError("Long events should be split into short ones.")
+    print "31. Changes are published to subscribers as they commit."
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -189,6 +1041,26 @@ if __name__ == '__main__':
     # Added tests.
     testCheckTournament(testTourn, c)
     testDeleteTournaments(testTourn, c)
+    testBulkRegister()
+    testReportRound()
+    testNoRematches()
+    testByes()
+    testTiebreakers()
+    testTournamentState()
+    testValidation()
+    testNonBlocking()
+    testIdempotentReports()
+    testRounds()
+    testCache()
+    testExport()
+    testImport()
+    testInstrumentation()
+    testConstraintErrors()
+    testPods()
+    testRatings()
+    testProjection()
+    testBracket()
+    testChangeFeed()
     print "Success!  All tests pass!"
 
 